@@ -1,6 +1,9 @@
 """
 This version uses a thread-safe queue to communicate between the native
 hardware threads and the eventlet-based web server thread, preventing deadlocks.
+Hardware, BLE and WiFi modules are imported lazily so the web server comes up
+while the hardware is still being brought online, and optional subsystems
+are not imported at all while they are switched off (see features.py).
 """
 import time
 import atexit
@@ -8,78 +11,131 @@ import queue
 from flask import Flask
 import threading
 
-from .extensions import socketio
-from .database import init_db, init_db_defaults
-from .hardware import system_startup, cleanup_resources, get_live_io_status, state as hardware_state
-from .system import get_system_health_info, get_consolidated_network_info
+class LatestQueue(queue.Queue):
+    """A thread-safe queue that only holds the newest item: put() replaces an item nobody has taken yet."""
+    def _put(self, item):
+        self.queue.clear()
+        self.queue.append(item)
 
 # --- THE FIX: Create a thread-safe queue for status updates ---
-status_queue = queue.Queue()
+# Defined before any submodule import: hardware.py imports it from this package.
+# Each snapshot is the whole state, so a consumer that falls behind only needs
+# the newest one; intermediate snapshots are dropped instead of piling up.
+status_queue = LatestQueue()
+
+from . import startup
+from .extensions import socketio
+from .database import init_db, init_db_defaults
 
 tasks_started = False
 
 def status_broadcaster():
-    """This is a GREEN thread. It safely consumes from the queue and emits to clients."""
+    """This is a GREEN thread. It safely consumes from the queue, emits to 'status' subscribers and versions /api/status."""
+    from .topics import emit_topic
+    from . import hardware, status_feed, watchdog
     print("[Broadcaster] Starting status broadcaster green thread...")
+    watchdog.register('status-broadcaster', stall_after=5, critical=True)
     while True:
+        watchdog.beat('status-broadcaster')
         try:
-            status_data = status_queue.get()
-            socketio.emit('status_update', status_data)
+            # The timeout lets the loop heartbeat while the line is idle.
+            snapshot = status_queue.get(timeout=1)
+            status_feed.publish(snapshot)
+            emit_topic('status', hardware.status_dict(snapshot))
+        except queue.Empty:
+            continue
         except Exception as e:
             print(f"[ERROR in status_broadcaster]: {e}")
         socketio.sleep(0.01)
 
-def diagnostics_broadcaster():
-    """This is a GREEN thread for less frequent updates."""
-    print("[Broadcaster] Starting diagnostics broadcaster green thread...")
-    while True:
-        try:
-            socketio.emit('health_update', get_system_health_info())
-            socketio.emit('pin_update', get_live_io_status())
-            broadcast_top_bar_data()
-        except Exception as e:
-            print(f"[ERROR in diagnostics_broadcaster]: {e}")
-        socketio.sleep(5)
+def ble_manager_thread():
+    """Imports bleak inside the thread so it never delays startup."""
+    from .ble import connection_manager_loop
+    connection_manager_loop()
 
-def broadcast_top_bar_data():
-    network_info = get_consolidated_network_info()
-    top_bar_data = {
-        "internet_active": network_info["has_internet"], "ip_address": network_info["ip_address"],
-        "eth_active": network_info["is_ethernet"], "wifi_active": network_info["is_wifi"],
-        "wifi_strength": network_info["wifi_strength"], "wifi_ssid": network_info["wifi_ssid"],
-    }
-    socketio.emit('top_bar_update', top_bar_data)
+def start_line_tasks():
+    """Starts the threads that belong with the line: printer, analytics and the MES uplink."""
+    # The BLE manager keeps the printer connected and drains the print queue
+    from . import features
+    if features.is_enabled('ble'):
+        threading.Thread(target=ble_manager_thread, daemon=True).start()
+    # Production counters are folded into the hourly aggregate table in the background
+    from . import analytics
+    analytics.start_tracking()
+    threading.Thread(target=analytics.flush_loop, daemon=True, name='analytics-flush').start()
+    atexit.register(analytics.flush)
+    # Count and batch events are forwarded to the MES through a durable outbox
+    from . import uplink
+    threading.Thread(target=uplink.uplink_loop, daemon=True, name='uplink').start()
 
-def create_app():
+def create_app(mode='device', fleet_devices=()):
+    """
+    mode='device' runs the counting line on this Pi. mode='web' serves the
+    same UI while the line runs in the separate counting daemon (counterd.py).
+    mode='fleet' runs the aggregator dashboard for many devices instead
+    (see fleet_run.py).
+    """
     global tasks_started
     print("[App Factory] Creating Flask application instance...")
     app = Flask(__name__)
     app.config['SECRET_KEY'] = 'your-very-secret-key!'
-    socketio.init_app(app, async_mode='eventlet')
+    # Kiosk navigation swaps views client-side over one socket (see static/js/kiosk-shell.js)
+    app.config['SPA_MODE'] = True
+    # Long-polling clients get gzip/deflate above the threshold; websocket clients negotiate
+    # permessage-deflate with eventlet's websocket server, which then compresses every frame.
+    socketio.init_app(app, async_mode='eventlet', http_compression=True, compression_threshold=1024)
     
     with app.app_context():
         init_db()
         init_db_defaults()
+    startup.mark('database_ready')
+
+    if mode == 'fleet':
+        from . import fleet
+        fleet.init_app(app, fleet_devices)
+        return app
+
+    from . import features
+    features.load()
+    from .hardware import system_startup, cleanup_resources
+    if mode == 'web':
+        from . import counter_link
+        counter_link.link['enabled'] = True
+    elif not tasks_started:
+        # Start the hardware logic in a NATIVE OS thread first, so GPIO and Modbus
+        # bring-up overlaps with building assets and registering routes below.
+        threading.Thread(target=system_startup, daemon=True, name='hardware-startup').start()
 
+    from . import assets
+    assets.init_app(app)
+    startup.mark('assets_built')
     from .routes import main_bp
     app.register_blueprint(main_bp)
     print("[App Factory] Main blueprint registered successfully.")
+    from . import topics
 
     if not tasks_started:
         print("[App Factory] Starting background tasks...")
-        # Start the hardware logic in a NATIVE OS thread
-        threading.Thread(target=system_startup, daemon=True).start()
+        if mode == 'web':
+            # The daemon runs the line; status arrives through shared memory
+            socketio.start_background_task(target=counter_link.mirror_loop)
+        else:
+            start_line_tasks()
         # Start the queue consumers in GREEN threads managed by socketio
         socketio.start_background_task(target=status_broadcaster)
-        socketio.start_background_task(target=diagnostics_broadcaster)
+        # Health, pins, network and top bar data are only computed for subscribed pages
+        socketio.start_background_task(target=topics.topic_broadcaster)
+        # Notices stalled loops and pets the systemd watchdog while they are healthy
+        from . import watchdog
+        watchdog.start_supervisor()
         tasks_started = True
         print("[App Factory] All background tasks started.")
 
-    atexit.register(cleanup_resources)
+    if mode != 'web': atexit.register(cleanup_resources)
+    startup.mark('app_created')
     return app
 
 @socketio.on('connect')
 def handle_connect():
+    # The full state is sent when the client subscribes to the 'status' topic.
     print('[SocketIO] Client connected.')
-    with hardware_state['lock']:
-        status_queue.put({k: v for k, v in hardware_state.items() if k != 'lock'})
\ No newline at end of file
@@ -0,0 +1,311 @@
+"""
+Production analytics: throughput per hour and per shift, batch fill time and
+gate-closed downtime.
+
+The counting code only bumps in-memory counters (record_box, record_batch,
+record_gate). A background thread folds those deltas into the hourly
+aggregate table every FLUSH_INTERVAL seconds, so dashboard queries read at
+most a few thousand pre-aggregated rows and never scan raw events. Queries
+only read: the deltas not yet flushed are added to the rows in memory. The
+same flush appends the buffered raw box/batch events to production_events,
+which is only read by the export endpoints.
+"""
+import json
+import threading
+import time
+from collections import deque
+
+from . import database, watchdog
+
+FLUSH_INTERVAL = 30
+# Minute buckets kept in memory for the "last hour" rolling throughput.
+ROLLING_WINDOW_MINUTES = 60
+# Raw events kept in memory between flushes; the oldest are dropped if the database stays unavailable.
+MAX_BUFFERED_EVENTS = 20000
+DEFAULT_SHIFTS = [
+    {"name": "A", "start": 6, "end": 14},
+    {"name": "B", "start": 14, "end": 22},
+    {"name": "C", "start": 22, "end": 6},
+]
+
+lock = threading.Lock()
+# Held while a flush moves deltas from `pending` into the table, so a query never sees them twice or not at all.
+flush_lock = threading.Lock()
+# hour_start -> {"boxes", "batches", "batch_fill_seconds", "gate_closed_seconds"} not yet flushed
+pending = {}
+recent_minutes = deque(maxlen=ROLLING_WINDOW_MINUTES)
+# (ts, event, batch_number, count) rows waiting for production_events
+pending_events = deque(maxlen=MAX_BUFFERED_EVENTS)
+# Only the process running the line tracks the gate (start_tracking); the web process of the split install never does.
+tracker = {"gate_closed_since": None, "batch_started_at": None}
+# Raw events lost because the database stayed unavailable for longer than the buffer holds.
+stats = {"dropped_events": 0}
+
+
+def _local_hour_start(ts):
+    lt = time.localtime(ts)
+    return int(ts) - lt.tm_min * 60 - lt.tm_sec
+
+
+def _bucket(hour_start):
+    bucket = pending.get(hour_start)
+    if bucket is None:
+        bucket = pending[hour_start] = {"boxes": 0, "batches": 0, "batch_fill_seconds": 0.0, "gate_closed_seconds": 0.0}
+    return bucket
+
+
+def _closed_segments(start, end):
+    """Splits the closed interval [start, end) at hour boundaries; yields (hour_start, seconds)."""
+    while start < end:
+        hour_start = _local_hour_start(start)
+        segment_end = min(hour_start + 3600, end)
+        yield hour_start, segment_end - start
+        start = segment_end
+
+
+def _accrue_gate_closed(now):
+    """Adds the closed time since the last accrual, split across hour boundaries. Caller holds `lock`."""
+    start = tracker['gate_closed_since']
+    if start is None:
+        return
+    for hour_start, seconds in _closed_segments(start, now):
+        _bucket(hour_start)['gate_closed_seconds'] += seconds
+    tracker['gate_closed_since'] = now
+
+
+def _unflushed(now):
+    """Copies of the pending deltas, including the gate's current closed spell, without touching them."""
+    with lock:
+        deltas = {hour_start: dict(bucket) for hour_start, bucket in pending.items()}
+        start = tracker['gate_closed_since']
+    if start is not None:
+        for hour_start, seconds in _closed_segments(start, now):
+            deltas.setdefault(hour_start, {"boxes": 0, "batches": 0, "batch_fill_seconds": 0.0, "gate_closed_seconds": 0.0})
+            deltas[hour_start]['gate_closed_seconds'] += seconds
+    return deltas
+
+
+def start_tracking():
+    """Called once where the line runs: the gate is closed from startup until the line opens it."""
+    with lock:
+        if tracker['gate_closed_since'] is None and tracker['batch_started_at'] is None:
+            tracker['gate_closed_since'] = time.time()
+
+
+# --- Recording hooks (called from the counting code; must stay cheap) ---
+
+def record_box(batch_number=None, count=None, ts=None):
+    ts = ts or time.time()
+    minute = int(ts // 60)
+    with lock:
+        _bucket(_local_hour_start(ts))['boxes'] += 1
+        pending_events.append((ts, 'box', batch_number, count))
+        if recent_minutes and recent_minutes[-1][0] == minute:
+            recent_minutes[-1][1] += 1
+        else:
+            recent_minutes.append([minute, 1])
+
+
+def record_batch(batch_number=None, count=None, ts=None):
+    ts = ts or time.time()
+    with lock:
+        bucket = _bucket(_local_hour_start(ts))
+        bucket['batches'] += 1
+        pending_events.append((ts, 'batch', batch_number, count))
+        if tracker['batch_started_at'] is not None:
+            bucket['batch_fill_seconds'] += ts - tracker['batch_started_at']
+        tracker['batch_started_at'] = None
+
+
+def record_gate(closed, ts=None):
+    ts = ts or time.time()
+    with lock:
+        if closed:
+            if tracker['gate_closed_since'] is None:
+                tracker['gate_closed_since'] = ts
+        else:
+            _accrue_gate_closed(ts)
+            tracker['gate_closed_since'] = None
+            # A batch starts filling when the gate opens.
+            tracker['batch_started_at'] = ts
+
+
+# --- Shifts ---
+
+def get_shifts():
+    try:
+        return json.loads(database.get_setting('shifts') or 'null') or DEFAULT_SHIFTS
+    except ValueError:
+        return DEFAULT_SHIFTS
+
+
+def shift_for(hour_start, shifts):
+    """Returns (shift name, shift date) for an hour. Night shifts belong to the day they started."""
+    lt = time.localtime(hour_start)
+    for shift in shifts:
+        start, end = shift['start'], shift['end']
+        if start < end and start <= lt.tm_hour < end:
+            return shift['name'], time.strftime('%Y-%m-%d', lt)
+        if start > end and (lt.tm_hour >= start or lt.tm_hour < end):
+            day = hour_start - 86400 if lt.tm_hour < end else hour_start
+            return shift['name'], time.strftime('%Y-%m-%d', time.localtime(day))
+    return '-', time.strftime('%Y-%m-%d', lt)
+
+
+# --- Flushing ---
+
+def flush():
+    """Folds the pending deltas into production_hourly and appends the raw events, in one transaction."""
+    with flush_lock:
+        _flush()
+
+
+def _flush():
+    with lock:
+        _accrue_gate_closed(time.time())
+        deltas = dict(pending)
+        pending.clear()
+        events = list(pending_events)
+        pending_events.clear()
+    if not deltas and not events:
+        return
+    conn = None
+    try:
+        shifts = get_shifts()
+        conn = database.get_db_connection()
+        with conn:
+            for hour_start, d in deltas.items():
+                shift, shift_date = shift_for(hour_start, shifts)
+                conn.execute('''
+                    INSERT INTO production_hourly (hour_start, shift, shift_date, boxes, batches, batch_fill_seconds, gate_closed_seconds)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(hour_start) DO UPDATE SET
+                        boxes = boxes + excluded.boxes, batches = batches + excluded.batches,
+                        batch_fill_seconds = batch_fill_seconds + excluded.batch_fill_seconds,
+                        gate_closed_seconds = gate_closed_seconds + excluded.gate_closed_seconds
+                ''', (hour_start, shift, shift_date, d['boxes'], d['batches'], d['batch_fill_seconds'], d['gate_closed_seconds']))
+            conn.executemany("INSERT INTO production_events (ts, event, batch_number, count) VALUES (?, ?, ?, ?)", events)
+    except Exception:
+        # Put everything back so nothing is lost if the database was busy. Events recorded
+        # meanwhile go after the failed ones; if that overflows the buffer the oldest are dropped.
+        with lock:
+            merged = events + list(pending_events)
+            pending_events.clear()
+            pending_events.extend(merged[-MAX_BUFFERED_EVENTS:])
+            dropped = max(0, len(merged) - MAX_BUFFERED_EVENTS)
+            stats['dropped_events'] += dropped
+            for hour_start, d in deltas.items():
+                bucket = _bucket(hour_start)
+                for key, value in d.items():
+                    bucket[key] += value
+        if dropped:
+            print(f"[Analytics] Event buffer full; dropped the {dropped} oldest events ({stats['dropped_events']} in total).")
+        raise
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def flush_loop():
+    print("[Analytics] Starting aggregate flush thread...")
+    watchdog.register('analytics-flush', stall_after=FLUSH_INTERVAL * 4)
+    while True:
+        watchdog.beat('analytics-flush')
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception as e:
+            print(f"[ERROR in analytics flush_loop]: {e}")
+
+
+# --- Queries ---
+
+def _with_rates(row, elapsed_seconds):
+    hours = max(elapsed_seconds, 1) / 3600
+    row['boxes_per_hour'] = round(row['boxes'] / hours, 1)
+    row['avg_batch_fill_seconds'] = round(row['batch_fill_seconds'] / row['batches'], 1) if row['batches'] else None
+    row['downtime_ratio'] = round(min(1.0, row['gate_closed_seconds'] / max(elapsed_seconds, 1)), 3)
+    return row
+
+
+def _add_delta(row, delta):
+    for key, value in delta.items():
+        row[key] += value
+
+
+def get_hourly(hours=24):
+    """Per-hour aggregates for the last `hours` hours, newest last."""
+    now = time.time()
+    since = _local_hour_start(now) - (hours - 1) * 3600
+    with flush_lock:
+        deltas = _unflushed(now)
+        conn = database.get_db_connection()
+        rows = {row['hour_start']: dict(row) for row in conn.execute(
+            "SELECT * FROM production_hourly WHERE hour_start >= ? ORDER BY hour_start", (since,)
+        )}
+        conn.close()
+    shifts = get_shifts()
+    for hour_start, delta in deltas.items():
+        if hour_start < since:
+            continue
+        if hour_start not in rows:
+            shift, shift_date = shift_for(hour_start, shifts)
+            rows[hour_start] = {"hour_start": hour_start, "shift": shift, "shift_date": shift_date, "boxes": 0,
+                                "batches": 0, "batch_fill_seconds": 0.0, "gate_closed_seconds": 0.0}
+        _add_delta(rows[hour_start], delta)
+    return [_with_rates(rows[hour_start], min(3600, now - hour_start)) for hour_start in sorted(rows)]
+
+
+def get_shift_summary(days=7):
+    """Per-shift totals for the last `days` shift days, newest first."""
+    now = time.time()
+    since = time.strftime('%Y-%m-%d', time.localtime(now - days * 86400))
+    with flush_lock:
+        deltas = _unflushed(now)
+        conn = database.get_db_connection()
+        rows = {(row['shift_date'], row['shift']): dict(row) for row in conn.execute('''
+            SELECT shift_date, shift, COUNT(*) AS hours, MIN(hour_start) AS first_hour,
+                   SUM(boxes) AS boxes, SUM(batches) AS batches,
+                   SUM(batch_fill_seconds) AS batch_fill_seconds, SUM(gate_closed_seconds) AS gate_closed_seconds
+            FROM production_hourly WHERE shift_date >= ?
+            GROUP BY shift_date, shift
+        ''', (since,))}
+        # Unflushed hours that have no row yet add an hour to their shift.
+        stored = {row[0] for row in conn.execute(
+            f"SELECT hour_start FROM production_hourly WHERE hour_start IN ({','.join('?' * len(deltas))})", tuple(deltas)
+        )} if deltas else set()
+        conn.close()
+    shifts = get_shifts()
+    for hour_start, delta in deltas.items():
+        shift, shift_date = shift_for(hour_start, shifts)
+        if shift_date < since:
+            continue
+        row = rows.setdefault((shift_date, shift), {"shift_date": shift_date, "shift": shift, "hours": 0, "first_hour": hour_start,
+                                                    "boxes": 0, "batches": 0, "batch_fill_seconds": 0.0, "gate_closed_seconds": 0.0})
+        if hour_start not in stored:
+            row['hours'] += 1
+            row['first_hour'] = min(row['first_hour'], hour_start)
+        _add_delta(row, delta)
+    ordered = sorted(rows.values(), key=lambda row: (row['shift_date'], row['first_hour']), reverse=True)
+    return [_with_rates(row, min(row['hours'] * 3600, now - row['first_hour'])) for row in ordered]
+
+
+def get_rolling_throughput():
+    """Boxes counted in the last hour, from the in-memory minute buckets."""
+    oldest = int(time.time() // 60) - ROLLING_WINDOW_MINUTES
+    with lock:
+        return sum(count for minute, count in recent_minutes if minute > oldest)
+
+
+def get_summary():
+    shifts = get_shift_summary(days=2)
+    current, previous = (shifts + [None, None])[:2]
+    comparison = None
+    if current and previous and previous['boxes_per_hour']:
+        comparison = round((current['boxes_per_hour'] - previous['boxes_per_hour']) / previous['boxes_per_hour'] * 100, 1)
+    return {
+        "boxes_last_hour": get_rolling_throughput(),
+        "current_shift": current, "previous_shift": previous,
+        "throughput_change_pct": comparison,
+        "dropped_events": stats['dropped_events'],
+    }
@@ -0,0 +1,165 @@
+"""
+Static asset pipeline for the kiosk.
+At startup every file in app/static gets a content-hashed URL under /assets/
+and CSS/JS files are precompressed with gzip (and brotli when the optional
+'brotli' package is installed). Hashed URLs never change content, so they are
+served with a one-year immutable Cache-Control and page switches hit the
+browser cache instead of Flask. Templates use asset_url() and inline_asset().
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from flask import Blueprint, Response, abort, request, send_file, url_for
+from markupsafe import Markup
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(__file__), 'static')
+# Compressed variants are cached here (keyed by content hash) so a restart does not recompress.
+COMPRESSED_DIR = os.path.join(STATIC_DIR, '.compressed')
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.html')
+ONE_YEAR = 365 * 24 * 3600
+CSS_URL_PATTERN = re.compile(r'url\((["\']?)([^"\')]+)\1\)')
+
+mimetypes.add_type('font/woff2', '.woff2')
+
+assets_bp = Blueprint('assets', __name__)
+
+# hashed path -> asset record; logical path -> hashed path
+assets = {}
+manifest = {}
+inline_cache = {}
+
+
+def _hashed_name(logical_path, digest):
+    base, ext = os.path.splitext(logical_path)
+    return f"{base}.{digest[:10]}{ext}"
+
+
+def _rewrite_css_urls(css_text, logical_path):
+    """Points url() references at the hashed URLs of the files they name."""
+    css_dir = os.path.dirname(logical_path)
+
+    def replace(match):
+        target = match.group(2).strip()
+        if target.startswith(('data:', 'http:', 'https:', '/', '#')):
+            return match.group(0)
+        clean = re.split(r'[?#]', target, maxsplit=1)[0]
+        resolved = os.path.normpath(os.path.join(css_dir, clean)).replace(os.sep, '/')
+        if resolved not in manifest:
+            return match.group(0)
+        return f'url("/assets/{manifest[resolved]}")'
+
+    return CSS_URL_PATTERN.sub(replace, css_text)
+
+
+def _compressed_variant(digest, encoding, data):
+    cache_path = os.path.join(COMPRESSED_DIR, f"{digest}.{encoding}")
+    if os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            return f.read()
+    if encoding == 'br':
+        compressed = brotli.compress(data, quality=11)
+    else:
+        compressed = gzip.compress(data, compresslevel=9, mtime=0)
+    try:
+        os.makedirs(COMPRESSED_DIR, exist_ok=True)
+        with open(cache_path, 'wb') as f:
+            f.write(compressed)
+    except OSError as e:
+        print(f"[Assets] Could not cache compressed asset {cache_path}: {e}")
+    return compressed
+
+
+def _register(logical_path, file_path, data=None):
+    if data is None:
+        with open(file_path, 'rb') as f:
+            data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    hashed_path = _hashed_name(logical_path, digest)
+    mimetype = mimetypes.guess_type(logical_path)[0] or 'application/octet-stream'
+    record = {"logical": logical_path, "file": file_path, "mimetype": mimetype, "digest": digest[:16], "variants": {}}
+    if logical_path.endswith(COMPRESSIBLE_EXTENSIONS):
+        record['variants']['identity'] = data
+        record['variants']['gzip'] = _compressed_variant(digest, 'gzip', data)
+        if brotli is not None:
+            record['variants']['br'] = _compressed_variant(digest, 'br', data)
+    assets[hashed_path] = record
+    manifest[logical_path] = hashed_path
+
+
+def build_assets():
+    """Hashes and precompresses everything under app/static. CSS is processed last so it can reference hashed fonts."""
+    assets.clear(); manifest.clear(); inline_cache.clear()
+    css_files = []
+    for root, dirs, files in os.walk(STATIC_DIR):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in files:
+            # Skip copies whose filename carries a cache-busting query string.
+            if '?' in name or name.startswith('.'):
+                continue
+            file_path = os.path.join(root, name)
+            logical_path = os.path.relpath(file_path, STATIC_DIR).replace(os.sep, '/')
+            if name.endswith('.css'):
+                css_files.append((logical_path, file_path))
+            else:
+                _register(logical_path, file_path)
+    for logical_path, file_path in css_files:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            css_text = _rewrite_css_urls(f.read(), logical_path)
+        _register(logical_path, file_path, css_text.encode('utf-8'))
+    print(f"[Assets] Built {len(assets)} hashed assets (brotli {'enabled' if brotli else 'not installed'}).")
+
+
+def asset_url(logical_path):
+    """Template helper: the immutable hashed URL for a static file."""
+    hashed_path = manifest.get(logical_path)
+    if hashed_path is None:
+        return url_for('static', filename=logical_path)
+    return f"/assets/{hashed_path}"
+
+
+def inline_asset(logical_path):
+    """Template helper: the contents of a small static file, for inlining critical CSS."""
+    if logical_path not in inline_cache:
+        with open(os.path.join(STATIC_DIR, logical_path), 'r', encoding='utf-8') as f:
+            inline_cache[logical_path] = Markup(f.read())
+    return inline_cache[logical_path]
+
+
+def _choose_encoding(record):
+    for encoding in ('br', 'gzip'):
+        if encoding in record['variants'] and request.accept_encodings[encoding]:
+            return encoding
+    return 'identity'
+
+
+@assets_bp.route('/assets/<path:hashed_path>')
+def serve_asset(hashed_path):
+    record = assets.get(hashed_path)
+    if record is None:
+        abort(404)
+    if not record['variants']:
+        response = send_file(record['file'], mimetype=record['mimetype'], max_age=ONE_YEAR, etag=record['digest'], conditional=True)
+        response.headers['Cache-Control'] = f'public, max-age={ONE_YEAR}, immutable'
+        return response
+
+    encoding = _choose_encoding(record)
+    etag = record['digest'] if encoding == 'identity' else f"{record['digest']}-{encoding}"
+    headers = {'Cache-Control': f'public, max-age={ONE_YEAR}, immutable', 'ETag': f'"{etag}"', 'Vary': 'Accept-Encoding'}
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    return Response(record['variants'][encoding], mimetype=record['mimetype'], headers=headers)
+
+
+def init_app(app):
+    build_assets()
+    app.register_blueprint(assets_bp)
+    app.jinja_env.globals.update(asset_url=asset_url, inline_asset=inline_asset)
@@ -0,0 +1,71 @@
+"""
+Compact binary encoding of the busiest topic payloads, for SocketIO clients
+that ask for it (kiosk-shell.js does unless told otherwise).
+A payload dict is sent as a msgpack map whose keys are small integers from a
+fixed key table instead of strings; keys missing from the table are kept as
+strings, so a new state field never breaks a client. Preformatted values such
+as "42.0%" travel as numbers and the decoder formats them back, and tables of
+records (the health topic's loop list) travel as value arrays. The tables are
+sent to each client when it picks the encoding, so the bundled JS does not
+carry a copy. msgpack is optional: without it every client stays on JSON.
+"""
+from . import hardware
+
+ENCODING = 'msgpack'
+
+KEY_TABLES = {
+    'status_update': hardware.STATUS_KEYS,
+    'pin_update': ('ENTRY_SENSOR', 'EXIT_SENSOR', 'GATE_RELAY', 'GREEN_LED', 'RED_LED', 'BUZZER', 'SENSORS', 'OUTPUTS',
+                   'MODBUS_LINK', 'POLL_TIMING', 'OUTPUT_COILS', 'VISION'),
+    'health_update': ('cpu_usage', 'cpu_temp', 'memory_usage', 'uptime', 'loops'),
+    'top_bar_update': ('internet_active', 'ip_address', 'eth_active', 'wifi_active', 'wifi_strength', 'wifi_ssid',
+                       'ble_connected', 'ble_saved'),
+}
+# key -> (unit, decimals): strings like "42.0%" are sent as 42.0 and formatted back by the decoder.
+UNITS = {'cpu_usage': ('%', 1), 'memory_usage': ('%', 1), 'cpu_temp': ('°C', 1)}
+# key -> record fields: a {name: record} value is sent as {name: [field values in this order]}.
+ROWS = {'loops': ('lag_ms', 'max_gap_ms', 'stall_after_ms', 'stalled', 'stalls', 'beats', 'critical')}
+
+_indexes = {event: {key: i for i, key in enumerate(keys)} for event, keys in KEY_TABLES.items()}
+_reshaped = {event: [key for key in keys if key in UNITS or key in ROWS] for event, keys in KEY_TABLES.items()}
+_packer = {"packb": None, "checked": False}
+
+
+def available():
+    """True if msgpack is installed; checked once."""
+    if not _packer['checked']:
+        _packer['checked'] = True
+        try:
+            import msgpack
+            _packer['packb'] = msgpack.packb
+        except ImportError:
+            print("[Codec] msgpack is not installed; SocketIO clients get JSON.")
+    return _packer['packb'] is not None
+
+
+def _compact(key, value):
+    if key in ROWS and isinstance(value, dict):
+        return {name: [record.get(field) for field in ROWS[key]] for name, record in value.items()}
+    unit = UNITS.get(key)
+    if unit and isinstance(value, str) and value.endswith(unit[0]):
+        try:
+            return float(value[:-len(unit[0])])
+        except ValueError:
+            pass
+    return value
+
+
+def encode(event, payload):
+    """Returns the binary form of a payload for `event`. Only events in KEY_TABLES are encoded."""
+    index = _indexes[event]
+    data = {index.get(key, key): value for key, value in payload.items()}
+    for key in _reshaped[event]:
+        if key in payload:
+            data[index[key]] = _compact(key, payload[key])
+    return _packer['packb'](data)
+
+
+def describe():
+    """What a client needs to decode: the key tables, unit formats and record layouts."""
+    return {"encoding": ENCODING, "tables": {event: list(keys) for event, keys in KEY_TABLES.items()},
+            "units": {key: list(unit) for key, unit in UNITS.items()}, "rows": {key: list(fields) for key, fields in ROWS.items()}}
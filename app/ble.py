@@ -9,6 +9,13 @@ import threading
 from bleak import BleakClient, BleakError, BleakScanner
 from . import database
 from . import hardware
+from . import printing
+from . import watchdog
+
+# ATT header bytes that are subtracted from the negotiated MTU for each write.
+ATT_WRITE_OVERHEAD = 3
+# Small pause between unacknowledged writes so the printer's buffer keeps up.
+WRITE_WITHOUT_RESPONSE_DELAY = 0.01
 
 def connection_manager_loop():
     """
@@ -17,28 +24,36 @@ def connection_manager_loop():
     print("[BLE Manager] Starting background connection manager loop...")
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
+    # Connect attempts, the 60 s retry pause and a long label drain all happen between beats.
+    watchdog.register('ble-manager', stall_after=180)
     while True:
+        watchdog.beat('ble-manager')
         try:
             device_address = database.get_setting('printer_address')
             with hardware.state['lock']:
                 client = hardware.state.get('ble_printer_client')
             is_connected = client and client.is_connected
+            if is_connected and client.address != device_address:
+                print("[BLE Manager] Default device removed or changed. Disconnecting...")
+                loop.run_until_complete(client.disconnect())
+                with hardware.state['lock']:
+                    hardware.state['ble_printer_client'] = None
+                    hardware.state['ble_connection_status'] = "Disconnected"
+                is_connected = False
             if not device_address:
-                if is_connected:
-                    print("[BLE Manager] Default device removed. Disconnecting...")
-                    loop.run_until_complete(client.disconnect())
-                    with hardware.state['lock']:
-                        hardware.state['ble_printer_client'] = None
-                        hardware.state['ble_connection_status'] = "Disconnected"
-                time.sleep(15)
+                printing.jobs_available.wait(timeout=15)
+                printing.jobs_available.clear()
                 continue
             if not is_connected:
                 print(f"[BLE Manager] Found device {device_address}, attempting connection...")
-                loop.run_until_complete(connect_and_manage_device(device_address, loop))
-                print("[BLE Manager] Waiting 60 seconds before next connection attempt...")
-                time.sleep(60)
-            else:
-                time.sleep(15)
+                if not loop.run_until_complete(connect_and_manage_device(device_address, loop)):
+                    print("[BLE Manager] Waiting 60 seconds before next connection attempt...")
+                    time.sleep(60)
+                continue
+            # Connected: drain any queued labels, then sleep until a new job arrives.
+            printing.jobs_available.clear()
+            loop.run_until_complete(drain_print_queue(client))
+            printing.jobs_available.wait(timeout=15)
         except Exception as e:
             print(f"[ERROR in connection_manager_loop]: {e}")
             time.sleep(30) # Wait longer if there's a loop error
@@ -56,14 +71,54 @@ async def connect_and_manage_device(address, loop):
                 print(f"[BLE Connect] Success: {address}.")
                 hardware.state['ble_printer_client'] = new_client
                 hardware.state['ble_connection_status'] = "Connected"
-            else:
-                hardware.state['ble_printer_client'] = None
-                hardware.state['ble_connection_status'] = "Disconnected"
+                return True
+            hardware.state['ble_printer_client'] = None
+            hardware.state['ble_connection_status'] = "Disconnected"
     except Exception as e:
         print(f"[BLE Connect] Failed: {address}. Error: {e}")
         with hardware.state['lock']:
             hardware.state['ble_printer_client'] = None
             hardware.state['ble_connection_status'] = "Disconnected"
+    return False
+
+async def drain_print_queue(client):
+    """
+    Writes every pending label to the saved characteristic. Each label is split
+    into MTU-sized chunks and written without response when the characteristic
+    allows it. A failed job stays in the queue and is retried after reconnecting.
+    The label delay from the Printer Configure page is waited between jobs.
+    """
+    char_uuid = database.get_setting('printer_char_uuid')
+    if not char_uuid:
+        return
+    characteristic = client.services.get_characteristic(char_uuid)
+    if characteristic is None:
+        print(f"[BLE Print] Characteristic {char_uuid} not found on printer.")
+        return
+    with_response = 'write-without-response' not in characteristic.properties
+    chunk_size = max(20, client.mtu_size - ATT_WRITE_OVERHEAD)
+    delay = printing.get_printer_config()['delay_ms'] / 1000
+    jobs = printing.get_pending_jobs()
+    while jobs:
+        for job_id, payload in jobs:
+            try:
+                for offset in range(0, len(payload), chunk_size):
+                    await client.write_gatt_char(characteristic, payload[offset:offset + chunk_size], response=with_response)
+                    if not with_response:
+                        await asyncio.sleep(WRITE_WITHOUT_RESPONSE_DELAY)
+                printing.mark_job_printed(job_id)
+                print(f"[BLE Print] Job {job_id} printed ({len(payload)} bytes).")
+                if delay:
+                    await asyncio.sleep(delay)
+            except Exception as e:
+                print(f"[BLE Print] Job {job_id} failed: {e}")
+                printing.mark_job_failed(job_id, e)
+                if not client.is_connected:
+                    with hardware.state['lock']:
+                        hardware.state['ble_printer_client'] = None
+                        hardware.state['ble_connection_status'] = "Disconnected"
+                return
+        jobs = printing.get_pending_jobs()
 
 # --- On-Demand Functions (Unchanged) ---
 async def scan_ble_devices(timeout=10.0):
@@ -0,0 +1,94 @@
+"""
+Gate, lights and buzzer driven through the coils of the Modbus I/O module
+instead of Pi GPIO, for cabinets where only the RS-485 bus is wired.
+CoilOutput stands in for the gpiozero LED/Buzzer objects hardware.py uses, but
+on()/off()/beep() only change an output image. The poll loop writes the image
+once per sample window, right after the input read: all outputs in a single
+write_coils frame, and only if something differs from what the module last
+acknowledged. Outputs changed from other threads (batch changeover, manual
+control) go out with the next window, at most one POLL_INTERVAL later.
+Buzzer patterns are resolved against the window clock, so a beep is as
+precise as the window (50 ms).
+The mapped coils are written as one contiguous range; coils inside the range
+that are not mapped are held off.
+"""
+import threading
+import time
+
+outputs = []
+lock = threading.Lock()
+# Coil values the module last acknowledged; None forces a full write (startup, link recovery).
+image = {"written": None}
+stats = {"frames": 0, "errors": 0, "last_error": None}
+
+
+class CoilOutput:
+    """One output on coil `channel` (1-based, like the module's DO labels)."""
+    def __init__(self, name, channel):
+        self.name, self.address = name, channel - 1
+        self._value, self._pattern = 0, None
+        outputs.append(self)
+        outputs.sort(key=lambda output: output.address)
+
+    @property
+    def value(self):
+        return self._value
+
+    def on(self):
+        with lock: self._value, self._pattern = 1, None
+
+    def off(self):
+        with lock: self._value, self._pattern = 0, None
+
+    def beep(self, on_time=1, off_time=1, n=None, background=True):
+        """Same arguments as gpiozero's Buzzer.beep(); n=None beeps until off()."""
+        with lock: self._value, self._pattern = 1, (time.monotonic(), on_time, off_time, n)
+        if not background and n is not None:
+            time.sleep(n * (on_time + off_time))
+
+    def close(self):
+        self.off()
+        with lock:
+            if self in outputs: outputs.remove(self)
+
+    def current(self, now):
+        """The coil value for this window. Caller holds `lock`."""
+        if self._pattern is None:
+            return self._value
+        started, on_time, off_time, n = self._pattern
+        elapsed = now - started
+        cycle = int(elapsed // (on_time + off_time))
+        if n is not None and cycle >= n:
+            self._value, self._pattern = 0, None
+            return 0
+        return 1 if elapsed - cycle * (on_time + off_time) < on_time else 0
+
+
+def pending_frame(now):
+    """Returns (address, bits) for this window's write_coils frame, or None if the module is up to date."""
+    with lock:
+        if not outputs:
+            return None
+        first = outputs[0].address
+        bits = [False] * (outputs[-1].address - first + 1)
+        for output in outputs:
+            bits[output.address - first] = bool(output.current(now))
+    return None if bits == image['written'] else (first, bits)
+
+
+def acknowledged(bits):
+    image['written'] = bits; stats['frames'] += 1
+
+
+def failed(error):
+    stats['errors'] += 1; stats['last_error'] = str(error)
+
+
+def invalidate():
+    """The module may have lost its outputs (power cycle, bus fault); rewrite them all next window."""
+    image['written'] = None
+
+
+def get_status():
+    return {"coils": {output.name: output.address + 1 for output in outputs}, "frames": stats['frames'],
+            "errors": stats['errors'], "last_error": stats['last_error']}
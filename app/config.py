@@ -0,0 +1,127 @@
+"""
+Versioned line configuration (batch target, gate wait time).
+Every change is validated against SCHEMA and written in a single SQLite
+transaction together with a bumped config_version. A caller can pass the
+version it last read; if someone else saved in between, the update is rejected
+instead of silently overwriting (compare-and-swap).
+Saved changes are not written into the running engine here: the process
+running the line parks them in `pending` (see park()) and
+hardware.apply_pending_config() applies them at a safe point, i.e. when no
+batch is in progress, so a change never lands mid-batch.
+"""
+import threading
+
+from . import database
+
+SCHEMA = {
+    'batch_target': {'type': int, 'min': 1, 'max': 10000, 'default': 20},
+    'gate_wait_time': {'type': int, 'min': 0, 'max': 3600, 'default': 10},
+    # 1: boxes that pass during a batch changeover are counted into the next batch; 0: they are not counted.
+    'changeover_carry': {'type': int, 'min': 0, 'max': 1, 'default': 1},
+    # 1: close the gate ahead of the target using the learned gate timing (gate_timing.py); 0: close at the target.
+    'close_ahead': {'type': int, 'min': 0, 'max': 1, 'default': 0},
+}
+VERSION_KEY = 'config_version'
+
+# Saved but not yet applied to hardware.state: {"values": {...}, "version": n} or empty.
+pending = {}
+pending_lock = threading.Lock()
+
+
+class ConfigError(ValueError):
+    """The submitted values failed validation."""
+
+
+class ConfigConflict(Exception):
+    """The configuration changed since the caller read it."""
+    def __init__(self, current_version):
+        super().__init__(f"Configuration was changed elsewhere (now version {current_version}). Reload and try again.")
+        self.current_version = current_version
+
+
+def validate(changes):
+    """Returns the changes converted to their schema types. Raises ConfigError."""
+    clean = {}
+    for key, raw in changes.items():
+        spec = SCHEMA.get(key)
+        if spec is None:
+            raise ConfigError(f"Unknown setting '{key}'")
+        try:
+            value = spec['type'](raw)
+        except (TypeError, ValueError):
+            raise ConfigError(f"{key} must be a whole number")
+        if not spec['min'] <= value <= spec['max']:
+            raise ConfigError(f"{key} must be between {spec['min']} and {spec['max']}")
+        clean[key] = value
+    if not clean:
+        raise ConfigError("No settings given")
+    return clean
+
+
+def _read(conn):
+    rows = conn.execute(
+        f"SELECT key, value FROM settings WHERE key IN ({','.join('?' * (len(SCHEMA) + 1))})",
+        (*SCHEMA, VERSION_KEY)
+    ).fetchall()
+    stored = {row['key']: row['value'] for row in rows}
+    values = {}
+    for key, spec in SCHEMA.items():
+        try:
+            values[key] = spec['type'](stored[key])
+        except (KeyError, ValueError):
+            values[key] = spec['default']
+    return values, int(stored.get(VERSION_KEY, 0))
+
+
+def get_config():
+    """Returns the saved configuration and its version, read consistently in one query."""
+    conn = database.get_db_connection()
+    values, version = _read(conn)
+    conn.close()
+    return {"values": values, "version": version}
+
+
+def update_config(changes, expected_version=None):
+    """
+    Validates and saves several settings atomically. Raises ConfigError or
+    ConfigConflict. Returns the new config, to be handed to park().
+    """
+    clean = validate(changes)
+    conn = database.get_db_connection()
+    try:
+        # IMMEDIATE takes the write lock before reading the version, so two saves cannot both pass the check.
+        conn.execute("BEGIN IMMEDIATE")
+        values, version = _read(conn)
+        if expected_version is not None and int(expected_version) != version:
+            conn.rollback()
+            raise ConfigConflict(version)
+        values.update(clean)
+        version += 1
+        conn.executemany("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                         [(key, str(value)) for key, value in clean.items()] + [(VERSION_KEY, str(version))])
+        conn.commit()
+    finally:
+        conn.close()
+    return {"values": values, "version": version}
+
+
+def park(values, version):
+    """Holds a saved change until the engine reaches a safe point; a newer one replaces it."""
+    with pending_lock:
+        if version > pending.get('version', 0):
+            pending.update(values=values, version=version)
+
+
+def take_pending():
+    """Returns and clears the parked change, or None."""
+    with pending_lock:
+        if not pending:
+            return None
+        change = dict(pending)
+        pending.clear()
+        return change
+
+
+def has_pending():
+    with pending_lock:
+        return bool(pending)
@@ -0,0 +1,170 @@
+"""
+Link between the web process and the counting daemon (counterd.py).
+In the split install the daemon owns Modbus, GPIO and the BLE printer and the
+web process only serves the UI, so HTTP load, JSON encoding and psutil probes
+never hold the GIL the poll loop needs.
+Status goes one way through the shared-memory record (shared_state.py):
+mirror_loop copies every new snapshot into hardware.state of the web process,
+so pages and topics read it exactly as in the all-in-one install. Commands
+that act on the line go the other way, one JSON line per request over a Unix
+socket. run() hides the difference: it calls the command locally in the
+all-in-one install and in the daemon otherwise.
+"""
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+
+from . import analytics, config, gate_timing, hardware, printing, realtime, shared_state, startup, uplink, watchdog
+
+SOCKET_PATH = os.environ.get('BOX_COUNTER_SOCKET', '/tmp/box_counter.sock')
+CALL_TIMEOUT = 2.0
+# How often the web process looks for a new sequence number; the check is one 8-byte read.
+MIRROR_INTERVAL = 0.01
+# The daemon touches the record at least this often, and is presumed gone after STALE_AFTER.
+HEARTBEAT_INTERVAL = 1.0
+STALE_AFTER = 3.0
+MAX_MESSAGE_BYTES = 65536
+
+link = {"enabled": False, "connected": False, "daemon_pid": None, "seq": None, "last_error": None}
+
+
+class CounterUnavailable(ConnectionError):
+    """The counting daemon did not answer."""
+
+
+def _config_saved(values, version):
+    config.park(values, version)
+    return hardware.config_saved()
+
+
+# Everything the web tier may ask of the process running the line.
+COMMANDS = {
+    'reset_counter': hardware.reset_counter,
+    'manual_control': hardware.manual_control,
+    'config_saved': _config_saved,
+    'io_status': hardware.get_live_io_status,
+    'reset_poll_timing': realtime.reset_poll_timing,
+    'uplink_status': uplink.get_uplink_status,
+    'uplink_retry': uplink.retry_now,
+    'analytics_summary': analytics.get_summary,
+    'analytics_flush': analytics.flush,
+    'startup_profile': startup.get_profile,
+    'gate_timing': gate_timing.get_status,
+    'gate_calibrate': gate_timing.calibrate,
+    'print_wake': printing.wake_printer,
+}
+
+
+def run(command, **args):
+    """Runs a line command in this process, or in the daemon when the web tier is split off."""
+    if link['enabled']:
+        return call(command, **args)
+    return COMMANDS[command](**args)
+
+
+def call(command, **args):
+    """Sends one command to the daemon and returns its result. Raises CounterUnavailable."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(CALL_TIMEOUT)
+            sock.connect(SOCKET_PATH)
+            sock.sendall(json.dumps({"command": command, "args": args}).encode('utf-8') + b'\n')
+            with sock.makefile('rb') as reader:
+                reply = json.loads(reader.readline(MAX_MESSAGE_BYTES) or b'null')
+    except (OSError, ValueError) as e:
+        raise CounterUnavailable(f"Counting service unavailable: {e}")
+    if not reply or not reply.get('ok'):
+        raise CounterUnavailable((reply or {}).get('error', "Counting service gave no answer"))
+    return reply['result']
+
+
+# --- Web process side ---
+def _mark_offline(reason):
+    link.update(connected=False, seq=None, last_error=reason)
+    print(f"[Counter Link] Counting service offline: {reason}")
+    with hardware.state['lock']:
+        hardware.state['system_status'] = "Counting Service Offline"
+    hardware.broadcast_status()
+
+
+def mirror_loop():
+    """GREEN thread: copies each new daemon snapshot into hardware.state and the status queue."""
+    from . import status_queue
+    from .extensions import socketio
+    print(f"[Counter Link] Mirroring counting service status from {shared_state.STATE_PATH}...")
+    watchdog.register('counter-link', stall_after=5, critical=True)
+    link['connected'] = True
+    while True:
+        watchdog.beat('counter-link')
+        try:
+            if shared_state.record['mm'] is None:
+                shared_state.open_reader()
+            if time.time() - shared_state.read_heartbeat() > STALE_AFTER:
+                if link['connected']:
+                    _mark_offline(f"no heartbeat for {STALE_AFTER:.0f}s")
+            elif shared_state.read_seq() != link['seq']:
+                seq, pid, _, data = shared_state.read()
+                link.update(seq=seq, daemon_pid=pid)
+                if data:
+                    with hardware.state['lock']:
+                        hardware.state.update(data)
+                        snapshot = hardware.snapshot_state()
+                    status_queue.put(snapshot)
+                if not link['connected']:
+                    link.update(connected=True, last_error=None); print("[Counter Link] Counting service is back.")
+        except shared_state.RecordUnavailable as e:
+            shared_state.record['mm'] = None
+            if link['connected']:
+                _mark_offline(str(e))
+        except Exception as e:
+            print(f"[ERROR in counter link mirror]: {e}")
+        socketio.sleep(MIRROR_INTERVAL)
+
+
+# --- Daemon side ---
+def publish_loop():
+    """Publishes status snapshots to shared memory; the status queue only ever holds the newest one."""
+    from . import status_queue
+    print("[Counter Link] Publishing status to shared memory...")
+    watchdog.register('state-publisher', stall_after=5, critical=True)
+    while True:
+        watchdog.beat('state-publisher')
+        try:
+            snapshot = status_queue.get(timeout=HEARTBEAT_INTERVAL)
+        except queue.Empty:
+            shared_state.touch()
+            continue
+        try:
+            shared_state.publish(hardware.status_dict(snapshot))
+        except Exception as e:
+            print(f"[ERROR in state publisher]: {e}")
+
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline(MAX_MESSAGE_BYTES))
+            command = COMMANDS.get(request.get('command'))
+            if command is None:
+                reply = {"ok": False, "error": f"Unknown command '{request.get('command')}'"}
+            else:
+                reply = {"ok": True, "result": command(**request.get('args', {}))}
+        except Exception as e:
+            reply = {"ok": False, "error": str(e)}
+        self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+
+
+def start_command_server():
+    """Serves COMMANDS on SOCKET_PATH, one thread per connection."""
+    if os.path.exists(SOCKET_PATH):
+        os.unlink(SOCKET_PATH)
+    server = socketserver.ThreadingUnixStreamServer(SOCKET_PATH, CommandHandler)
+    server.daemon_threads = True
+    os.chmod(SOCKET_PATH, 0o660)
+    threading.Thread(target=server.serve_forever, daemon=True, name='command-server').start()
+    print(f"[Counter Link] Accepting commands on {SOCKET_PATH}.")
+    return server
@@ -14,7 +14,7 @@ def get_db_connection():
     return conn
 
 def init_db():
-    """Initializes the database and creates the settings table if it doesn't exist."""
+    """Initializes the database and creates the tables if they don't exist."""
     conn = get_db_connection()
     conn.execute('''
         CREATE TABLE IF NOT EXISTS settings (
@@ -22,6 +22,65 @@ def init_db():
             value TEXT NOT NULL
         )
     ''')
+    # Persistent queue of rendered labels waiting for the BLE printer.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS print_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at REAL NOT NULL,
+            batch_number INTEGER,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            payload BLOB NOT NULL,
+            last_error TEXT,
+            printed_at REAL
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_print_jobs_status ON print_jobs (status, id)")
+    # One row per local hour, maintained incrementally by analytics.flush().
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS production_hourly (
+            hour_start INTEGER PRIMARY KEY,
+            shift TEXT NOT NULL,
+            shift_date TEXT NOT NULL,
+            boxes INTEGER NOT NULL DEFAULT 0,
+            batches INTEGER NOT NULL DEFAULT 0,
+            batch_fill_seconds REAL NOT NULL DEFAULT 0,
+            gate_closed_seconds REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_production_hourly_shift ON production_hourly (shift_date, shift)")
+    # Raw per-box and per-batch events, appended in batches by analytics.flush() and read by the exports.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS production_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts REAL NOT NULL,
+            event TEXT NOT NULL,
+            batch_number INTEGER,
+            count INTEGER
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_production_events_ts ON production_events (ts)")
+    # Events waiting to be sent to the MES; rows are deleted once the endpoint accepts them.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS uplink_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at REAL NOT NULL,
+            body TEXT NOT NULL
+        )
+    ''')
+    # Per-minute device samples kept by the fleet aggregator (fleet mode only).
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS fleet_history (
+            device TEXT NOT NULL,
+            ts REAL NOT NULL,
+            link TEXT NOT NULL,
+            system_status TEXT,
+            batches_completed INTEGER,
+            object_count INTEGER
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fleet_history_device_ts ON fleet_history (device, ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fleet_history_ts ON fleet_history (ts)")
     conn.commit()
     conn.close()
     print("[Database] Database initialized successfully.")
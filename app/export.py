@@ -0,0 +1,142 @@
+"""
+Streaming export of production data for supervisors' spreadsheets.
+Rows are read from the ts/hour indexed tables one page at a time (keyset
+pagination: each page continues after the last row of the previous one) and
+written out as they come, so exporting months of per-box events uses constant
+memory. Each page is read on its own short-lived connection: the database is
+in rollback-journal mode, where a read cursor held open for a whole download
+would make every writer (analytics flush, label queue, config saves, uplink
+outbox) fail with "database is locked". Between pages the generator yields to
+the event loop, so the status broadcaster keeps running during a long download.
+Parquet output needs the optional 'pyarrow' package.
+"""
+import csv
+import io
+import os
+import tempfile
+import time
+
+from . import counter_link, database
+from .extensions import socketio
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+CHUNK_ROWS = 1000
+# Parquet row groups; also the most rows held in memory while writing one.
+PARQUET_ROW_GROUP = 10000
+FILE_CHUNK_BYTES = 64 * 1024
+
+DATASETS = {
+    "events": {
+        "columns": ("ts", "time", "event", "batch_number", "count"),
+        "types": ("float", "str", "str", "int", "int"),
+        # ts is not unique, so pages continue after the last (ts, id).
+        "query": """SELECT id, ts, event, batch_number, count FROM production_events
+                    WHERE ts >= ? AND ts < ? AND (ts > ? OR (ts = ? AND id > ?)) ORDER BY ts, id LIMIT ?""",
+        "first_key": lambda start: (start, start, -1),
+        "key": lambda r: (r['ts'], r['ts'], r['id']),
+        "row": lambda r: (r['ts'], _local_time(r['ts']), r['event'], r['batch_number'], r['count']),
+    },
+    "hourly": {
+        "columns": ("hour_start", "time", "shift", "shift_date", "boxes", "batches", "batch_fill_seconds", "gate_closed_seconds"),
+        "types": ("int", "str", "str", "str", "int", "int", "float", "float"),
+        "query": "SELECT * FROM production_hourly WHERE hour_start >= ? AND hour_start < ? AND hour_start > ? ORDER BY hour_start LIMIT ?",
+        "first_key": lambda start: (start - 1,),
+        "key": lambda r: (r['hour_start'],),
+        "row": lambda r: (r['hour_start'], _local_time(r['hour_start']), r['shift'], r['shift_date'], r['boxes'],
+                          r['batches'], round(r['batch_fill_seconds'], 1), round(r['gate_closed_seconds'], 1)),
+    },
+}
+
+
+def _local_time(ts):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))
+
+
+def parse_range(date_from, date_to):
+    """Turns inclusive YYYY-MM-DD local dates into a [start, end) timestamp range. Raises ValueError."""
+    start = time.mktime(time.strptime(date_from, '%Y-%m-%d'))
+    end = time.mktime(time.strptime(date_to, '%Y-%m-%d')) + 86400
+    if end <= start:
+        raise ValueError("'to' must not be before 'from'")
+    return start, end
+
+
+def _read_page(spec, start, end, key):
+    conn = database.get_db_connection()
+    try:
+        return conn.execute(spec['query'], (start, end) + key + (CHUNK_ROWS,)).fetchall()
+    finally:
+        conn.close()
+
+
+def iter_rows(dataset, start, end):
+    """Yields lists of at most CHUNK_ROWS export rows. No connection stays open across a yield."""
+    spec = DATASETS[dataset]
+    # Include the counters still buffered in memory of the process running the line.
+    try:
+        counter_link.run('analytics_flush')
+    except counter_link.CounterUnavailable as e:
+        print(f"[Export] Exporting without the last unflushed events: {e}")
+    key = spec['first_key'](start)
+    while True:
+        rows = _read_page(spec, start, end, key)
+        if not rows:
+            break
+        key = spec['key'](rows[-1])
+        yield [spec['row'](r) for r in rows]
+        if len(rows) < CHUNK_ROWS:
+            break
+        socketio.sleep(0)
+
+
+def stream_csv(dataset, start, end):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(DATASETS[dataset]['columns'])
+    for chunk in iter_rows(dataset, start, end):
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0); buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_parquet(dataset, start, end):
+    """
+    Parquet needs a seekable file, so row groups are written to a temporary
+    file on disk and the file is streamed back once complete.
+    """
+    if pyarrow is None:
+        raise RuntimeError("Parquet export requires the 'pyarrow' package.")
+    spec = DATASETS[dataset]
+    type_map = {"int": pyarrow.int64(), "float": pyarrow.float64(), "str": pyarrow.string()}
+    schema = pyarrow.schema([(name, type_map[t]) for name, t in zip(spec['columns'], spec['types'])])
+    fd, path = tempfile.mkstemp(suffix='.parquet')
+    os.close(fd)
+    try:
+        group = []
+        with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+            for chunk in iter_rows(dataset, start, end):
+                group.extend(chunk)
+                if len(group) >= PARQUET_ROW_GROUP:
+                    _write_group(writer, schema, group); group = []
+            if group:
+                _write_group(writer, schema, group)
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(FILE_CHUNK_BYTES)
+                if not data:
+                    break
+                yield data
+                socketio.sleep(0)
+    finally:
+        os.remove(path)
+
+
+def _write_group(writer, schema, rows):
+    columns = [[row[i] for row in rows] for i in range(len(schema))]
+    writer.write_table(pyarrow.Table.from_arrays([pyarrow.array(c, type=f.type) for c, f in zip(columns, schema)], schema=schema))
@@ -0,0 +1,49 @@
+"""
+Optional subsystems and the memory profile.
+The BLE printer link, WiFi management and the diagnostics pages (system
+health, pin diagnostics, profiler) can be switched off. A subsystem that is
+off is never imported, so neither are the packages it pulls in (bleak,
+psutil). The 'low' memory profile (setting 'memory_profile', for 512 MB
+boards that share their memory with the kiosk browser) turns all three off
+by default; each can still be switched on with its own setting
+(feature_ble, feature_wifi, feature_diagnostics = '1' or '0').
+Read once, at startup; a change takes effect after a restart.
+"""
+from . import database
+
+PROFILES = ('standard', 'low')
+OPTIONAL = {'ble': "The Bluetooth printer link", 'wifi': "WiFi management", 'diagnostics': "Diagnostics"}
+
+enabled = {}
+active = {"profile": None}
+
+
+class Disabled(Exception):
+    """The request needs a subsystem that is switched off on this line."""
+    def __init__(self, name):
+        super().__init__(f"{OPTIONAL[name]} is switched off on this line (memory profile '{active['profile']}').")
+
+
+def load():
+    profile = database.get_setting('memory_profile', 'standard')
+    if profile not in PROFILES:
+        print(f"[Features] Unknown memory profile '{profile}'; using 'standard'.")
+        profile = 'standard'
+    default = '0' if profile == 'low' else '1'
+    active['profile'] = profile
+    enabled.update({name: database.get_setting(f'feature_{name}', default) == '1' for name in OPTIONAL})
+    print(f"[Features] Memory profile '{profile}'; off: {', '.join(n for n in OPTIONAL if not enabled[n]) or 'nothing'}.")
+    return enabled
+
+
+def is_enabled(name):
+    if not enabled:
+        load()
+    return enabled[name]
+
+
+def require(name):
+    """Raises Disabled if the subsystem is off (routes turn that into a 404)."""
+    if not is_enabled(name):
+        raise Disabled(name)
+
@@ -0,0 +1,285 @@
+"""
+Fleet aggregator mode: one host watching many counting Pis.
+Started with fleet_run.py (create_app(mode='fleet')); no hardware is touched.
+Each device gets a green worker that subscribes to the device's 'status'
+topic over a SocketIO client, so updates are pushed rather than polled. If a
+device's socket cannot be reached (older firmware, proxy in the way) the worker
+polls its /api/status instead (conditionally, with If-None-Match) and retries
+the socket periodically. All HTTP
+traffic shares one pooled requests.Session.
+Changed devices are coalesced and pushed to the fleet dashboard through the
+'fleet' topic; a per-minute sample of every device is kept for the history API.
+"""
+import json
+import time
+import threading
+from flask import Blueprint, jsonify, render_template, request
+
+from . import database, watchdog
+from .extensions import socketio
+
+# Dashboard updates are batched over this window.
+PUSH_INTERVAL = 0.5
+POLL_INTERVAL = 2
+SOCKET_RETRY_SECONDS = 60
+CONNECT_TIMEOUT = 5
+HISTORY_INTERVAL = 60
+HISTORY_RETENTION_DAYS = 30
+# Upper bound on pooled keep-alive connections (one per device is enough).
+MAX_POOL_SIZE = 256
+
+fleet_bp = Blueprint('fleet', __name__)
+
+# name -> {"name", "url", "link", "status", "last_update", "error", ...}
+devices = {}
+devices_lock = threading.Lock()
+dirty = set()
+clients = {}
+# name -> ETag of the last /api/status body polled from the device
+etags = {}
+http_pool = None
+
+
+def _get_pool():
+    global http_pool
+    if http_pool is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        http_pool = requests.Session()
+        adapter = HTTPAdapter(pool_connections=MAX_POOL_SIZE, pool_maxsize=MAX_POOL_SIZE)
+        http_pool.mount('http://', adapter); http_pool.mount('https://', adapter)
+    return http_pool
+
+
+def _public(device):
+    return {k: v for k, v in device.items() if k != 'generation'}
+
+
+def _update_device(name, **fields):
+    with devices_lock:
+        device = devices.get(name)
+        if device is None:
+            return
+        # Repeated identical polls of an idle or offline device are not pushed to the dashboard.
+        if any(device.get(key) != value for key, value in fields.items() if key != 'last_update'):
+            dirty.add(name)
+        device.update(fields)
+
+
+# --- Device list ---
+
+def get_configured_devices():
+    try:
+        return json.loads(database.get_setting('fleet_devices') or '[]')
+    except ValueError:
+        return []
+
+
+def _save_devices():
+    with devices_lock:
+        listing = [{"name": d['name'], "url": d['url']} for d in devices.values()]
+    database.set_setting('fleet_devices', json.dumps(listing))
+
+
+def add_device(name, url):
+    """Adds (or re-points) a device and starts its worker. Raises ValueError for bad input."""
+    name, url = (name or '').strip(), (url or '').strip().rstrip('/')
+    if not name or not url.startswith(('http://', 'https://')):
+        raise ValueError("A device needs a name and an http(s):// URL.")
+    remove_device(name, save=False)
+    with devices_lock:
+        devices[name] = {"name": name, "url": url, "link": "connecting", "status": None,
+                         "last_update": None, "error": None, "generation": time.monotonic()}
+        dirty.add(name)
+    _save_devices()
+    socketio.start_background_task(device_worker, name, devices[name]['generation'])
+
+
+def remove_device(name, save=True):
+    with devices_lock:
+        existed = devices.pop(name, None) is not None
+        dirty.add(name)
+    etags.pop(name, None)
+    client = clients.pop(name, None)
+    if client is not None:
+        try: client.disconnect()
+        except Exception: pass
+    if save and existed:
+        _save_devices()
+    return existed
+
+
+# --- Per-device workers ---
+
+def _current_url(name, generation):
+    """The device's URL, or None once the device was removed or re-added."""
+    with devices_lock:
+        device = devices.get(name)
+        return device['url'] if device is not None and device['generation'] == generation else None
+
+
+def _connect_socket(name, url, generation):
+    """Subscribes to the device's status topic. Blocks until the connection drops; returns True if it was up."""
+    import socketio as socketio_client
+    client = socketio_client.Client(reconnection=False, http_session=_get_pool())
+
+    @client.on('connect')
+    def on_connect():
+        client.emit('subscribe', {'topics': ['status'], 'visible': True})
+
+    @client.on('status_update')
+    def on_status(data):
+        _update_device(name, status=data, last_update=time.time(), link='socket', error=None)
+
+    client.connect(url, wait_timeout=CONNECT_TIMEOUT)
+    if _current_url(name, generation) is None:
+        client.disconnect(); return True
+    clients[name] = client
+    _update_device(name, link='socket', error=None)
+    client.wait()
+    return True
+
+
+def _poll_status(name, url):
+    try:
+        # The device answers 304 without a body while its state version is unchanged.
+        headers = {'If-None-Match': etags[name]} if name in etags else {}
+        response = _get_pool().get(f"{url}/api/status", headers=headers, timeout=CONNECT_TIMEOUT)
+        if response.status_code == 304:
+            _update_device(name, last_update=time.time(), link='poll'); return
+        response.raise_for_status()
+        if 'ETag' in response.headers: etags[name] = response.headers['ETag']
+        _update_device(name, status=response.json(), last_update=time.time(), link='poll')
+    except Exception as e:
+        _update_device(name, link='offline', error=str(e))
+
+
+def device_worker(name, generation):
+    """GREEN thread per device: push over SocketIO when possible, HTTP polling otherwise."""
+    print(f"[Fleet] Watching device '{name}'.")
+    while True:
+        url = _current_url(name, generation)
+        if url is None:
+            break
+        was_connected = False
+        try:
+            was_connected = _connect_socket(name, url, generation)
+        except Exception as e:
+            _update_device(name, error=f"socket: {e}")
+        clients.pop(name, None)
+        # A dropped socket (e.g. the device restarted) is retried soon; an unreachable one only every minute.
+        retry_at = time.time() + (POLL_INTERVAL if was_connected else SOCKET_RETRY_SECONDS)
+        while _current_url(name, generation) and time.time() < retry_at:
+            _poll_status(name, url)
+            socketio.sleep(POLL_INTERVAL)
+    print(f"[Fleet] Stopped watching device '{name}'.")
+
+
+# --- Dashboard push, metrics and history ---
+
+def get_fleet_snapshot():
+    with devices_lock:
+        return {"devices": [_public(d) for d in devices.values()], "full": True}
+
+
+def get_fleet_metrics():
+    with devices_lock:
+        snapshot = [dict(d) for d in devices.values()]
+    metrics = {"devices": len(snapshot), "links": {}, "system_status": {}, "batches_completed": 0, "objects_in_batch": 0}
+    for device in snapshot:
+        metrics['links'][device['link']] = metrics['links'].get(device['link'], 0) + 1
+        status = device['status'] or {}
+        if device['link'] != 'offline' and status:
+            key = status.get('system_status', 'Unknown')
+            metrics['system_status'][key] = metrics['system_status'].get(key, 0) + 1
+            metrics['batches_completed'] += status.get('batches_completed', 0)
+            metrics['objects_in_batch'] += status.get('object_count', 0)
+    return metrics
+
+
+def record_history():
+    now = time.time()
+    with devices_lock:
+        rows = [(d['name'], now, d['link'], (d['status'] or {}).get('system_status'),
+                 (d['status'] or {}).get('batches_completed'), (d['status'] or {}).get('object_count'))
+                for d in devices.values()]
+    conn = database.get_db_connection()
+    with conn:
+        conn.executemany('''INSERT INTO fleet_history (device, ts, link, system_status, batches_completed, object_count)
+                            VALUES (?, ?, ?, ?, ?, ?)''', rows)
+        conn.execute("DELETE FROM fleet_history WHERE ts < ?", (now - HISTORY_RETENTION_DAYS * 86400,))
+    conn.close()
+
+
+def get_history(device=None, hours=24):
+    since = time.time() - hours * 3600
+    conn = database.get_db_connection()
+    if device:
+        rows = conn.execute('''SELECT ts, link, system_status, batches_completed, object_count FROM fleet_history
+                               WHERE device = ? AND ts >= ? ORDER BY ts''', (device, since)).fetchall()
+    else:
+        rows = conn.execute('''SELECT ts, COUNT(*) AS devices, SUM(link != 'offline') AS online,
+                                      SUM(batches_completed) AS batches_completed, SUM(object_count) AS object_count
+                               FROM fleet_history WHERE ts >= ? GROUP BY ts ORDER BY ts''', (since,)).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+
+def fleet_broadcaster():
+    """GREEN thread: pushes changed devices to the dashboard and samples history once a minute."""
+    from .topics import topic_room
+    print("[Fleet] Starting fleet broadcaster green thread...")
+    watchdog.register('fleet-broadcaster', stall_after=10, critical=True)
+    next_history = time.time() + HISTORY_INTERVAL
+    while True:
+        watchdog.beat('fleet-broadcaster')
+        try:
+            with devices_lock:
+                changed = [_public(devices[n]) if n in devices else {"name": n, "removed": True} for n in dirty]
+                dirty.clear()
+            if changed:
+                socketio.emit('fleet_update', {"devices": changed, "full": False}, to=topic_room('fleet'))
+            if time.time() >= next_history:
+                next_history += HISTORY_INTERVAL
+                record_history()
+        except Exception as e:
+            print(f"[ERROR in fleet_broadcaster]: {e}")
+        socketio.sleep(PUSH_INTERVAL)
+
+
+# --- Routes ---
+
+@fleet_bp.route('/')
+def dashboard(): return render_template('fleet/dashboard.html')
+@fleet_bp.route('/api/fleet/devices', methods=['GET', 'POST'])
+def api_fleet_devices():
+    if request.method == 'GET': return jsonify(get_fleet_snapshot()['devices'])
+    data = request.get_json(force=True) or {}
+    try: add_device(data.get('name'), data.get('url'))
+    except ValueError as e: return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({"success": True, "message": f"Device '{data.get('name')}' added."})
+@fleet_bp.route('/api/fleet/devices/<name>', methods=['DELETE'])
+def api_fleet_remove_device(name):
+    if not remove_device(name): return jsonify({"success": False, "message": "Unknown device."}), 404
+    return jsonify({"success": True, "message": f"Device '{name}' removed."})
+@fleet_bp.route('/api/fleet/metrics')
+def api_fleet_metrics(): return jsonify(get_fleet_metrics())
+@fleet_bp.route('/api/fleet/history')
+def api_fleet_history():
+    hours = min(max(request.args.get('hours', 24, type=int), 1), HISTORY_RETENTION_DAYS * 24)
+    return jsonify(get_history(request.args.get('device'), hours))
+
+
+def init_app(app, seed_devices=()):
+    """Registers the fleet routes and topic and starts watching every configured device."""
+    from . import assets, topics
+    assets.init_app(app)
+    app.register_blueprint(fleet_bp)
+    topics.register_topic('fleet', 'fleet_update', snapshot=get_fleet_snapshot)
+    configured = {d['name']: d['url'] for d in get_configured_devices()}
+    configured.update(seed_devices)
+    for name, url in configured.items():
+        add_device(name, url)
+    socketio.start_background_task(target=fleet_broadcaster)
+    watchdog.start_supervisor()
+    print(f"[Fleet] Aggregator started with {len(configured)} devices.")
@@ -0,0 +1,209 @@
+"""
+Close-ahead gate control with learned timing.
+The gate sits upstream of the entry sensor and takes a while to shut, so a
+gate closed when the last box of a batch is counted lets the next one or two
+boxes slip through on a fast belt. With close-ahead on (config key
+'close_ahead'), the gate is told to close while the batch is still short: as
+soon as the boxes already past the gate (counted, plus between the sensors)
+and the boxes expected to slip through during the close latency add up to the
+target. If fewer boxes slip than expected, the gate reopens to top up.
+The close latency, the box interval at the entry sensor and the entry-to-exit
+transit time are learned for this line and kept in the 'gate_timing' setting:
+  - calibrate() closes the gate several times while boxes flow; the latest
+    box still reaching the entry sensor after a close command bounds the latency
+  - each close-ahead batch then nudges the latency: extra boxes mean the gate
+    closed too late, a top-up means it closed too early
+"""
+import json
+import random
+import threading
+import time
+
+from . import database
+
+SETTING_KEY = 'gate_timing'
+DEFAULTS = {"close_latency": 0.5, "entry_interval": None, "transit": None, "calibrated_at": None, "batches_learned": 0}
+# Gaps longer than this are pauses in the flow, not the belt's box interval.
+MAX_FLOW_GAP = 5.0
+EWMA_ALPHA = 0.2
+# Seconds of latency added or removed per box of error after a close-ahead batch.
+LEARN_GAIN = 0.25
+LATENCY_MIN, LATENCY_MAX = 0.05, 5.0
+# Boxes reaching the entry sensor this long after a close command count as having slipped through.
+SLIP_WINDOW = 3.0
+CALIBRATION_CYCLES = 8
+CALIBRATION_FLOW_TIMEOUT = 30
+
+params = dict(DEFAULTS)
+lock = threading.Lock()
+# The running close-ahead: set when the gate is closed early, cleared when the batch is settled.
+run = {"active": False, "needed": 0, "entries": 0, "closed_at": 0.0}
+belt = {"last_entry": None, "opened_at": 0.0}
+calibration = {"running": False, "closed_at": None, "slips": [], "cycles_done": 0, "result": None, "error": None}
+
+
+def load():
+    saved = database.get_setting(SETTING_KEY)
+    try:
+        params.update(json.loads(saved) if saved else {})
+    except ValueError:
+        print("[Gate Timing] Saved gate timing is invalid; using defaults.")
+
+
+def _save():
+    database.set_setting(SETTING_KEY, json.dumps(params))
+
+
+def _ewma(key, sample):
+    params[key] = sample if params[key] is None else params[key] + EWMA_ALPHA * (sample - params[key])
+
+
+def observe_entry(now):
+    """A box reached the entry sensor. Called by the poll loop with the state lock held."""
+    with lock:
+        last, belt['last_entry'] = belt['last_entry'], now
+        # Only a gap with the gate open the whole time is the belt's box interval.
+        if last is not None and last >= belt['opened_at'] and now - last <= MAX_FLOW_GAP and not run['active']:
+            _ewma('entry_interval', now - last)
+        if run['active']:
+            run['entries'] += 1
+        if calibration['closed_at'] is not None and now - calibration['closed_at'] <= SLIP_WINDOW:
+            calibration['slips'].append(now - calibration['closed_at'])
+
+
+def gate_opened(now):
+    belt['opened_at'] = now
+
+
+def observe_exit(now):
+    """The box that last entered reached the exit sensor."""
+    with lock:
+        if belt['last_entry'] is not None and now - belt['last_entry'] <= MAX_FLOW_GAP * 4:
+            _ewma('transit', now - belt['last_entry'])
+
+
+def expected_slip():
+    """Boxes expected to reach the entry sensor between the close command and the gate being shut."""
+    interval = params['entry_interval']
+    return params['close_latency'] / interval if interval else 0.0
+
+
+def should_close_ahead(count, on_belt, target):
+    """True once the boxes past the gate plus the expected slip cover the target."""
+    return not run['active'] and count + on_belt + int(expected_slip() + 0.5) >= target
+
+
+def start_close_ahead(count, on_belt, target, now):
+    with lock:
+        run.update(active=True, needed=max(0, target - count - on_belt), entries=0, closed_at=now)
+
+
+def short_batch_timeout():
+    """How long the belt may stay quiet after a close-ahead before the batch is treated as short."""
+    return params['close_latency'] + 1.5 * (params['transit'] or 2.0) + 1.0
+
+
+def is_short(now):
+    return run['active'] and belt['last_entry'] is not None and now - max(belt['last_entry'], run['closed_at']) > short_batch_timeout()
+
+
+def _learn(error):
+    """error > 0: more boxes came through than needed (closed too late); < 0: too few (too early)."""
+    if error and params['entry_interval']:
+        latency = params['close_latency'] + LEARN_GAIN * error * params['entry_interval']
+        params['close_latency'] = round(min(LATENCY_MAX, max(LATENCY_MIN, latency)), 3)
+    params['batches_learned'] += 1
+    print(f"[Gate Timing] Close-ahead was off by {error:+d} box(es); close latency now {params['close_latency']}s.")
+    # A top-up is learned on the poll thread; keep the SQLite write off it.
+    threading.Thread(target=_save, daemon=True, name='gate-timing-save').start()
+
+
+def top_up():
+    """The batch ran short after closing ahead: learn from it and let the caller reopen the gate."""
+    with lock:
+        error = run['entries'] - run['needed']
+        run['active'] = False
+    _learn(error)
+
+
+def finish_batch():
+    """Called at the batch reset, after every box of the batch (and any slip) has arrived."""
+    with lock:
+        if not run['active']:
+            return
+        error = run['entries'] - run['needed']
+        run['active'] = False
+    _learn(error)
+
+
+def cancel():
+    with lock:
+        run['active'] = False
+
+
+def get_status():
+    with lock:
+        return {"params": dict(params), "expected_slip": round(expected_slip(), 2), "close_ahead_active": run['active'],
+                "calibration": {k: v for k, v in calibration.items() if k not in ('closed_at', 'slips')}}
+
+
+def calibrate(cycles=CALIBRATION_CYCLES):
+    """
+    Closes the gate `cycles` times at random moments while boxes flow and takes
+    the latest slip as the close latency. Runs in its own thread; boxes that
+    pass meanwhile are not counted. Returns (ok, message).
+    """
+    try:
+        cycles = int(cycles)
+    except (TypeError, ValueError):
+        return False, "cycles must be a whole number"
+    if not 1 <= cycles <= 50:
+        return False, "cycles must be between 1 and 50"
+    from . import hardware
+    with hardware.state['lock']:
+        if calibration['running'] or hardware.state['changeover'] or hardware.state['closing_ahead'] or hardware.state['system_status'] not in ["Ready to Count", "Counting"]:
+            return False, "Calibrate between batches, with the line ready and boxes flowing."
+        calibration.update(running=True, cycles_done=0, result=None, error=None, slips=[])
+        previous_status, hardware.state['system_status'] = hardware.state['system_status'], "Calibrating Gate"
+    hardware.broadcast_status()
+    print(f"[Gate Timing] Calibrating the gate over {cycles} closes...")
+    threading.Thread(target=_calibration_run, args=(cycles, previous_status), daemon=True, name='gate-calibration').start()
+    return True, f"Calibrating over {cycles} gate closes. Keep boxes flowing."
+
+
+def _calibration_run(cycles, previous_status):
+    from . import hardware
+    delays = []
+    try:
+        for cycle in range(cycles):
+            hardware.open_gate()
+            seen = belt['last_entry']
+            waited = time.monotonic()
+            while belt['last_entry'] == seen:
+                if time.monotonic() - waited > CALIBRATION_FLOW_TIMEOUT:
+                    raise TimeoutError("No boxes reached the entry sensor; keep boxes flowing during calibration.")
+                time.sleep(0.01)
+            # Close at a random point of the box interval so the cycles sample different phases.
+            time.sleep(random.uniform(0, params['entry_interval'] or 1.0))
+            with lock:
+                calibration.update(closed_at=time.monotonic(), slips=[])
+            hardware.close_gate()
+            time.sleep(SLIP_WINDOW)
+            with lock:
+                delays.extend(calibration['slips']); calibration['closed_at'] = None
+            calibration['cycles_done'] = cycle + 1
+        if not delays:
+            raise ValueError("No box slipped through after any close; run calibration with boxes closer together.")
+        params.update(close_latency=round(min(LATENCY_MAX, max(LATENCY_MIN, max(delays))), 3), calibrated_at=time.time())
+        _save()
+        calibration['result'] = {"close_latency": params['close_latency'], "slips": len(delays), "cycles": cycles}
+        print(f"[Gate Timing] Calibrated close latency {params['close_latency']}s from {len(delays)} slips in {cycles} closes.")
+    except Exception as e:
+        calibration['error'] = str(e)
+        print(f"[Gate Timing] Calibration failed: {e}")
+    finally:
+        calibration.update(running=False, closed_at=None)
+        with hardware.state['lock']:
+            hardware.state['system_status'] = previous_status
+        hardware.open_gate()
+        hardware.broadcast_status()
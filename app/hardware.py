@@ -3,140 +3,491 @@ This is the final, definitive version of hardware.py.
 It runs in a native OS thread and communicates with the web server
 thread via a thread-safe queue instead of calling socketio.emit directly.
 It uses the correct 'lgpio' pin factory for the Raspberry Pi 5.
+gpiozero and pymodbus are imported during bring-up, not at module import,
+so the web server can start while the hardware is still initializing.
 """
-from gpiozero.pins.lgpio import LGPIOFactory
-from gpiozero import Device
-Device.pin_factory = LGPIOFactory()
-
 import time
+import random
+import operator
 import threading
-from pymodbus.client import ModbusSerialClient
-from pymodbus.exceptions import ModbusIOException
-from gpiozero import LED, Buzzer
 
-from . import database
+from . import analytics, coil_outputs, config, database, gate_timing, printing, realtime, startup, uplink, watchdog
 from app import status_queue
 
 PIN_CONFIG = { 'GATE_RELAY': {'pin': 22}, 'GREEN_LED': {'pin': 27}, 'RED_LED': {'pin': 23}, 'BUZZER': {'pin': 24} }
 MODBUS_CONFIG = {
     'port': '/dev/ttyUSB0', 'baudrate': 9600, 'parity': 'N', 'stopbits': 1, 'bytesize': 8,
-    'slave_id': 1, 'ENTRY_SENSOR_CH': 4, 'EXIT_SENSOR_CH': 7
+    'slave_id': 1, 'ENTRY_SENSOR_CH': 4, 'EXIT_SENSOR_CH': 7,
+    # Per-request timeout; at 9600 baud a healthy reply takes ~10 ms.
+    'timeout': 0.15,
+    # What to do with the gate while the sensors are blind: 'close' (hold boxes back) or 'hold' (leave it).
+    'fault_gate_action': 'close', 'fault_grace_seconds': 0.3,
+    # Where the outputs are wired: 'gpio' (PIN_CONFIG) or 'coils' of the I/O module (coil_outputs.py).
+    # Overridden per line with the 'output_backend' setting.
+    'outputs': 'gpio', 'GATE_RELAY_COIL': 1, 'GREEN_LED_COIL': 2, 'RED_LED_COIL': 3, 'BUZZER_COIL': 4,
 }
 state = {
     "object_count": 0, "batch_target": 20, "gate_wait_time": 10, "objects_on_belt": 0,
     "gate_status": "Closed", "box_state": "Idle", "system_status": "Initializing",
     "lock": threading.Lock(), "batches_completed": 0,
     "entry_sensor_status": False, "exit_sensor_status": False,
+    "config_version": 0, "config_pending": False,
+    "modbus_link": "up", "missed_windows": 0,
+    # Between reaching the target and reopening the gate the line is in changeover;
+    # boxes passing then are held in carried_over and start the next batch.
+    "changeover_carry": 1, "changeover": False, "carried_over": 0,
+    # With close_ahead on, the gate is closed before the target (gate_timing.py); boxes still
+    # slipping through while closing_ahead count into the batch.
+    "close_ahead": 0, "closing_ahead": False,
+    # Maintained by ble.py while the printer link is enabled.
+    "ble_connection_status": "Disconnected", "ble_printer_client": None,
+}
+
+# How long the gate stays closed during the startup self-test.
+STARTUP_GATE_HOLD_SECONDS = 2
+
+# Sensor sample window, and the Modbus link retry schedule used when a window fails.
+POLL_INTERVAL = 0.05
+LINK_FAST_RETRIES = 5
+LINK_FAST_RETRY_DELAY = 0.02
+LINK_BACKOFF_MAX = 0.5
+link = {
+    "state": "up", "port": None, "faults": 0, "consecutive_failures": 0, "missed_windows": 0,
+    "last_blind_ms": 0, "max_blind_ms": 0, "last_error": None, "down_since": 0, "gate_closed_by_fault": False,
+    "fault_gate_action": MODBUS_CONFIG['fault_gate_action'], "fault_grace_seconds": MODBUS_CONFIG['fault_grace_seconds'],
 }
 
 gate_relay, green_led, red_led, buzzer = None, None, None, None
 modbus_client, polling_thread = None, None
+# Serial port modbus_client was created for (link['port'] only changes once a slave has answered there).
+modbus_client_port = None
 modbus_lock = threading.Lock()
 
+# Entries in `state` that are live objects rather than JSON-serializable values.
+PRIVATE_STATE_KEYS = ('lock', 'ble_printer_client')
+# Status snapshots are tuples of the public values in this order, a fraction of
+# the size of a dict copy; status_dict() turns one back into a dict.
+STATUS_KEYS = tuple(k for k in state if k not in PRIVATE_STATE_KEYS)
+_status_values = operator.itemgetter(*STATUS_KEYS)
+
+def snapshot_state():
+    """Returns the public state as a tuple in STATUS_KEYS order. The caller must hold state['lock']."""
+    return _status_values(state)
+
+def status_dict(snapshot):
+    return dict(zip(STATUS_KEYS, snapshot))
+
 def broadcast_status():
     """THE FIX: Instead of emitting, put the current state into the thread-safe queue."""
     with state['lock']:
-        status_data = {k: v for k, v in state.items() if k != 'lock'}
-    status_queue.put(status_data)
+        snapshot = snapshot_state()
+    status_queue.put(snapshot)
 
-def initialize_hardware():
-    global gate_relay, green_led, red_led, buzzer, modbus_client, polling_thread
+def output_backend():
+    return database.get_setting('output_backend', MODBUS_CONFIG['outputs'])
+
+def sensor_backend():
+    """'modbus' (through-beam sensors on the I/O module) or 'vision' (camera, see vision.py)."""
+    return database.get_setting('sensor_backend', 'modbus')
+
+def initialize_gpio():
+    global gate_relay, green_led, red_led, buzzer
+    if output_backend() == 'coils':
+        gate_relay, green_led, red_led, buzzer = (coil_outputs.CoilOutput(name, MODBUS_CONFIG[f'{name}_COIL']) for name in ('GATE_RELAY', 'GREEN_LED', 'RED_LED', 'BUZZER'))
+        print(f"[Hardware] Outputs on Modbus coils {coil_outputs.get_status()['coils']}; written with the sensor poll.")
+        startup.mark('gpio_ready')
+        return True
     print("[Hardware] Initializing GPIO (using lgpio factory)...")
     try:
+        from gpiozero.pins.lgpio import LGPIOFactory
+        from gpiozero import Device, LED, Buzzer
+        Device.pin_factory = LGPIOFactory()
         gate_relay = LED(PIN_CONFIG['GATE_RELAY']['pin']); green_led = LED(PIN_CONFIG['GREEN_LED']['pin'])
         red_led = LED(PIN_CONFIG['RED_LED']['pin']); buzzer = Buzzer(PIN_CONFIG['BUZZER']['pin'])
         print("[Hardware] GPIO objects initialized successfully.")
     except Exception as e:
         print(f"[FATAL] GPIO FAILED: {e}");
-        with state['lock']: state['system_status'] = f"GPIO FAILED: {e}"; broadcast_status(); return False
+        with state['lock']: state['system_status'] = f"GPIO FAILED: {e}"
+        broadcast_status(); return False
+    startup.mark('gpio_ready')
+    return True
+
+def find_serial_ports():
+    """Candidate Modbus ports: the configured one first, then stable by-id links, then any USB/ACM serial device."""
+    import glob
+    candidates = [MODBUS_CONFIG['port']] + sorted(glob.glob('/dev/serial/by-id/*')) + sorted(glob.glob('/dev/ttyUSB*')) + sorted(glob.glob('/dev/ttyACM*'))
+    return list(dict.fromkeys(candidates))
+
+def _create_modbus_client(port):
+    from pymodbus.client import ModbusSerialClient
+    # Short timeout and no internal retries: the link state machine below does its own fast retries.
+    return ModbusSerialClient(port=port, baudrate=MODBUS_CONFIG['baudrate'], parity=MODBUS_CONFIG['parity'], stopbits=MODBUS_CONFIG['stopbits'], bytesize=MODBUS_CONFIG['bytesize'], timeout=MODBUS_CONFIG['timeout'], retries=0)
+
+def _open_port(port):
+    """Returns a connected client on the port, reusing the current one if it is on that port; None if it will not open."""
+    global modbus_client, modbus_client_port
+    if modbus_client is None or modbus_client_port != port:
+        if modbus_client is not None: modbus_client.close()
+        modbus_client, modbus_client_port = _create_modbus_client(port), port
+    return modbus_client if modbus_client.connect() else None
+
+def _probe_slave(client):
+    """One discrete input read, so a port that opens but has no I/O module behind it is not kept."""
+    try:
+        rr = client.read_discrete_inputs(address=0, count=1, slave=MODBUS_CONFIG['slave_id'])
+        return not rr.isError()
+    except Exception:
+        return False
+
+def _connect_modbus(ports):
+    """
+    Tries each port in turn and keeps the first one whose slave answers a probe read.
+    If no slave answers (e.g. the module is still powering up), the first port that
+    opened is kept and the poll loop's link fault handling retries; once its fast
+    retries fail, every candidate is probed again. Caller holds modbus_lock.
+    """
+    fallback = None
+    for port in ports:
+        client = _open_port(port)
+        if client is None: continue
+        if _probe_slave(client):
+            if link['port'] != port: print(f"[Modbus] Using serial port {port}.")
+            link['port'] = port
+            return True
+        fallback = fallback or port
+    if fallback is None or _open_port(fallback) is None: return False
+    if link['port'] != fallback: print(f"[Modbus] No answer from slave {MODBUS_CONFIG['slave_id']} on {', '.join(ports)}; keeping {fallback}.")
+    link['port'] = fallback
+    return True
+
+def initialize_modbus():
     print("[Hardware] Initializing Modbus client...")
     try:
-        modbus_client = ModbusSerialClient(port=MODBUS_CONFIG['port'], baudrate=MODBUS_CONFIG['baudrate'], parity=MODBUS_CONFIG['parity'], stopbits=MODBUS_CONFIG['stopbits'], bytesize=MODBUS_CONFIG['bytesize'], timeout=2)
-        if not modbus_client.connect(): raise ConnectionError(f"Failed to connect to Modbus device at {MODBUS_CONFIG['port']}")
+        with modbus_lock:
+            if not _connect_modbus(find_serial_ports()): raise ConnectionError(f"Failed to connect to Modbus device at {MODBUS_CONFIG['port']}")
         print("[Hardware] Modbus connected.")
     except Exception as e:
         print(f"[FATAL] MODBUS FAILED: {e}")
-        with state['lock']: state['system_status'] = f"MODBUS FAILED: {e}"; broadcast_status(); return False
-    polling_thread = threading.Thread(target=poll_sensors_loop, daemon=True); polling_thread.start()
+        with state['lock']: state['system_status'] = f"MODBUS FAILED: {e}"
+        broadcast_status(); return False
+    startup.mark('modbus_connected')
     return True
 
-def poll_sensors_loop():
-    print("[Polling] Sensor polling thread started.")
+def start_polling_thread():
+    global polling_thread
+    polling_thread = threading.Thread(target=poll_sensors_loop, daemon=True, name='sensor-poll'); polling_thread.start()
+    startup.mark('polling_started')
+
+def read_sensors():
+    """Reads one sample window. Returns (entry_on, exit_on); raises on any link or protocol error."""
     entry_ch_index, exit_ch_index = MODBUS_CONFIG['ENTRY_SENSOR_CH'] - 1, MODBUS_CONFIG['EXIT_SENSOR_CH'] - 1
     count_to_read = max(entry_ch_index, exit_ch_index) + 1
+    with modbus_lock:
+        if not modbus_client or not modbus_client.connected: raise ConnectionError("Modbus client disconnected")
+        if realtime.status['active']:
+            bits = realtime.read_discrete_inputs_raw(modbus_client.socket, MODBUS_CONFIG['timeout'])
+            return bool(bits[entry_ch_index // 8] >> (entry_ch_index % 8) & 1), bool(bits[exit_ch_index // 8] >> (exit_ch_index % 8) & 1)
+        rr = modbus_client.read_discrete_inputs(address=0, count=count_to_read, slave=MODBUS_CONFIG['slave_id'])
+    if rr.isError() or not hasattr(rr, 'bits') or len(rr.bits) < count_to_read: raise IOError(f"Invalid or short response from Modbus: {rr}")
+    return rr.bits[entry_ch_index], rr.bits[exit_ch_index]
+
+def write_outputs():
+    """Coil backend: sends this window's output changes as one write_coils frame. Raises on any link or protocol error."""
+    frame = coil_outputs.pending_frame(time.monotonic())
+    if frame is None: return
+    address, bits = frame
+    with modbus_lock:
+        if not modbus_client or not modbus_client.connected: raise ConnectionError("Modbus client disconnected")
+        try:
+            if realtime.status['active']:
+                realtime.write_coils_raw(modbus_client.socket, MODBUS_CONFIG['slave_id'], address, bits)
+            else:
+                rr = modbus_client.write_coils(address=address, values=bits, slave=MODBUS_CONFIG['slave_id'])
+                if rr.isError(): raise IOError(f"write_coils failed: {rr}")
+        except Exception as e:
+            coil_outputs.failed(e); raise
+    coil_outputs.acknowledged(bits)
+
+def process_sensor_sample(entry_sensor_on, exit_sensor_on):
+    """Runs the box state machine for one sensor sample. Independent of where the sample came from."""
+    start_batch = gate_action = False
+    with state['lock']:
+        state_changed = False
+        if state['entry_sensor_status'] != entry_sensor_on: state['entry_sensor_status'] = entry_sensor_on; state_changed = True
+        if state['exit_sensor_status'] != exit_sensor_on: state['exit_sensor_status'] = exit_sensor_on; state_changed = True
+        current_box_state = state['box_state']
+        if current_box_state == "Idle" and entry_sensor_on:
+            state['box_state'] = "Entering"; state['objects_on_belt'] += 1; state_changed = True
+            gate_timing.observe_entry(time.monotonic()); gate_action = _check_close_ahead()
+        elif current_box_state == "Entering" and not entry_sensor_on: state['box_state'] = "Inside"
+        elif current_box_state == "Inside" and exit_sensor_on: state['box_state'] = "Exiting"
+        elif current_box_state == "Exiting" and not exit_sensor_on:
+            state['box_state'] = "Idle"; state['objects_on_belt'] = max(0, state['objects_on_belt'] - 1)
+            gate_timing.observe_exit(time.monotonic())
+            if state['changeover']:
+                if state['changeover_carry']:
+                    state['carried_over'] += 1
+                    analytics.record_box(state['batches_completed'] + 1, state['carried_over'])
+                    uplink.record('box', batch=state['batches_completed'] + 1, count=state['carried_over'], carried=True)
+                    print(f"Object Passed during changeover. Carried to next batch: {state['carried_over']}")
+            elif (state['gate_status'] == "Open" or state['closing_ahead']) and state['system_status'] in ["Ready to Count", "Counting"]:
+                state['object_count'] += 1; state['system_status'] = "Counting"
+                analytics.record_box(state['batches_completed'] + 1, state['object_count'])
+                uplink.record('box', batch=state['batches_completed'] + 1, count=state['object_count'])
+                print(f"Object Passed. Count: {state['object_count']}"); buzzer.beep(on_time=1.0, n=1, background=True)
+                start_batch = _begin_changeover() or False
+                if not start_batch: gate_action = _check_close_ahead()
+            state_changed = True
+        elif state['closing_ahead'] and not state['changeover'] and not state['objects_on_belt'] and gate_timing.is_short(time.monotonic()):
+            # Fewer boxes slipped through than expected: the gate closed too early, so reopen it to top up.
+            state['closing_ahead'] = False; gate_action = 'open'
+            print(f"Closed ahead too early: {state['object_count']} of {state['batch_target']}. Reopening the gate to top up.")
+    if start_batch: threading.Thread(target=handle_batch_completion, args=start_batch, daemon=True).start()
+    if gate_action == 'close': close_gate()
+    elif gate_action == 'open': gate_timing.top_up(); open_gate()
+    if state_changed: broadcast_status()
+
+def _check_close_ahead():
+    """Starts a close-ahead once the boxes past the gate plus the expected slip cover the target. Caller holds state['lock']."""
+    if (not state['close_ahead'] or state['closing_ahead'] or state['changeover'] or state['gate_status'] != "Open"
+            or state['system_status'] not in ["Ready to Count", "Counting"]):
+        return False
+    if not gate_timing.should_close_ahead(state['object_count'], state['objects_on_belt'], state['batch_target']): return False
+    state['closing_ahead'] = True
+    gate_timing.start_close_ahead(state['object_count'], state['objects_on_belt'], state['batch_target'], time.monotonic())
+    print(f"Closing ahead at {state['object_count']} counted + {state['objects_on_belt']} on the belt (expected slip {gate_timing.expected_slip():.1f}).")
+    return 'close'
+
+def _link_retry_delay(failures):
+    """Fast fixed retries first, then exponential backoff with jitter, capped well under a second."""
+    if failures <= LINK_FAST_RETRIES: return LINK_FAST_RETRY_DELAY
+    delay = min(LINK_BACKOFF_MAX, LINK_FAST_RETRY_DELAY * 2 ** (failures - LINK_FAST_RETRIES))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def handle_link_fault(error):
+    """One failed poll window: mark the link down, apply the safe gate action and try to reconnect."""
+    now = time.monotonic()
+    if link['state'] == "up":
+        link.update(state="down", down_since=now, consecutive_failures=0, gate_closed_by_fault=False); link['faults'] += 1
+        print(f"[Modbus] Link fault: {error}")
+        with state['lock']: state['modbus_link'] = "down"
+        broadcast_status()
+    link['consecutive_failures'] += 1; link['last_error'] = str(error)
+    if not link['gate_closed_by_fault'] and link['fault_gate_action'] == "close" and now - link['down_since'] >= link['fault_grace_seconds']:
+        with state['lock']: should_close = state['gate_status'] == "Open"
+        # Boxes passing while the sensors are blind would go uncounted, so hold them back.
+        if should_close: print("[Modbus] Link still down; closing gate until it recovers."); close_gate(); link['gate_closed_by_fault'] = True
+    time.sleep(_link_retry_delay(link['consecutive_failures']))
+    try:
+        with modbus_lock:
+            if modbus_client: modbus_client.close()
+            # After the fast retries fail the adapter may have been re-enumerated under another name.
+            ports = [link['port']] if link['consecutive_failures'] <= LINK_FAST_RETRIES else find_serial_ports()
+            _connect_modbus(ports)
+    except Exception as e:
+        link['last_error'] = str(e)
+
+def handle_link_recovered():
+    blind_seconds = time.monotonic() - link['down_since']
+    missed = max(1, round(blind_seconds / POLL_INTERVAL))
+    link.update(state="up", last_blind_ms=round(blind_seconds * 1000)); link['missed_windows'] += missed
+    coil_outputs.invalidate()
+    link['max_blind_ms'] = max(link['max_blind_ms'], link['last_blind_ms'])
+    print(f"[Modbus] Link recovered after {link['last_blind_ms']} ms ({missed} missed windows, {link['consecutive_failures']} retries).")
+    with state['lock']:
+        state['modbus_link'] = "up"; state['missed_windows'] = link['missed_windows']
+        reopen = link['gate_closed_by_fault'] and state['system_status'] in ["Ready to Count", "Counting"]
+    link['gate_closed_by_fault'] = False
+    if reopen: open_gate()
+    else: broadcast_status()
+
+def get_link_status():
+    status = {k: v for k, v in link.items() if k != 'down_since'}
+    if link['state'] != "up": status['current_blind_ms'] = round((time.monotonic() - link['down_since']) * 1000)
+    return status
+
+def _window_failed(error):
+    try: handle_link_fault(error)
+    except Exception as fault_error: print(f"[ERROR in poll_sensors_loop]: {fault_error}"); time.sleep(LINK_BACKOFF_MAX)
+    # The sensors are blind anyway, so this is slack time too.
+    realtime.collect_in_slack(realtime.GC_MIN_SLACK)
+
+def poll_sensors_loop():
+    print("[Polling] Sensor polling thread started.")
+    # The gate fault action can be overridden per line with the 'modbus_fault_gate_action' setting.
+    link['fault_gate_action'] = database.get_setting('modbus_fault_gate_action', MODBUS_CONFIG['fault_gate_action'])
+    watchdog.register('sensor-poll', stall_after=2, critical=True)
+    coil_backend = bool(coil_outputs.outputs)
+    if realtime.settings['enabled'] and realtime.enter_realtime():
+        realtime.prepare_request(MODBUS_CONFIG['slave_id'], max(MODBUS_CONFIG['ENTRY_SENSOR_CH'], MODBUS_CONFIG['EXIT_SENSOR_CH']))
+    # Windows are scheduled on absolute deadlines so a late window does not shift all later ones.
+    deadline = time.monotonic()
     while True:
+        window_start = time.monotonic(); watchdog.beat('sensor-poll')
+        try:
+            entry_sensor_on, exit_sensor_on = read_sensors()
+        except Exception as e:
+            _window_failed(e); deadline = time.monotonic()
+            continue
         try:
-            with modbus_lock:
-                if not modbus_client or not modbus_client.connected:
-                    print("[Polling] Modbus client disconnected. Reconnecting..."); modbus_client.connect(); time.sleep(5); continue
-                rr = modbus_client.read_discrete_inputs(address=0, count=count_to_read, slave=MODBUS_CONFIG['slave_id'])
-                if rr.isError() or not hasattr(rr, 'bits') or len(rr.bits) < count_to_read:
-                    print(f"[POLLING WARNING] Invalid or short response from Modbus: {rr}"); time.sleep(1); continue
-            inputs = rr.bits; entry_sensor_on = inputs[entry_ch_index]; exit_sensor_on = inputs[exit_ch_index]
-            with state['lock']:
-                state_changed = False
-                if state['entry_sensor_status'] != entry_sensor_on: state['entry_sensor_status'] = entry_sensor_on; state_changed = True
-                if state['exit_sensor_status'] != exit_sensor_on: state['exit_sensor_status'] = exit_sensor_on; state_changed = True
-                current_box_state = state['box_state']
-                if current_box_state == "Idle" and entry_sensor_on: state['box_state'] = "Entering"; state['objects_on_belt'] += 1; state_changed = True
-                elif current_box_state == "Entering" and not entry_sensor_on: state['box_state'] = "Inside"
-                elif current_box_state == "Inside" and exit_sensor_on: state['box_state'] = "Exiting"
-                elif current_box_state == "Exiting" and not exit_sensor_on:
-                    state['box_state'] = "Idle"; state['objects_on_belt'] = max(0, state['objects_on_belt'] - 1)
-                    if state['gate_status'] == "Open" and state['system_status'] in ["Ready to Count", "Counting"]:
-                        state['object_count'] += 1; state['system_status'] = "Counting"
-                        count, target = state['object_count'], state['batch_target']
-                        print(f"Object Passed. Count: {count}"); buzzer.beep(on_time=1.0, n=1, background=True)
-                        if count >= target: threading.Thread(target=handle_batch_completion, daemon=True).start()
-                    state_changed = True
-                if state_changed: broadcast_status()
-            time.sleep(0.05)
+            if link['state'] != "up": handle_link_recovered()
+            process_sensor_sample(entry_sensor_on, exit_sensor_on)
         except Exception as e:
             print(f"[ERROR in poll_sensors_loop]: {e}")
-            with state['lock']: state['system_status'] = "MODBUS POLL FAILED"; broadcast_status(); time.sleep(5)
+        if coil_backend:
+            # Outputs decided in this window go out in the same bus turn as its input read.
+            try: write_outputs()
+            except Exception as e:
+                _window_failed(e); deadline = time.monotonic()
+                continue
+        window_end = time.monotonic()
+        realtime.record_window(window_start - deadline, window_end - window_start, POLL_INTERVAL)
+        deadline = max(deadline + POLL_INTERVAL, window_end)
+        realtime.collect_in_slack(deadline - window_end)
+        time.sleep(max(0.0, deadline - time.monotonic()))
 
 def system_startup():
+    """
+    Brings the line up as fast as possible: Modbus is connected in a helper thread
+    while GPIO initializes, and the initial gate-closed hold overlaps the Modbus
+    bring-up instead of running after it. The gate reopens from a timer.
+    A camera line has no Modbus module; the vision backend replaces the poll loop.
+    """
     print("--- [STARTUP THREAD] Started ---")
     try:
+        print("[STARTUP THREAD] Loading configuration from database...")
+        saved = config.get_config()
         with state['lock']:
-            print("[STARTUP THREAD] Loading configuration from database...")
-            target = database.get_setting('batch_target', '20'); wait_time = database.get_setting('gate_wait_time', '10')
-            state['batch_target'] = int(target); state['gate_wait_time'] = int(wait_time)
+            state.update(saved['values']); state['config_version'] = saved['version']
         print(f"[STARTUP THREAD] Config loaded: Batch Target={state['batch_target']}, Wait Time={state['gate_wait_time']}")
+        startup.mark('config_loaded')
+        gate_timing.load()
         broadcast_status()
         print("[STARTUP THREAD] Initializing hardware...")
-        if not initialize_hardware(): print("[STARTUP THREAD] Hardware initialization failed. Startup aborted."); return
-        print("[STARTUP THREAD] Performing initial gate sequence..."); close_gate(); time.sleep(2)
+        vision_line = sensor_backend() == 'vision'
+        if vision_line and output_backend() == 'coils':
+            # Coils are only written by the Modbus poll loop, which a camera line does not run.
+            print("[FATAL] CONFIG FAILED: sensor_backend 'vision' needs output_backend 'gpio'. Startup aborted.")
+            with state['lock']: state['system_status'] = "CONFIG FAILED: camera counting needs GPIO outputs (set output_backend to gpio)"
+            broadcast_status(); return
+        modbus_result = {"ok": vision_line}
+        modbus_thread = threading.Thread(target=lambda: modbus_result.update(ok=initialize_modbus()), daemon=True, name='modbus-startup')
+        if not vision_line: modbus_thread.start()
+        if not initialize_gpio(): print("[STARTUP THREAD] Hardware initialization failed. Startup aborted."); return
+        print("[STARTUP THREAD] Performing initial gate sequence..."); close_gate()
+        gate_closed_at = time.monotonic()
+        if not vision_line: modbus_thread.join()
+        if not modbus_result.get('ok'): print("[STARTUP THREAD] Hardware initialization failed. Startup aborted."); return
+        if vision_line:
+            from . import vision
+            vision.start(); startup.mark('polling_started')
+        else: start_polling_thread()
+        remaining_hold = STARTUP_GATE_HOLD_SECONDS - (time.monotonic() - gate_closed_at)
+        threading.Timer(max(0.0, remaining_hold), finish_startup).start()
+    except Exception as e:
+        print(f"--- [FATAL ERROR in STARTUP THREAD]: {e} ---")
+        with state['lock']: state['system_status'] = "STARTUP FAILED"
+        broadcast_status()
+
+def finish_startup():
+    """Ends the initial gate sequence and opens the line for counting."""
+    try:
         buzzer.beep(on_time=0.1, off_time=0.2, n=3, background=True)
         open_gate()
         with state['lock']: state['system_status'] = "Ready to Count"
-        broadcast_status(); print("--- [STARTUP THREAD] System is ready. ---")
+        broadcast_status(); startup.mark('ready_to_count')
+        print("--- [STARTUP THREAD] System is ready. ---"); startup.print_profile()
     except Exception as e:
         print(f"--- [FATAL ERROR in STARTUP THREAD]: {e} ---")
-        with state['lock']: state['system_status'] = "STARTUP FAILED"; broadcast_status()
+        with state['lock']: state['system_status'] = "STARTUP FAILED"
+        broadcast_status()
 
 # (All other functions are unchanged)
-def get_diagnostics_config(): return {"ENTRY SENSOR": {"channel": f"Modbus CH {MODBUS_CONFIG.get('ENTRY_SENSOR_CH', 'N/A')}"},"EXIT SENSOR": {"channel": f"Modbus CH {MODBUS_CONFIG.get('EXIT_SENSOR_CH', 'N/A')}"},"GATE RELAY": {"channel": f"GPIO {PIN_CONFIG.get('GATE_RELAY', {}).get('pin', 'N/A')}"},"GREEN LED": {"channel": f"GPIO {PIN_CONFIG.get('GREEN_LED', {}).get('pin', 'N/A')}"},"RED LED": {"channel": f"GPIO {PIN_CONFIG.get('RED_LED', {}).get('pin', 'N/A')}"},"BUZZER": {"channel": f"GPIO {PIN_CONFIG.get('BUZZER', {}).get('pin', 'N/A')}"}}
+def get_diagnostics_config():
+    coils = output_backend() == 'coils'
+    def output(name): return {"channel": f"Modbus Coil {MODBUS_CONFIG.get(f'{name}_COIL', 'N/A')}" if coils else f"GPIO {PIN_CONFIG.get(name, {}).get('pin', 'N/A')}"}
+    return {"ENTRY SENSOR": {"channel": f"Modbus CH {MODBUS_CONFIG.get('ENTRY_SENSOR_CH', 'N/A')}"},"EXIT SENSOR": {"channel": f"Modbus CH {MODBUS_CONFIG.get('EXIT_SENSOR_CH', 'N/A')}"},"GATE RELAY": output('GATE_RELAY'),"GREEN LED": output('GREEN_LED'),"RED LED": output('RED_LED'),"BUZZER": output('BUZZER')}
 def close_gate():
     with state['lock']:
-        if state['gate_status'] != "Closed": gate_relay.on(); state['gate_status'] = "Closed"; update_lights(); print("Gate Closed.")
+        if state['gate_status'] != "Closed": gate_relay.on(); state['gate_status'] = "Closed"; update_lights(); analytics.record_gate(True); print("Gate Closed.")
     broadcast_status()
 def open_gate():
     with state['lock']:
-        if state['gate_status'] != "Open": gate_relay.off(); state['gate_status'] = "Open"; update_lights(); print("Gate Open.")
+        if state['gate_status'] != "Open": gate_relay.off(); state['gate_status'] = "Open"; update_lights(); gate_timing.gate_opened(time.monotonic()); analytics.record_gate(False); print("Gate Open.")
     broadcast_status()
+def apply_pending_config():
+    """Applies a saved config change at a safe point: no batch in progress. Returns True if applied."""
+    with state['lock']:
+        if state['object_count'] > 0: return False
+        change = config.take_pending()
+        if change is None: return False
+        state.update(change['values']); state['config_version'] = change['version']; state['config_pending'] = False
+    broadcast_status(); print(f"[Config] Applied version {change['version']}: {change['values']}")
+    return True
+def config_saved():
+    """Called once a config change is parked; applies it now if no batch is in progress. Returns True if applied."""
+    with state['lock']: state['config_pending'] = config.has_pending()
+    if apply_pending_config(): return True
+    broadcast_status(); return False
+def reset_counter():
+    with state['lock']:
+        state['object_count'] = 0
+        if state['system_status'] not in ["Ready to Count", "Counting"]: state['system_status'] = "Ready to Count"
+        # A reset mid close-ahead starts the batch over, so the gate closed ahead must reopen.
+        reopen = state['closing_ahead'] and not state['changeover']; state['closing_ahead'] = False
+    if reopen: gate_timing.cancel(); open_gate()
+    if not apply_pending_config(): broadcast_status()
+def manual_control(device, action):
+    """Drives one output from the Manual Control page. Returns (ok, message)."""
+    relay_map = {'green_led': green_led, 'red_led': red_led}
+    if device == 'gate':
+        if action == 'on': open_gate()
+        elif action == 'off': close_gate()
+        return True, f"Gate action '{action}' triggered."
+    elif device in relay_map and relay_map[device]:
+        if action == 'on': relay_map[device].on()
+        elif action == 'off': relay_map[device].off()
+        return True, f"{device} turned {action}."
+    elif device == 'buzzer' and action == 'beep' and buzzer:
+        buzzer.beep(on_time=0.2, n=1, background=True)
+        return True, "Buzzer beeped."
+    return False, "Invalid device or action."
 def update_lights():
     if state['gate_status'] == "Open": green_led.on(); red_led.off()
     else: green_led.off(); red_led.on()
-def handle_batch_completion():
+def _begin_changeover():
+    """Closes the batch if the target is reached. Caller holds state['lock']. Returns (batch_number, count) or None."""
+    if state['changeover'] or state['object_count'] < state['batch_target']: return None
+    # Decided in the same critical section as the count, so the very next box already belongs to the next batch.
+    state['changeover'] = True; state['system_status'] = "Batch Complete: Closing Gate"; state['batches_completed'] += 1
+    return state['batches_completed'], state['object_count']
+def handle_batch_completion(batch_number, batch_count):
     print("Batch complete.")
-    with state['lock']: state['system_status'] = "Batch Complete: Closing Gate"; state['batches_completed'] += 1
-    broadcast_status(); buzzer.beep(on_time=2.0, n=1, background=True); time.sleep(0.5); close_gate()
+    analytics.record_batch(batch_number, batch_count); uplink.record('batch', batch=batch_number, count=batch_count)
+    broadcast_status(); buzzer.beep(on_time=2.0, n=1, background=True)
+    try: printing.enqueue_batch_label(batch_number, batch_count)
+    except Exception as e: print(f"[ERROR queueing batch label]: {e}")
+    # A gate closed ahead of the target is already shut; otherwise give the last box time to clear it.
+    if not state['closing_ahead']: time.sleep(0.5)
+    close_gate()
     with state['lock']: wait_time = state['gate_wait_time']; state['system_status'] = f"Waiting for {wait_time}s"
     broadcast_status(); print(f"Waiting for {wait_time} seconds..."); time.sleep(wait_time)
     print("Resetting for next batch.")
+    # Every box that slipped through after a close-ahead has arrived by now; learn from the count.
+    gate_timing.finish_batch()
     with state['lock']: state['object_count'] = 0; state['system_status'] = "Ready to Count"
-    broadcast_status(); buzzer.beep(on_time=0.1, off_time=0.2, n=3, background=True); open_gate()
+    # Between batches is the safe point for configuration changes saved during this batch.
+    apply_pending_config()
+    with state['lock']:
+        # The reset keeps the boxes carried over during the changeover instead of zeroing the count.
+        carried, state['carried_over'], state['changeover'] = state['carried_over'], 0, False
+        state['closing_ahead'] = False
+        state['object_count'] = carried
+        if carried: state['system_status'] = "Counting"; print(f"Next batch starts at {carried} carried-over boxes.")
+        next_batch = _begin_changeover()
+    broadcast_status(); buzzer.beep(on_time=0.1, off_time=0.2, n=3, background=True)
+    if next_batch: handle_batch_completion(*next_batch)
+    else: open_gate()
 def get_live_io_status():
     status = {}
     with modbus_lock:
@@ -156,6 +507,12 @@ def get_live_io_status():
             status['RED_LED'] = red_led.value; status['BUZZER'] = buzzer.value
         else: status["OUTPUTS"] = "GPIO Not Initialized"
     except Exception as e: status["OUTPUTS"] = str(e)
+    if coil_outputs.outputs: status["OUTPUT_COILS"] = coil_outputs.get_status()
+    status["MODBUS_LINK"] = get_link_status()
+    if sensor_backend() == 'vision':
+        from . import vision
+        status["VISION"] = vision.get_status()
+    status["POLL_TIMING"] = realtime.get_poll_timing()
     return status
 def cleanup_resources():
     print("Cleaning up resources...")
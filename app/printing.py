@@ -0,0 +1,172 @@
+"""
+This module owns the persistent BLE label print queue.
+Labels are rendered once into ESC/POS bytes when a batch completes and
+stored in SQLite, so a disconnected printer never loses a label. The BLE
+connection manager in ble.py drains the queue whenever it has a link.
+"""
+import time
+import threading
+
+from . import database
+
+# Give up on a job after this many failed write attempts.
+MAX_PRINT_ATTEMPTS = 10
+
+# Set whenever a new job is queued so the BLE manager wakes up immediately.
+jobs_available = threading.Event()
+
+PRINTER_DEFAULTS = {
+    'enabled': False, 'delay_ms': 0,
+    'var1': 'Batch', 'val1': '{batch}',
+    'var2': 'QR', 'val2': 'BATCH-{batch}-{count}',
+}
+
+ESC_INIT = b'\x1b\x40'
+ESC_ALIGN_CENTER = b'\x1b\x61\x01'
+ESC_ALIGN_LEFT = b'\x1b\x61\x00'
+ESC_FEED_LINES = b'\x1b\x64'
+
+
+def wake_printer():
+    """Wakes the BLE manager in this process (see counter_link 'print_wake' for the split install)."""
+    jobs_available.set()
+
+
+def get_printer_config():
+    """Reads the label configuration saved from the Printer Configure page."""
+    config = {}
+    for key, default in PRINTER_DEFAULTS.items():
+        value = database.get_setting(f'printer_{key}')
+        if value is None:
+            config[key] = default
+        elif key == 'enabled':
+            config[key] = value == '1'
+        elif key == 'delay_ms':
+            config[key] = int(value) if value.isdigit() else 0
+        else:
+            config[key] = value
+    return config
+
+
+def save_printer_config(config):
+    """Saves the label configuration. Unknown keys are ignored."""
+    for key in PRINTER_DEFAULTS:
+        if key not in config:
+            continue
+        value = config[key]
+        if key == 'enabled':
+            value = '1' if value in (True, 'true', 'on', '1', 1) else '0'
+        elif key == 'delay_ms':
+            value = str(max(0, int(value or 0)))
+        database.set_setting(f'printer_{key}', value)
+
+
+def _fill_placeholders(template, fields):
+    for name, value in fields.items():
+        template = template.replace('{' + name + '}', str(value))
+    return template
+
+
+def _qr_code(data):
+    """Builds the ESC/POS GS ( k sequence for a model 2 QR code."""
+    payload = data.encode('ascii', errors='replace')
+    store_len = len(payload) + 3
+    return (
+        b'\x1d\x28\x6b\x04\x00\x31\x41\x32\x00' +   # model 2
+        b'\x1d\x28\x6b\x03\x00\x31\x43\x06' +       # module size 6
+        b'\x1d\x28\x6b\x03\x00\x31\x45\x31' +       # error correction M
+        b'\x1d\x28\x6b' + bytes([store_len & 0xFF, store_len >> 8]) + b'\x31\x50\x30' + payload +
+        b'\x1d\x28\x6b\x03\x00\x31\x51\x30'         # print the stored symbol
+    )
+
+
+def render_label(batch_number, count, config, timestamp=None):
+    """Renders one batch label into the printer's ESC/POS byte format."""
+    timestamp = timestamp or time.time()
+    fields = {
+        'batch': batch_number, 'count': count,
+        'date': time.strftime('%d/%m/%Y', time.localtime(timestamp)),
+        'time': time.strftime('%H:%M:%S', time.localtime(timestamp)),
+    }
+    lines = [
+        f"{config['var1']}: {_fill_placeholders(config['val1'], fields)}",
+        f"Count: {count}",
+        f"{fields['date']} {fields['time']}",
+    ]
+    text = '\n'.join(lines) + '\n'
+    label = ESC_INIT + ESC_ALIGN_CENTER + text.encode('ascii', errors='replace')
+    qr_data = _fill_placeholders(config['val2'], fields)
+    if qr_data:
+        label += _qr_code(qr_data)
+    return label + ESC_ALIGN_LEFT + ESC_FEED_LINES + bytes([3])
+
+
+def enqueue_batch_label(batch_number, count):
+    """Renders and stores a label for a completed batch, if printing is enabled."""
+    config = get_printer_config()
+    if not config['enabled']:
+        return None
+    job_id = _insert_job(render_label(batch_number, count, config), batch_number)
+    print(f"[Printer] Queued label job {job_id} for batch {batch_number}.")
+    return job_id
+
+
+def enqueue_test_print(text):
+    """Queues plain text from the Bluetooth page, whether or not batch labels are enabled."""
+    payload = ESC_INIT + text.encode('ascii', errors='replace') + b'\n' + ESC_FEED_LINES + bytes([3])
+    job_id = _insert_job(payload)
+    print(f"[Printer] Queued test print job {job_id}.")
+    return job_id
+
+
+def _insert_job(payload, batch_number=None):
+    conn = database.get_db_connection()
+    cursor = conn.execute(
+        "INSERT INTO print_jobs (created_at, batch_number, payload) VALUES (?, ?, ?)",
+        (time.time(), batch_number, payload)
+    )
+    conn.commit()
+    job_id = cursor.lastrowid
+    conn.close()
+    jobs_available.set()
+    return job_id
+
+
+def get_pending_jobs(limit=20):
+    """Returns the oldest pending jobs as (id, payload) tuples."""
+    conn = database.get_db_connection()
+    rows = conn.execute(
+        "SELECT id, payload FROM print_jobs WHERE status = 'pending' ORDER BY id LIMIT ?", (limit,)
+    ).fetchall()
+    conn.close()
+    return [(row['id'], bytes(row['payload'])) for row in rows]
+
+
+def mark_job_printed(job_id):
+    conn = database.get_db_connection()
+    conn.execute("UPDATE print_jobs SET status = 'printed', printed_at = ? WHERE id = ?", (time.time(), job_id))
+    conn.commit()
+    conn.close()
+
+
+def mark_job_failed(job_id, error):
+    """Records a failed attempt. The job stays pending until it runs out of attempts."""
+    conn = database.get_db_connection()
+    conn.execute('''
+        UPDATE print_jobs
+        SET attempts = attempts + 1, last_error = ?,
+            status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END
+        WHERE id = ?
+    ''', (str(error), MAX_PRINT_ATTEMPTS, job_id))
+    conn.commit()
+    conn.close()
+
+
+def get_queue_summary():
+    """Returns job counts per status for the status pages."""
+    conn = database.get_db_connection()
+    rows = conn.execute("SELECT status, COUNT(*) AS total FROM print_jobs GROUP BY status").fetchall()
+    conn.close()
+    summary = {'pending': 0, 'printed': 0, 'failed': 0}
+    summary.update({row['status']: row['total'] for row in rows})
+    return summary
@@ -0,0 +1,145 @@
+"""
+Built-in sampling profiler for finding hot spots on the running Pi.
+While enabled, a native OS thread wakes every `interval` seconds, reads the
+current stack of every thread with sys._current_frames() and counts it in
+folded form ("thread;outer (file:line);...;leaf"). Nothing is hooked into the
+profiled code, so the cost is one stack walk per sample (~1% at 100 Hz) and
+zero while stopped. The result is served as folded stacks, which
+flamegraph.pl, speedscope.app and inferno read directly.
+It is a wall-clock profile: native threads blocked in sleep or I/O show up
+too. Under eventlet every green thread shares the main OS thread, so samples
+show whichever green thread was running. Samples of a thread waiting on a
+queue or condition, or of the hub waiting for I/O, are counted as idle
+instead of being stored.
+"""
+import collections
+import os
+import sys
+import time
+
+DEFAULT_INTERVAL = 0.01
+MIN_INTERVAL = 0.001
+DEFAULT_DURATION = 60
+MAX_DURATION = 600
+# Caps memory if the workload produces many distinct stacks.
+MAX_STACKS = 20000
+MAX_DEPTH = 64
+
+# Unpatched primitives for the sampler thread (see watchdog.start_supervisor).
+native = {"sleep": time.sleep, "threading": None}
+profile = {
+    "running": False, "started_at": None, "stopped_at": None, "interval": DEFAULT_INTERVAL,
+    "duration": DEFAULT_DURATION, "samples": 0, "idle_samples": 0, "dropped_stacks": 0,
+    "overhead_seconds": 0.0, "generation": 0,
+}
+stacks = collections.Counter()
+# code object -> "function (file:line)"; built once per function seen.
+labels = {}
+# Functions a thread (or the eventlet hub) sits in while there is nothing to do.
+IDLE_LEAVES = {('wait', 'threading.py'), ('wait', 'hub.py'), ('wait', 'poll.py'), ('wait', 'epolls.py'), ('select', 'selectors.py')}
+
+
+def _native_threading():
+    if native['threading'] is None:
+        try:
+            import eventlet.patcher
+            native.update(threading=eventlet.patcher.original('threading'), sleep=eventlet.patcher.original('time').sleep)
+        except ImportError:
+            import threading
+            native['threading'] = threading
+    return native['threading']
+
+
+def _label(code):
+    label = labels.get(code)
+    if label is None:
+        label = labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return label
+
+
+def take_sample(own_ident, thread_names):
+    """Counts the current stack of every thread except the sampler itself."""
+    for ident, frame in sys._current_frames().items():
+        if ident == own_ident:
+            continue
+        code = frame.f_code
+        if (code.co_name, os.path.basename(code.co_filename)) in IDLE_LEAVES:
+            profile['idle_samples'] += 1
+            continue
+        names = []
+        while frame is not None and len(names) < MAX_DEPTH:
+            names.append(_label(frame.f_code))
+            frame = frame.f_back
+        names.append(thread_names.get(ident, f"thread-{ident}"))
+        key = ';'.join(reversed(names))
+        if key in stacks or len(stacks) < MAX_STACKS:
+            stacks[key] += 1
+        else:
+            profile['dropped_stacks'] += 1
+    profile['samples'] += 1
+
+
+def sampler_loop(generation):
+    threading = _native_threading()
+    own_ident = threading.get_ident()
+    deadline = time.monotonic() + profile['duration']
+    print(f"[Profiler] Sampling every {profile['interval'] * 1000:.0f} ms for up to {profile['duration']}s.")
+    while profile['running'] and profile['generation'] == generation and time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            thread_names = {t.ident: t.name for t in threading.enumerate()}
+            take_sample(own_ident, thread_names)
+        except Exception as e:
+            print(f"[ERROR in profiler]: {e}")
+        profile['overhead_seconds'] += time.perf_counter() - started
+        native['sleep'](profile['interval'])
+    if profile['generation'] == generation and profile['running']:
+        profile.update(running=False, stopped_at=time.time())
+        print(f"[Profiler] Stopped after {profile['samples']} samples.")
+
+
+def start(interval=DEFAULT_INTERVAL, duration=DEFAULT_DURATION):
+    """Clears the previous profile and starts sampling. Raises ValueError on bad arguments."""
+    interval, duration = float(interval), float(duration)
+    if not MIN_INTERVAL <= interval <= 1:
+        raise ValueError(f"interval must be between {MIN_INTERVAL} and 1 second")
+    if not 1 <= duration <= MAX_DURATION:
+        raise ValueError(f"duration must be between 1 and {MAX_DURATION} seconds")
+    threading = _native_threading()
+    stacks.clear()
+    profile.update(running=True, started_at=time.time(), stopped_at=None, interval=interval, duration=duration,
+                   samples=0, idle_samples=0, dropped_stacks=0, overhead_seconds=0.0,
+                   generation=profile['generation'] + 1)
+    threading.Thread(target=sampler_loop, args=(profile['generation'],), daemon=True, name='profiler').start()
+
+
+def stop():
+    if profile['running']:
+        profile.update(running=False, stopped_at=time.time())
+        print(f"[Profiler] Stopped after {profile['samples']} samples.")
+
+
+def get_status():
+    end = time.time() if profile['running'] else profile['stopped_at']
+    elapsed = (end - profile['started_at']) if profile['started_at'] and end else 0
+    return {"running": profile['running'], "interval_ms": round(profile['interval'] * 1000, 1),
+            "duration": profile['duration'], "elapsed": round(elapsed, 1), "samples": profile['samples'],
+            "idle_samples": profile['idle_samples'], "distinct_stacks": len(stacks),
+            "dropped_stacks": profile['dropped_stacks'],
+            "overhead_pct": round(profile['overhead_seconds'] / elapsed * 100, 2) if elapsed else 0,
+            "top": top_functions(10)}
+
+
+def top_functions(limit=10):
+    """Returns the functions found innermost on the sampled stacks most often."""
+    leaves = collections.Counter()
+    for key, count in list(stacks.items()):
+        leaves[key.rsplit(';', 1)[-1]] += count
+    total = sum(leaves.values()) or 1
+    return [{"function": name, "samples": count, "pct": round(count * 100 / total, 1)}
+            for name, count in leaves.most_common(limit)]
+
+
+def get_folded():
+    """Returns the profile as folded stacks, one "stack count" line each."""
+    return ''.join(f"{key} {count}\n" for key, count in sorted(stacks.items()))
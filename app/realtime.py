@@ -0,0 +1,185 @@
+"""
+Opt-in real-time mode for the sensor poll loop, and the loop's jitter histogram.
+The counting throughput is limited by the worst poll window, not the average,
+so real-time mode targets the tail:
+  - the poll thread switches to SCHED_FIFO and can be pinned to its own core,
+    so Chromium and the CFS scheduler cannot delay its wake-up
+  - long-lived objects are frozen out of the GC and automatic collection is
+    turned off; the poll loop collects in the slack left after a window, so a
+    collection triggered by another thread never lands mid-window
+  - the Modbus request frame is built once and the reply is read into a
+    preallocated buffer, skipping pymodbus' per-request objects; coil writes
+    (coil output backend) also bypass pymodbus
+Only the native poll thread of counterd.py can be real-time; under eventlet
+the poll loop is a green thread sharing the web server's OS thread.
+The jitter histogram is always on and is served with the 'pins' topic
+(Diagnostics page), so the effect can be compared with the mode off.
+"""
+import bisect
+import gc
+import os
+import time
+
+settings = {"enabled": False, "priority": 50, "cpus": None}
+status = {"active": False, "policy": "SCHED_OTHER", "cpus": None, "error": None}
+
+# Wake-up lateness histogram: bucket upper edges in ms; the last bucket is "above 100 ms".
+JITTER_EDGES_MS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 50, 100)
+timing = {"windows": 0, "overruns": 0, "max_late_ms": 0.0, "max_work_ms": 0.0,
+          "buckets": [0] * (len(JITTER_EDGES_MS) + 1), "since": time.time()}
+
+# Collections run only when at least this much of the window is left.
+GC_MIN_SLACK = 0.02
+GC_YOUNG_INTERVAL = 1.0
+GC_FULL_INTERVAL = 60.0
+gc_state = {"last_young": 0.0, "last_full": 0.0, "collections": 0, "max_ms": 0.0}
+
+
+def enter_realtime():
+    """Called from the poll thread itself: sched_setscheduler/affinity with pid 0 apply to the calling thread."""
+    try:
+        import eventlet.patcher
+        if eventlet.patcher.is_monkey_patched('thread'):
+            status['error'] = "real-time mode needs counterd.py (the poll loop is a green thread here)"
+            print(f"[Realtime] Not enabled: {status['error']}.")
+            return False
+    except ImportError:
+        pass
+    if settings['cpus']:
+        try:
+            os.sched_setaffinity(0, settings['cpus']); status['cpus'] = sorted(settings['cpus'])
+        except OSError as e:
+            status['error'] = f"affinity: {e}"
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(settings['priority']))
+        status['policy'] = f"SCHED_FIFO {settings['priority']}"
+    except (OSError, AttributeError) as e:
+        # Needs root, CAP_SYS_NICE or LimitRTPRIO= in the systemd unit.
+        status['error'] = f"SCHED_FIFO: {e}"
+    gc.collect(); gc.freeze(); gc.disable()
+    now = time.monotonic()
+    gc_state.update(last_young=now, last_full=now)
+    status['active'] = True
+    print(f"[Realtime] Poll thread: {status['policy']}, CPUs {status['cpus'] or 'any'}, GC frozen and collected in slack time."
+          + (f" ({status['error']})" if status['error'] else ""))
+    return True
+
+
+def collect_in_slack(slack):
+    """Runs a due GC generation if `slack` seconds remain in this window. Only in real-time mode."""
+    if not status['active'] or slack < GC_MIN_SLACK:
+        return
+    now = time.monotonic()
+    if now - gc_state['last_full'] >= GC_FULL_INTERVAL:
+        generation = 2; gc_state['last_full'] = gc_state['last_young'] = now
+    elif now - gc_state['last_young'] >= GC_YOUNG_INTERVAL:
+        generation = 0; gc_state['last_young'] = now
+    else:
+        return
+    started = time.perf_counter()
+    gc.collect(generation)
+    gc_state['max_ms'] = max(gc_state['max_ms'], (time.perf_counter() - started) * 1000)
+    gc_state['collections'] += 1
+
+
+def record_window(late, work, period):
+    """`late`: how far past its deadline a window started; `work`: how long it ran (seconds)."""
+    late_ms, work_ms = late * 1000, work * 1000
+    timing['windows'] += 1
+    timing['buckets'][bisect.bisect_left(JITTER_EDGES_MS, late_ms)] += 1
+    if late_ms > timing['max_late_ms']: timing['max_late_ms'] = late_ms
+    if work_ms > timing['max_work_ms']: timing['max_work_ms'] = work_ms
+    if work > period: timing['overruns'] += 1
+
+
+def _percentile_edge(fraction):
+    """Upper bucket edge below which `fraction` of the windows started (None above the last edge)."""
+    if not timing['windows']:
+        return 0
+    target, seen = timing['windows'] * fraction, 0
+    for edge, count in zip(JITTER_EDGES_MS + (None,), timing['buckets']):
+        seen += count
+        if seen >= target:
+            return edge
+    return None
+
+
+def get_poll_timing():
+    return {"windows": timing['windows'], "overruns": timing['overruns'],
+            "max_late_ms": round(timing['max_late_ms'], 2), "max_work_ms": round(timing['max_work_ms'], 2),
+            "p99_late_ms": _percentile_edge(0.99), "p999_late_ms": _percentile_edge(0.999),
+            "edges_ms": list(JITTER_EDGES_MS), "buckets": list(timing['buckets']), "since": timing['since'],
+            "realtime": dict(status), "gc": {"collections": gc_state['collections'], "max_ms": round(gc_state['max_ms'], 2)}}
+
+
+def reset_poll_timing():
+    timing.update(windows=0, overruns=0, max_late_ms=0.0, max_work_ms=0.0,
+                  buckets=[0] * (len(JITTER_EDGES_MS) + 1), since=time.time())
+    return True
+
+
+# --- Preallocated Modbus RTU request (function 0x02, read discrete inputs) ---
+def _crc16_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+CRC_TABLE = _crc16_table()
+raw = {"request": None, "buffer": None, "view": None, "serial": None, "count": 0, "slave": None}
+
+
+def crc16(data):
+    crc = 0xFFFF
+    for byte in data:
+        crc = (crc >> 8) ^ CRC_TABLE[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def prepare_request(slave, count):
+    """Builds the discrete-input request frame and the reply buffer once."""
+    frame = bytearray((slave, 0x02, 0, 0, count >> 8, count & 0xFF))
+    crc = crc16(frame)
+    frame += bytes((crc & 0xFF, crc >> 8))
+    reply_length = 5 + (count + 7) // 8
+    raw.update(request=bytes(frame), buffer=bytearray(reply_length), count=count, slave=slave)
+    raw['view'] = memoryview(raw['buffer'])
+
+
+def read_discrete_inputs_raw(serial_port, timeout):
+    """Sends the prepared request and returns the reply's data bytes. Raises IOError on a bad reply."""
+    if raw['serial'] is not serial_port:
+        # A reconnect creates a new port object; configure its timeout once, not per request.
+        serial_port.timeout = timeout; raw['serial'] = serial_port
+    serial_port.reset_input_buffer()
+    serial_port.write(raw['request'])
+    received = serial_port.readinto(raw['view'])
+    buffer = raw['buffer']
+    if received != len(buffer):
+        if received >= 2 and buffer[1] == 0x82:
+            raise IOError(f"Modbus exception code {buffer[2] if received > 2 else '?'}")
+        raise IOError(f"Short Modbus reply ({received} of {len(buffer)} bytes)")
+    if buffer[0] != raw['slave'] or buffer[1] != 0x02 or crc16(raw['view'][:-2]) != buffer[-2] | (buffer[-1] << 8):
+        raise IOError("Corrupt Modbus reply")
+    return raw['view'][3:-2]
+
+
+def write_coils_raw(serial_port, slave, address, bits):
+    """Sends one function 0x0F (write multiple coils) frame and checks the echo. Raises IOError on a bad reply."""
+    data = bytearray((len(bits) + 7) // 8)
+    for index, bit in enumerate(bits):
+        if bit: data[index // 8] |= 1 << (index % 8)
+    frame = bytearray((slave, 0x0F, address >> 8, address & 0xFF, len(bits) >> 8, len(bits) & 0xFF, len(data))) + data
+    crc = crc16(frame)
+    frame += bytes((crc & 0xFF, crc >> 8))
+    serial_port.reset_input_buffer()
+    serial_port.write(frame)
+    reply = serial_port.read(8)
+    if len(reply) >= 2 and reply[1] == 0x8F:
+        raise IOError(f"Modbus exception code {reply[2] if len(reply) > 2 else '?'}")
+    if len(reply) != 8 or reply[:6] != frame[:6] or crc16(reply[:6]) != reply[6] | (reply[7] << 8):
+        raise IOError(f"Bad write_coils reply ({len(reply)} bytes)")
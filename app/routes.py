@@ -3,11 +3,35 @@ This version ensures that when a user sets a new configuration,
 it is correctly saved to the database for persistence.
 """
 import subprocess
-from flask import Blueprint, render_template, jsonify, request
-from . import hardware, wifi, database, system 
+import time
+from flask import Blueprint, Response, current_app, render_template, jsonify, request, stream_with_context
+from . import analytics, config, counter_link, features, hardware, database, printing, status_feed, topics
 
 main_bp = Blueprint('main', __name__)
 
+# --- SPA Shell Support ---
+# The kiosk router sends this header to get just the page's view fragment.
+VIEW_HEADER = 'X-Kiosk-View'
+
+def is_view_request(): return request.headers.get(VIEW_HEADER) == '1'
+
+@main_bp.app_context_processor
+def inject_view_mode():
+    return {"kiosk_view": is_view_request(), "spa_mode": current_app.config.get('SPA_MODE', False),
+            "features": features.enabled}
+
+@main_bp.after_app_request
+def mark_view_fragment(response):
+    if response.mimetype == 'text/html':
+        response.vary.add(VIEW_HEADER)
+        if is_view_request(): response.headers[VIEW_HEADER] = '1'
+    return response
+
+@main_bp.errorhandler(counter_link.CounterUnavailable)
+def counter_unavailable(e): return jsonify({"success": False, "message": str(e)}), 503
+@main_bp.errorhandler(features.Disabled)
+def feature_disabled(e): return jsonify({"success": False, "message": str(e)}), 404
+
 # --- Page Rendering Routes ---
 @main_bp.route('/')
 def index(): return render_template('index.html')
@@ -15,92 +39,261 @@ def index(): return render_template('index.html')
 def manual_control(): return render_template('main/manual_control.html')
 @main_bp.route('/diagnostics')
 def diagnostics(): 
+    features.require('diagnostics')
     diag_config = hardware.get_diagnostics_config()
     return render_template('main/diagnostics.html', pin_config=diag_config)
 @main_bp.route('/system-health')
-def system_health(): return render_template('main/system_health.html')
+def system_health():
+    features.require('diagnostics'); return render_template('main/system_health.html')
 @main_bp.route('/network-status')
 def network_status(): return render_template('main/network_status.html')
 @main_bp.route('/wifi-configure')
-def wifi_configure(): return render_template('wifi/configure.html')
+def wifi_configure():
+    features.require('wifi'); return render_template('wifi/configure.html')
+@main_bp.route('/ble-configure')
+def ble_configure():
+    features.require('ble')
+    return render_template('ble/configure.html', saved_address=database.get_setting('printer_address'),
+                           saved_char=database.get_setting('printer_char_uuid'))
 @main_bp.route('/app-settings')
 def app_settings(): return render_template('main/app_settings.html')
 @main_bp.route('/admin-unlock')
 def admin_unlock_page(): return render_template('admin/unlock.html')
+@main_bp.route('/printer-configure')
+def printer_configure(): return render_template('main/printer_configure.html')
 @main_bp.route('/support')
 def support(): return render_template('main/support.html')
+@main_bp.route('/analytics')
+def analytics_page(): return render_template('main/analytics.html')
 
 
 # --- API Endpoints ---
 @main_bp.route('/api/status')
 def api_status():
-    with hardware.state['lock']: return jsonify({k: v for k, v in hardware.state.items() if k != 'lock'})
+    """
+    The current status with its state version as ETag. If-None-Match with the
+    current ETag gets a 304; ?since=<version>&wait=<s> long-polls until the
+    version moves on (304 if it does not within the wait).
+    """
+    since, wait = request.args.get('since', type=int), request.args.get('wait', 0, type=float)
+    if not status_feed.has_data():
+        # Nothing broadcast yet (first request after startup): version the live state.
+        with hardware.state['lock']: status_feed.publish(hardware.snapshot_state())
+    version, body = status_feed.get(since, wait)
+    if request.if_none_match.contains(str(version)) or (since == version):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.headers['ETag'] = status_feed.etag(version)
+    # Browsers keep the body but revalidate every time, getting the 304 while nothing changed.
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @main_bp.route('/api/pin_status')
-def api_pin_status(): return jsonify(hardware.get_live_io_status())
+def api_pin_status():
+    features.require('diagnostics'); return jsonify(counter_link.run('io_status'))
+
+@main_bp.route('/api/poll_timing/reset', methods=['POST'])
+def api_reset_poll_timing():
+    features.require('diagnostics')
+    counter_link.run('reset_poll_timing'); return jsonify({"success": True, "message": "Poll loop timing reset."})
+
+@main_bp.route('/api/gate_timing')
+def api_gate_timing(): return jsonify(counter_link.run('gate_timing'))
+@main_bp.route('/api/gate_timing/calibrate', methods=['POST'])
+def api_gate_calibrate():
+    ok, message = counter_link.run('gate_calibrate', cycles=request.form.get('cycles', 8))
+    return jsonify({"success": ok, "message": message}), 202 if ok else 409
 
 @main_bp.route('/api/set_config', methods=['POST'])
 def api_set_config():
     """
-    NEW: This now saves the configuration to the database for persistence.
+    Saves batch_target/gate_wait_time atomically. Pass the 'version' last read
+    to reject the save if someone else changed the configuration meanwhile.
+    The running line picks the change up between batches.
     """
+    data = request.get_json(silent=True) or request.form.to_dict()
+    expected_version = data.pop('version', None)
     try:
-        new_target = int(request.form['batch_target'])
-        new_wait_time = int(request.form['gate_wait_time'])
-        
-        # Save to database
-        database.set_setting('batch_target', new_target)
-        database.set_setting('gate_wait_time', new_wait_time)
-        
-        # Update live state
-        with hardware.state['lock']:
-            hardware.state['batch_target'] = new_target
-            hardware.state['gate_wait_time'] = new_wait_time
-        
-        hardware.broadcast_status()
-        print(f"Config updated and saved: Batch Target={new_target}, Wait Time={new_wait_time}")
-        return jsonify({"success": True, "message": "Configuration updated successfully!"})
-    except (ValueError, KeyError) as e: 
-        return jsonify({"success": False, "message": f"Invalid input: {e}"})
+        saved = config.update_config(data, expected_version if expected_version not in (None, '') else None)
+    except config.ConfigConflict as e:
+        return jsonify({"success": False, "message": str(e), "config": config.get_config()}), 409
+    except (config.ConfigError, ValueError) as e:
+        return jsonify({"success": False, "message": f"Invalid input: {e}"}), 400
+    if counter_link.run('config_saved', values=saved['values'], version=saved['version']):
+        message = "Configuration updated successfully!"
+    else:
+        message = "Configuration saved. It will take effect when the current batch completes."
+    print(f"Config saved (version {saved['version']}): {saved['values']}")
+    return jsonify({"success": True, "message": message, "config": saved})
+@main_bp.route('/api/config')
+def api_config(): return jsonify(config.get_config())
 
 # ... (The rest of the routes file is unchanged) ...
+@main_bp.route('/api/startup_profile')
+def api_startup_profile():
+    return jsonify(counter_link.run('startup_profile'))
 @main_bp.route('/api/system_health')
-def api_system_health(): return jsonify(system.get_system_health_info())
+def api_system_health():
+    features.require('diagnostics'); return jsonify(topics.get_health_data())
 @main_bp.route('/api/network_status')
-def api_network_status():
-    network_info = system.get_consolidated_network_info()
-    return jsonify({
-        "ip_address": network_info["ip_address"], "ssid": network_info["wifi_ssid"],
-        "wifi_connected": network_info["is_wifi"], "eth_connected": network_info["is_ethernet"],
-    })
+def api_network_status(): return jsonify(topics.get_network_status())
 @main_bp.route('/api/manual_relay_control', methods=['POST'])
 def api_manual_relay_control():
-    device, action = request.form.get('device'), request.form.get('action')
-    relay_map = {'green_led': hardware.green_led, 'red_led': hardware.red_led}
-    if device == 'gate':
-        if action == 'on': hardware.open_gate()
-        elif action == 'off': hardware.close_gate()
-        return jsonify({"success": True, "message": f"Gate action '{action}' triggered."})
-    elif device in relay_map and relay_map[device]:
-        if action == 'on': relay_map[device].on()
-        elif action == 'off': relay_map[device].off()
-        return jsonify({"success": True, "message": f"{device} turned {action}."})
-    elif device == 'buzzer' and action == 'beep' and hardware.buzzer:
-        hardware.buzzer.beep(on_time=0.2, n=1, background=True)
-        return jsonify({"success": True, "message": "Buzzer beeped."})
-    return jsonify({"success": False, "message": "Invalid device or action."}), 400
+    ok, message = counter_link.run('manual_control', device=request.form.get('device'), action=request.form.get('action'))
+    return jsonify({"success": ok, "message": message}), 200 if ok else 400
 @main_bp.route('/api/reset_counter', methods=['POST'])
 def api_reset_counter():
-    with hardware.state['lock']:
-        hardware.state['object_count'] = 0
-        if hardware.state['system_status'] not in ["Ready to Count", "Counting"]:
-             hardware.state['system_status'] = "Ready to Count"
-    hardware.broadcast_status()
+    counter_link.run('reset_counter')
     return jsonify({"success": True, "message": "Live count has been reset to 0."})
+@main_bp.route('/api/get_printer_config')
+def api_get_printer_config(): return jsonify(printing.get_printer_config())
+@main_bp.route('/api/save_printer_config', methods=['POST'])
+def api_save_printer_config():
+    try:
+        printing.save_printer_config(request.get_json(force=True) or {})
+        return jsonify({"success": True, "message": "Printer configuration saved."})
+    except (ValueError, TypeError) as e:
+        return jsonify({"success": False, "message": f"Invalid input: {e}"}), 400
+@main_bp.route('/api/print_queue')
+def api_print_queue(): return jsonify(printing.get_queue_summary())
+@main_bp.route('/api/analytics/summary')
+def api_analytics_summary(): return jsonify(counter_link.run('analytics_summary'))
+@main_bp.route('/api/analytics/hourly')
+def api_analytics_hourly():
+    hours = min(max(request.args.get('hours', 24, type=int), 1), 24 * 31)
+    return jsonify(analytics.get_hourly(hours))
+@main_bp.route('/api/analytics/shifts')
+def api_analytics_shifts():
+    days = min(max(request.args.get('days', 7, type=int), 1), 366)
+    return jsonify({"shifts": analytics.get_shifts(), "summary": analytics.get_shift_summary(days)})
+@main_bp.route('/api/export/<dataset>.<fmt>')
+def api_export(dataset, fmt):
+    """Streams production data, e.g. /api/export/events.csv?from=2024-01-01&to=2024-01-31."""
+    from . import export
+    if dataset not in export.DATASETS or fmt not in ('csv', 'parquet'):
+        return jsonify({"success": False, "message": "Unknown export."}), 404
+    if fmt == 'parquet' and export.pyarrow is None:
+        return jsonify({"success": False, "message": "Parquet export requires the 'pyarrow' package."}), 501
+    today = time.strftime('%Y-%m-%d')
+    date_from, date_to = request.args.get('from', today), request.args.get('to', today)
+    try: start, end = export.parse_range(date_from, date_to)
+    except ValueError as e: return jsonify({"success": False, "message": f"Invalid date range: {e}"}), 400
+    filename = f"{dataset}_{date_from}_{date_to}.{fmt}"
+    if fmt == 'csv': body, mimetype = export.stream_csv(dataset, start, end), 'text/csv'
+    else: body, mimetype = export.stream_parquet(dataset, start, end), 'application/vnd.apache.parquet'
+    return Response(stream_with_context(body), mimetype=mimetype, headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+@main_bp.route('/api/uplink/status')
+def api_uplink_status():
+    return jsonify(counter_link.run('uplink_status'))
+@main_bp.route('/api/uplink/config', methods=['GET', 'POST'])
+def api_uplink_config():
+    from . import uplink
+    if request.method == 'GET': return jsonify(uplink.get_public_uplink_config())
+    try:
+        uplink.save_uplink_config(request.get_json(force=True) or {})
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    # The uplink thread runs with the line (in the counting daemon when split); retry there right away.
+    try: counter_link.run('uplink_retry')
+    except counter_link.CounterUnavailable: return jsonify({"success": True, "message": "Uplink settings saved; the counting service will use them once it is back."})
+    return jsonify({"success": True, "message": "Uplink settings saved."})
+@main_bp.route('/api/profiler/start', methods=['POST'])
+def api_profiler_start():
+    features.require('diagnostics')
+    from . import profiler
+    data = request.get_json(silent=True) or request.form.to_dict()
+    try:
+        profiler.start(data.get('interval', profiler.DEFAULT_INTERVAL), data.get('duration', profiler.DEFAULT_DURATION))
+        return jsonify({"success": True, "message": "Profiler started."})
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"Invalid input: {e}"}), 400
+@main_bp.route('/api/profiler/stop', methods=['POST'])
+def api_profiler_stop():
+    features.require('diagnostics')
+    from . import profiler
+    profiler.stop(); return jsonify({"success": True, "message": "Profiler stopped."})
+@main_bp.route('/api/profiler/status')
+def api_profiler_status():
+    features.require('diagnostics')
+    from . import profiler
+    return jsonify(profiler.get_status())
+@main_bp.route('/api/profiler/folded')
+def api_profiler_folded():
+    """Folded stacks for flamegraph.pl / speedscope.app."""
+    features.require('diagnostics')
+    from . import profiler
+    filename = time.strftime('profile_%Y%m%d_%H%M%S.folded')
+    return Response(profiler.get_folded(), mimetype='text/plain', headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 @main_bp.route('/api/wifi/scan', methods=['POST'])
-def api_wifi_scan(): return jsonify(wifi.scan_wifi())
+def api_wifi_scan():
+    features.require('wifi')
+    from . import wifi
+    return jsonify({"job_id": wifi.start_scan_job(), "cached": wifi.get_cached_scan()}), 202
+@main_bp.route('/api/wifi/networks')
+def api_wifi_networks():
+    features.require('wifi')
+    from . import wifi
+    return jsonify(wifi.get_cached_scan())
 @main_bp.route('/api/wifi/connect', methods=['POST'])
-def api_wifi_connect(): return jsonify(wifi.connect_to_wifi(request.form.get('ssid'), request.form.get('password')))
+def api_wifi_connect():
+    features.require('wifi')
+    from . import wifi
+    ssid = request.form.get('ssid')
+    if not ssid: return jsonify({"success": False, "message": "No SSID given."}), 400
+    return jsonify({"success": True, "job_id": wifi.start_connect_job(ssid, request.form.get('password'))}), 202
+@main_bp.route('/api/wifi/jobs/<job_id>')
+def api_wifi_job(job_id):
+    features.require('wifi')
+    from . import wifi
+    job = wifi.get_job(job_id)
+    if not job: return jsonify({"success": False, "message": "Unknown job."}), 404
+    return jsonify(job)
+@main_bp.route('/api/ble/scan', methods=['POST'])
+def api_ble_scan():
+    features.require('ble')
+    from . import ble
+    return jsonify(ble.run_async(ble.scan_ble_devices()))
+@main_bp.route('/api/ble/get-characteristics', methods=['POST'])
+def api_ble_get_characteristics():
+    features.require('ble')
+    from . import ble
+    address = request.form.get('address')
+    if not address: return jsonify({"error": "No device address given."}), 400
+    return jsonify(ble.run_async(ble.get_characteristics(address)))
+def wake_ble_manager():
+    """Wakes the BLE manager, which runs with the line (in the counting daemon when split)."""
+    # If the daemon does not answer, the manager still sees the change on its next check.
+    try: counter_link.run('print_wake')
+    except counter_link.CounterUnavailable: pass
+@main_bp.route('/api/ble/save-device', methods=['POST'])
+def api_ble_save_device():
+    features.require('ble')
+    address, char_uuid = request.form.get('address'), request.form.get('characteristic_uuid')
+    if not address or not char_uuid: return jsonify({"success": False, "message": "Select a device and a characteristic."}), 400
+    database.set_setting('printer_address', address)
+    database.set_setting('printer_char_uuid', char_uuid)
+    # Wakes the BLE manager so it connects to the new printer straight away.
+    wake_ble_manager()
+    return jsonify({"success": True, "message": f"Printer {address} saved."})
+@main_bp.route('/api/ble/remove-device', methods=['POST'])
+def api_ble_remove_device():
+    features.require('ble')
+    database.set_setting('printer_address', '')
+    database.set_setting('printer_char_uuid', '')
+    wake_ble_manager()
+    return jsonify({"success": True, "message": "Default printer removed."})
+@main_bp.route('/api/ble/test-print', methods=['POST'])
+def api_ble_test_print():
+    features.require('ble')
+    text = request.form.get('text')
+    if not text: return jsonify({"success": False, "message": "No text given."}), 400
+    job_id = printing.enqueue_test_print(text)
+    wake_ble_manager()
+    with hardware.state['lock']:
+        connected = hardware.state.get('ble_connection_status') == "Connected"
+    message = "Sent to the printer." if connected else "Queued; it prints once the printer connects."
+    return jsonify({"success": True, "message": message, "job_id": job_id})
 @main_bp.route('/api/unlock', methods=['POST'])
 def api_unlock():
     unlock_code = request.form.get('code')
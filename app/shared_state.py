@@ -0,0 +1,107 @@
+"""
+Shared-memory status record between the counting daemon (counterd.py) and the
+web process.
+The daemon is the only writer. It serializes the status snapshot into a
+fixed-size mmap'd file under /dev/shm guarded by a seqlock: the sequence
+number is made odd before the payload is written and even again afterwards.
+A reader copies the record and accepts it only if the sequence was even and
+unchanged across the copy. The copy must also match the CRC stored with it,
+which catches a torn read on a weakly ordered CPU. Readers never block the
+writer, so UI load cannot delay counting.
+"""
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+
+STATE_PATH = os.environ.get('BOX_COUNTER_STATE', '/dev/shm/box_counter_state' if os.path.isdir('/dev/shm') else '/tmp/box_counter_state')
+MAGIC = b'BXC1'
+# magic, seq, writer pid, payload length, payload crc32, written at (wall clock, ns)
+HEADER = struct.Struct('<4sQIIIQ')
+SEQ_OFFSET = 4
+WRITTEN_OFFSET = 24
+PAYLOAD_SIZE = 16384
+RECORD_SIZE = HEADER.size + PAYLOAD_SIZE
+READ_ATTEMPTS = 100
+
+record = {"mm": None, "seq": 0}
+
+
+class RecordUnavailable(Exception):
+    """No daemon has created the record yet, or it could not be read consistently."""
+
+
+def open_writer(path=STATE_PATH):
+    """Creates (or takes over) the record. Only the counting daemon calls this."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        os.ftruncate(fd, RECORD_SIZE)
+        record['mm'] = mmap.mmap(fd, RECORD_SIZE)
+    finally:
+        os.close(fd)
+    seq = HEADER.unpack_from(record['mm'])[1] if record['mm'][:4] == MAGIC else 0
+    # Continue from an even sequence so readers of the old record see a change.
+    record['seq'] = seq + (seq & 1)
+    HEADER.pack_into(record['mm'], 0, MAGIC, record['seq'], os.getpid(), 0, 0, time.time_ns())
+
+
+def publish(data):
+    """Writes a new snapshot. Raises ValueError if it does not fit the record."""
+    payload = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    if len(payload) > PAYLOAD_SIZE:
+        raise ValueError(f"status snapshot is {len(payload)} bytes, record holds {PAYLOAD_SIZE}")
+    mm = record['mm']
+    record['seq'] += 1
+    struct.pack_into('<Q', mm, SEQ_OFFSET, record['seq'])
+    mm[HEADER.size:HEADER.size + len(payload)] = payload
+    record['seq'] += 1
+    HEADER.pack_into(mm, 0, MAGIC, record['seq'], os.getpid(), len(payload), zlib.crc32(payload), time.time_ns())
+
+
+def touch():
+    """Refreshes the heartbeat without publishing, so readers can tell the daemon is alive."""
+    struct.pack_into('<Q', record['mm'], WRITTEN_OFFSET, time.time_ns())
+
+
+def open_reader(path=STATE_PATH):
+    """Maps an existing record read-only. Raises RecordUnavailable if the daemon never created it."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        raise RecordUnavailable(f"{path} does not exist (is counterd running?)")
+    try:
+        if os.fstat(fd).st_size < RECORD_SIZE:
+            raise RecordUnavailable(f"{path} is not a status record")
+        record['mm'] = mmap.mmap(fd, RECORD_SIZE, access=mmap.ACCESS_READ)
+    finally:
+        os.close(fd)
+
+
+def read_seq():
+    """Returns the current sequence number; cheap enough to poll for changes."""
+    return struct.unpack_from('<Q', record['mm'], SEQ_OFFSET)[0]
+
+
+def read_heartbeat():
+    """Returns when the daemon last published or touched the record (wall clock seconds)."""
+    return struct.unpack_from('<Q', record['mm'], WRITTEN_OFFSET)[0] / 1e9
+
+
+def read():
+    """Returns (seq, writer_pid, written_at, data) from a consistent copy of the record."""
+    mm = record['mm']
+    if mm is None or mm[:4] != MAGIC:
+        raise RecordUnavailable("status record not initialized")
+    for _ in range(READ_ATTEMPTS):
+        seq = read_seq()
+        if seq & 1:
+            time.sleep(0)
+            continue
+        raw = mm[:RECORD_SIZE]
+        _, copied_seq, pid, length, crc, written_ns = HEADER.unpack_from(raw)
+        payload = raw[HEADER.size:HEADER.size + length]
+        if copied_seq == seq == read_seq() and zlib.crc32(payload) == crc:
+            return seq, pid, written_ns / 1e9, json.loads(payload) if length else None
+    raise RecordUnavailable("status record kept changing while being read")
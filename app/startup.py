@@ -0,0 +1,47 @@
+"""
+Startup profile: wall-clock milestones from process start to "Ready to Count".
+Each phase calls mark() once; the profile is printed when the system is ready
+and served at /api/startup_profile so boot time can be tracked across releases.
+"""
+import os
+import threading
+import time
+
+# Reference point for all marks. The package is imported first thing by run.py.
+T0 = time.monotonic()
+marks = []
+marks_lock = threading.Lock()
+
+
+def process_age_seconds():
+    """Seconds since the interpreter started, including time spent before T0 (e.g. eventlet import)."""
+    try:
+        with open(f"/proc/{os.getpid()}/stat") as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def mark(phase):
+    elapsed_ms = round((time.monotonic() - T0) * 1000, 1)
+    with marks_lock:
+        marks.append({"phase": phase, "ms": elapsed_ms, "thread": threading.current_thread().name})
+    return elapsed_ms
+
+
+def get_profile():
+    with marks_lock:
+        phases = list(marks)
+    age = process_age_seconds()
+    before_t0_ms = round(age * 1000 - (time.monotonic() - T0) * 1000, 1) if age is not None else None
+    return {"phases": phases, "before_package_import_ms": before_t0_ms}
+
+
+def print_profile():
+    profile = get_profile()
+    print("[Startup] Profile (ms since package import):")
+    for entry in profile['phases']:
+        print(f"[Startup]   {entry['ms']:>8.1f}  {entry['phase']}  ({entry['thread']})")
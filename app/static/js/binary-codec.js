@@ -0,0 +1,104 @@
+/**
+ * Decoder for the compact binary topic payloads (app/binary_codec.py).
+ *
+ * A binary payload is a msgpack map whose integer keys index the event's key
+ * table; the tables, unit formats and record layouts arrive in the 'codec'
+ * event when the client picks the encoding. Decoded payloads look exactly
+ * like the JSON ones, so page handlers do not know which encoding was used.
+ */
+(function () {
+    const textDecoder = new TextDecoder();
+    let codec = null;
+
+    function readMsgpack(buffer) {
+        const view = new DataView(buffer);
+        const bytes = new Uint8Array(buffer);
+        let pos = 0;
+
+        function str(length) {
+            const value = textDecoder.decode(bytes.subarray(pos, pos + length));
+            pos += length;
+            return value;
+        }
+        function array(length) {
+            const value = new Array(length);
+            for (let i = 0; i < length; i++) value[i] = read();
+            return value;
+        }
+        function map(length) {
+            // Keys are kept as read (numbers stay numbers) so the caller can map table indexes.
+            const entries = new Array(length);
+            for (let i = 0; i < length; i++) entries[i] = [read(), read()];
+            return { entries: entries };
+        }
+        function object(length) {
+            const value = {};
+            map(length).entries.forEach(([key, item]) => { value[key] = item; });
+            return value;
+        }
+        function next(size, getter) {
+            const value = getter.call(view, pos);
+            pos += size;
+            return value;
+        }
+        function read(raw) {
+            const type = bytes[pos++];
+            if (type <= 0x7f) return type;
+            if (type >= 0xe0) return type - 0x100;
+            if (type >= 0x80 && type <= 0x8f) return raw ? map(type & 0x0f) : object(type & 0x0f);
+            if (type >= 0x90 && type <= 0x9f) return array(type & 0x0f);
+            if (type >= 0xa0 && type <= 0xbf) return str(type & 0x1f);
+            switch (type) {
+                case 0xc0: return null;
+                case 0xc2: return false;
+                case 0xc3: return true;
+                case 0xc4: { const n = next(1, view.getUint8); pos += n; return bytes.slice(pos - n, pos); }
+                case 0xc5: { const n = next(2, view.getUint16); pos += n; return bytes.slice(pos - n, pos); }
+                case 0xc6: { const n = next(4, view.getUint32); pos += n; return bytes.slice(pos - n, pos); }
+                case 0xca: return next(4, view.getFloat32);
+                case 0xcb: return next(8, view.getFloat64);
+                case 0xcc: return next(1, view.getUint8);
+                case 0xcd: return next(2, view.getUint16);
+                case 0xce: return next(4, view.getUint32);
+                case 0xcf: return Number(next(8, view.getBigUint64));
+                case 0xd0: return next(1, view.getInt8);
+                case 0xd1: return next(2, view.getInt16);
+                case 0xd2: return next(4, view.getInt32);
+                case 0xd3: return Number(next(8, view.getBigInt64));
+                case 0xd9: return str(next(1, view.getUint8));
+                case 0xda: return str(next(2, view.getUint16));
+                case 0xdb: return str(next(4, view.getUint32));
+                case 0xdc: return array(next(2, view.getUint16));
+                case 0xdd: return array(next(4, view.getUint32));
+                case 0xde: { const n = next(2, view.getUint16); return raw ? map(n) : object(n); }
+                case 0xdf: { const n = next(4, view.getUint32); return raw ? map(n) : object(n); }
+            }
+            throw new Error(`Unsupported msgpack type 0x${type.toString(16)}`);
+        }
+        return read(true);
+    }
+
+    window.kioskCodec = {
+        setTables: (description) => { codec = description; },
+        isBinary: (data) => data instanceof ArrayBuffer,
+        decode: (event, buffer) => {
+            const table = codec && codec.tables[event];
+            if (!table) throw new Error(`No key table for '${event}'`);
+            const payload = {};
+            readMsgpack(buffer).entries.forEach(([key, value]) => {
+                const name = typeof key === 'number' ? table[key] : key;
+                const unit = codec.units[name], fields = codec.rows[name];
+                if (unit && typeof value === 'number') value = `${value.toFixed(unit[1])}${unit[0]}`;
+                else if (fields && value) {
+                    Object.keys(value).forEach(row => {
+                        const record = {};
+                        fields.forEach((field, i) => { record[field] = value[row][i]; });
+                        value[row] = record;
+                    });
+                }
+                payload[name] = value;
+            });
+            return payload;
+        },
+    };
+})();
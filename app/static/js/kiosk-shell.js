@@ -0,0 +1,140 @@
+/**
+ * Kiosk shell: the single SocketIO connection, topic subscriptions and the
+ * client-side router used in SPA mode.
+ *
+ * In SPA mode, clicking an internal link fetches only the page's view
+ * fragment (the server renders it when it sees the X-Kiosk-View header) and
+ * swaps it into <main>. Bootstrap, the socket and the top bar stay alive, so
+ * navigating does not reconnect or re-push the full state.
+ *
+ * Page scripts use onViewReady(), subscribeTopic() and onSocketEvent()
+ * instead of DOMContentLoaded and socket.on(), so their listeners and
+ * subscriptions are released when the view is swapped out.
+ *
+ * The shell asks for the compact binary payloads (binary-codec.js) and hands
+ * handlers decoded objects; set localStorage.socketEncoding = 'json' to opt out.
+ */
+(function () {
+    const socket = io();
+    window.kioskSocket = socket;
+    const encoding = window.kioskCodec && localStorage.getItem('socketEncoding') !== 'json' ? 'msgpack' : 'json';
+    socket.on('codec', description => window.kioskCodec.setTables(description));
+
+    // topic -> number of active subscribers on this page (shell + current view)
+    const topicRefs = new Map();
+    // Handlers and topics owned by the current view, released on navigation.
+    let viewScope = { topics: [], handlers: [] };
+
+    function emitSubscribe(topics) {
+        if (topics.length && socket.connected) {
+            socket.emit('subscribe', { topics: topics, visible: !document.hidden, encoding: encoding });
+        }
+    }
+
+    window.onSocketEvent = (event, handler, options = {}) => {
+        const listener = data => handler(window.kioskCodec && window.kioskCodec.isBinary(data) ? window.kioskCodec.decode(event, data) : data);
+        socket.on(event, listener);
+        if (!options.shell) viewScope.handlers.push([event, listener]);
+    };
+
+    window.subscribeTopic = (topic, event, handler, options = {}) => {
+        window.onSocketEvent(event, handler, options);
+        const refs = topicRefs.get(topic) || 0;
+        topicRefs.set(topic, refs + 1);
+        if (!options.shell) viewScope.topics.push(topic);
+        emitSubscribe([topic]);
+    };
+
+    function releaseView() {
+        viewScope.handlers.forEach(([event, handler]) => socket.off(event, handler));
+        const released = [];
+        viewScope.topics.forEach(topic => {
+            const refs = (topicRefs.get(topic) || 1) - 1;
+            if (refs <= 0) { topicRefs.delete(topic); released.push(topic); }
+            else topicRefs.set(topic, refs);
+        });
+        if (released.length) socket.emit('unsubscribe', { topics: released });
+        viewScope = { topics: [], handlers: [] };
+    }
+
+    // Subscriptions are per connection, so renew them after every (re)connect.
+    socket.on('connect', () => emitSubscribe([...topicRefs.keys()]));
+    // Hidden pages get slower (or no) updates until they are shown again.
+    document.addEventListener('visibilitychange', () => {
+        socket.emit('visibility', { visible: !document.hidden });
+    });
+
+    // --- View lifecycle ---
+    let viewLoading = false;
+    const pendingReady = [];
+    window.onViewReady = (fn) => {
+        if (viewLoading) pendingReady.push(fn);
+        else if (document.readyState === 'loading') document.addEventListener('DOMContentLoaded', fn);
+        else fn();
+    };
+
+    // --- Router (SPA mode only) ---
+    function isRoutable(link) {
+        if (!link || link.target || link.hasAttribute('download') || link.dataset.fullReload !== undefined) return false;
+        const url = new URL(link.href, window.location.href);
+        return url.origin === window.location.origin && !url.pathname.startsWith('/api/') &&
+               !url.pathname.startsWith('/assets/') && !url.pathname.startsWith('/static/') && link.getAttribute('href') !== '#';
+    }
+
+    function runViewScripts(container) {
+        container.querySelectorAll('script').forEach(oldScript => {
+            const script = document.createElement('script');
+            if (oldScript.src) script.src = oldScript.src;
+            // Each view runs in its own function scope so revisiting a view does not redeclare globals.
+            else script.textContent = `(function () {\n${oldScript.textContent}\n})();`;
+            oldScript.replaceWith(script);
+        });
+    }
+
+    async function loadView(url, pushHistory) {
+        const main = document.getElementById('kiosk-main');
+        let response;
+        try {
+            response = await fetch(url, { headers: { 'X-Kiosk-View': '1' } });
+        } catch (e) {
+            window.location.href = url;
+            return;
+        }
+        if (!response.ok || response.headers.get('X-Kiosk-View') !== '1') {
+            window.location.href = url;
+            return;
+        }
+        const html = await response.text();
+        releaseView();
+        const template = document.createElement('template');
+        template.innerHTML = html;
+        const view = template.content.firstElementChild;
+        if (view && view.dataset.title) document.title = view.dataset.title;
+        main.replaceChildren(...template.content.childNodes);
+        if (pushHistory) history.pushState({ kioskView: true }, '', url);
+        window.scrollTo(0, 0);
+
+        viewLoading = true;
+        try {
+            runViewScripts(main);
+        } finally {
+            viewLoading = false;
+        }
+        pendingReady.splice(0).forEach(fn => fn());
+        document.querySelectorAll('.navbar-collapse.show').forEach(el => bootstrap.Collapse.getOrCreateInstance(el).hide());
+    }
+
+    window.kioskNavigate = (url) => loadView(url, true);
+
+    if (document.body.dataset.spa === '1') {
+        history.replaceState({ kioskView: true }, '', window.location.href);
+        document.addEventListener('click', e => {
+            if (e.defaultPrevented || e.button !== 0 || e.metaKey || e.ctrlKey || e.shiftKey || e.altKey) return;
+            const link = e.target.closest('a[href]');
+            if (!isRoutable(link)) return;
+            e.preventDefault();
+            loadView(link.href, true);
+        });
+        window.addEventListener('popstate', () => loadView(window.location.href, false));
+    }
+})();
@@ -85,11 +85,11 @@ class VirtualKeyboard {
             dismissButton.addEventListener('click', () => this.hide());
         }
 
-        // Attach listeners to all designated input fields
-        document.querySelectorAll('.virtual-keyboard-input').forEach(element => {
-            element.addEventListener('focus', () => {
-                this.show(element); // Pass the element being focused
-            });
+        // Delegated focus listener, so inputs in views swapped in by the SPA router work too
+        document.addEventListener('focusin', (event) => {
+            if (event.target.classList && event.target.classList.contains('virtual-keyboard-input')) {
+                this.show(event.target); // Pass the element being focused
+            }
         });
     }
     
@@ -0,0 +1,46 @@
+"""
+Versioned status for HTTP clients of /api/status (PLC gateways, scripts, the
+fleet aggregator).
+Every status update the broadcaster emits is also published here as a new
+state version. Versions start from the boot time in milliseconds, so they keep
+increasing across restarts and an old ETag never matches a new state. The JSON
+body is encoded at most once per version however many clients ask, a client
+that already has the current version gets a 304 (If-None-Match), and a
+long-poll (?since=<version>&wait=<s>) returns as soon as the version moves on.
+"""
+import json
+import threading
+import time
+
+from . import hardware
+
+# Upper bound for ?wait=, so a forgotten client does not hold a worker forever.
+MAX_WAIT = 30
+
+latest = {"version": int(time.time() * 1000), "data": None, "body": None}
+changed = threading.Condition()
+
+
+def publish(snapshot):
+    """Makes a status snapshot (hardware.snapshot_state()) the current status as the next version."""
+    with changed:
+        latest.update(version=latest['version'] + 1, data=snapshot, body=None)
+        changed.notify_all()
+
+
+def has_data():
+    return latest['data'] is not None
+
+
+def etag(version):
+    return f'"{version}"'
+
+
+def get(since=None, wait=0):
+    """Returns (version, body), waiting up to `wait` seconds while the version is still `since`."""
+    with changed:
+        if since is not None and wait > 0:
+            changed.wait_for(lambda: latest['version'] != since, min(wait, MAX_WAIT))
+        if latest['body'] is None:
+            latest['body'] = json.dumps(dict(hardware.status_dict(latest['data']), state_version=latest['version']), separators=(',', ':'))
+        return latest['version'], latest['body']
@@ -1,17 +1,18 @@
 """
 This module contains functions for getting system-level information.
 It now includes a function for checking live internet connectivity.
+psutil and requests are imported on first use to keep startup fast.
 """
-import psutil
+import os
 import time
 import subprocess
-import requests # <-- New import
 
 # Uptime calculation starts when the module is first imported
 start_time = time.time()
 
 def check_internet_connection():
     """Checks for a live internet connection by making a request to a reliable server."""
+    import requests
     # Using a timeout is crucial so this function doesn't block for too long.
     try:
         requests.get("http://www.google.com", timeout=3)
@@ -30,6 +31,7 @@ def get_cpu_temp():
 
 def get_system_health_info():
     """Compiles all system health metrics into a dictionary."""
+    import psutil
     uptime_seconds = time.time() - start_time
     uptime_string = time.strftime("%H:%M:%S", time.gmtime(uptime_seconds))
     
@@ -84,4 +86,27 @@ def get_consolidated_network_info():
     if info["ip_address"] != "Not connected" and not info["is_wifi"]:
         info["is_ethernet"] = True
 
-    return info
\ No newline at end of file
+    return info
+
+def pin_process(cpus=None, nice=None):
+    """Restricts this process to the given CPU cores and/or changes its nice level."""
+    if cpus:
+        try:
+            os.sched_setaffinity(0, cpus); print(f"[System] Pinned to CPU(s) {sorted(cpus)}.")
+        except (OSError, AttributeError) as e:
+            print(f"[System] Could not set CPU affinity {sorted(cpus)}: {e}")
+    if nice is not None:
+        try:
+            os.setpriority(os.PRIO_PROCESS, 0, nice); print(f"[System] Nice level set to {nice}.")
+        except (OSError, AttributeError) as e:
+            # Raising priority (negative nice) needs root or CAP_SYS_NICE.
+            print(f"[System] Could not set nice level {nice}: {e}")
+
+
+def parse_cpu_list(text):
+    """Parses '2', '2,3' or '0-2' into a set of CPU numbers."""
+    cpus = set()
+    for part in text.split(','):
+        start, _, end = part.strip().partition('-')
+        cpus.update(range(int(start), int(end or start) + 1))
+    return cpus
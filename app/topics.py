@@ -0,0 +1,259 @@
+"""
+Topic subscriptions over the shared SocketIO connection.
+Pages emit 'subscribe' with the topics they display instead of polling the
+HTTP API on a timer. Each topic is computed at most once per interval, only
+while it has subscribers, and the result is fanned out to the topic's room.
+Pages also report whether they are visible; topics whose subscribers are all
+in background tabs refresh at their slower hidden interval, or not at all.
+A page may ask for the compact binary encoding (binary_codec.py); the topics
+it covers then have a second room, and each payload is encoded once per
+encoding in use.
+"""
+import threading
+import time
+from flask import request
+from flask_socketio import join_room, leave_room
+
+from .extensions import socketio
+from . import binary_codec, counter_link, database, features, hardware, printing, system, watchdog
+
+# How often the broadcaster checks which topics are due.
+TICK_SECONDS = 0.5
+# Slower check rate while nobody at all is subscribed.
+IDLE_TICK_SECONDS = 2
+# The network probe is shared by the 'network' and 'top_bar' topics.
+NETWORK_INFO_MAX_AGE = 4
+
+topics = {}
+subscribers = {}
+visible_sids = set()
+# Clients that negotiated the binary encoding.
+binary_sids = set()
+subscribers_lock = threading.Lock()
+network_cache = {"info": None, "fetched_at": 0}
+
+
+def topic_room(name, binary=False):
+    return f"topic:{name}:bin" if binary else f"topic:{name}"
+
+
+def _is_binary(name, sid):
+    return sid in binary_sids and topics[name]['event'] in binary_codec.KEY_TABLES
+
+
+def emit_topic(name, payload):
+    """Fans a payload out to a topic's room(s), encoded once for each encoding its subscribers use."""
+    event = topics[name]['event']
+    with subscribers_lock:
+        members = subscribers[name]
+        binary = event in binary_codec.KEY_TABLES and not members.isdisjoint(binary_sids)
+        text = not binary or not members <= binary_sids
+    if binary:
+        socketio.emit(event, binary_codec.encode(event, payload), to=topic_room(name, binary=True))
+    if text:
+        socketio.emit(event, payload, to=topic_room(name))
+
+
+def register_topic(name, event, compute=None, interval=None, hidden_interval=None, snapshot=None):
+    """
+    Registers a topic. Topics without a compute function are push-only: their
+    payloads are emitted by whoever owns the data (see status_broadcaster), and
+    `snapshot` supplies the full payload a new subscriber starts from.
+    `hidden_interval` is used when every subscriber's page is hidden; None
+    pauses the topic until a visible page subscribes.
+    """
+    topics[name] = {"event": event, "compute": compute, "interval": interval, "hidden_interval": hidden_interval,
+                    "snapshot": snapshot, "last_run": 0, "last_payload": None}
+    subscribers[name] = set()
+
+
+def get_cached_network_info():
+    """Runs the network probe at most once every NETWORK_INFO_MAX_AGE seconds."""
+    if network_cache['info'] is None or time.time() - network_cache['fetched_at'] > NETWORK_INFO_MAX_AGE:
+        network_cache['info'] = system.get_consolidated_network_info()
+        network_cache['fetched_at'] = time.time()
+    return network_cache['info']
+
+
+def get_network_status():
+    network_info = get_cached_network_info()
+    printer_address = database.get_setting('printer_address')
+    return {
+        "ip_address": network_info["ip_address"], "ssid": network_info["wifi_ssid"],
+        "wifi_connected": network_info["is_wifi"], "eth_connected": network_info["is_ethernet"],
+        "ble_device": printer_address or "None", "ble_connected": bool(printer_address),
+    }
+
+
+def get_ble_status():
+    with hardware.state['lock']:
+        connection_status = hardware.state.get('ble_connection_status', "Disconnected")
+    return {
+        "ble_connection_status": connection_status,
+        "printer_address": database.get_setting('printer_address'),
+        "print_queue": printing.get_queue_summary(),
+    }
+
+
+def get_top_bar_data():
+    network_info = get_cached_network_info()
+    with hardware.state['lock']:
+        ble_connected = hardware.state.get('ble_connection_status') == "Connected"
+    return {
+        "internet_active": network_info["has_internet"], "ip_address": network_info["ip_address"],
+        "eth_active": network_info["is_ethernet"], "wifi_active": network_info["is_wifi"],
+        "wifi_strength": network_info["wifi_strength"], "wifi_ssid": network_info["wifi_ssid"],
+        "ble_connected": ble_connected, "ble_saved": bool(database.get_setting('printer_address')),
+    }
+
+
+def get_health_data():
+    health = system.get_system_health_info()
+    health['loops'] = watchdog.get_loop_status()
+    return health
+
+
+def get_pin_status():
+    return counter_link.run('io_status')
+
+
+def get_analytics_summary():
+    return counter_link.run('analytics_summary')
+
+
+def get_gate_timing():
+    return counter_link.run('gate_timing')
+
+
+def get_status_snapshot():
+    with hardware.state['lock']:
+        snapshot = hardware.snapshot_state()
+    return hardware.status_dict(snapshot)
+
+
+register_topic('status', 'status_update', snapshot=get_status_snapshot)
+register_topic('top_bar', 'top_bar_update', get_top_bar_data, interval=5, hidden_interval=30)
+register_topic('network', 'network_update', get_network_status, interval=5, hidden_interval=30)
+register_topic('analytics', 'analytics_update', get_analytics_summary, interval=10, hidden_interval=60)
+# Gate timing and calibration progress for Manual Control; a calibration takes about a minute.
+register_topic('gate_timing', 'gate_timing_update', get_gate_timing, interval=1)
+# Topics of optional subsystems exist only while the subsystem is on; subscribing to a missing topic is ignored.
+if features.is_enabled('diagnostics'):
+    register_topic('health', 'health_update', get_health_data, interval=2, hidden_interval=30)
+    # The pin read shares the Modbus bus with counting, so it never runs for hidden pages.
+    register_topic('pins', 'pin_update', get_pin_status, interval=2)
+if features.is_enabled('ble'):
+    register_topic('ble', 'ble_update', get_ble_status, interval=3, hidden_interval=15)
+
+
+def subscriber_count(name):
+    with subscribers_lock:
+        return len(subscribers.get(name, ()))
+
+
+def effective_interval(name):
+    """Returns the refresh interval for a topic right now, or None if it should not run."""
+    topic = topics[name]
+    with subscribers_lock:
+        members = subscribers.get(name, set())
+        if not members:
+            return None
+        if members & visible_sids:
+            return topic['interval']
+    return topic['hidden_interval']
+
+
+def _send_current(name, sid):
+    """Gives a new subscriber data right away instead of waiting for the next tick."""
+    topic = topics[name]
+    if topic['compute'] is None:
+        payload = topic['snapshot']() if topic['snapshot'] else None
+    elif topic['last_payload'] is not None and time.time() - topic['last_run'] < topic['interval']:
+        payload = topic['last_payload']
+    else:
+        payload = topic['compute']()
+        topic['last_payload'], topic['last_run'] = payload, time.time()
+    if payload is not None:
+        socketio.emit(topic['event'], binary_codec.encode(topic['event'], payload) if _is_binary(name, sid) else payload, to=sid)
+
+
+@socketio.on('subscribe')
+def handle_subscribe(data):
+    sid = request.sid
+    if (data or {}).get('encoding') == binary_codec.ENCODING and sid not in binary_sids and binary_codec.available():
+        # The key tables go out before the client joins any binary room.
+        socketio.emit('codec', binary_codec.describe(), to=sid)
+        with subscribers_lock:
+            binary_sids.add(sid)
+    for name in (data or {}).get('topics', []):
+        if name not in topics:
+            continue
+        join_room(topic_room(name, binary=_is_binary(name, sid)))
+        with subscribers_lock:
+            subscribers[name].add(sid)
+            if (data or {}).get('visible', True):
+                visible_sids.add(sid)
+            else:
+                visible_sids.discard(sid)
+        try:
+            _send_current(name, sid)
+        except Exception as e:
+            print(f"[Topics] Failed to send initial '{name}' payload: {e}")
+
+
+@socketio.on('unsubscribe')
+def handle_unsubscribe(data):
+    sid = request.sid
+    for name in (data or {}).get('topics', []):
+        if name not in topics:
+            continue
+        leave_room(topic_room(name, binary=_is_binary(name, sid)))
+        with subscribers_lock:
+            subscribers[name].discard(sid)
+
+
+@socketio.on('visibility')
+def handle_visibility(data):
+    sid = request.sid
+    with subscribers_lock:
+        if (data or {}).get('visible'):
+            visible_sids.add(sid)
+        else:
+            visible_sids.discard(sid)
+
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    sid = request.sid
+    with subscribers_lock:
+        for members in subscribers.values():
+            members.discard(sid)
+        visible_sids.discard(sid)
+        binary_sids.discard(sid)
+
+
+def topic_broadcaster():
+    """
+    GREEN thread that computes each due topic once and fans it out to its room.
+    Topics without subscribers cost nothing beyond a set lookup per tick.
+    """
+    print("[Topics] Starting topic broadcaster green thread...")
+    watchdog.register('topic-broadcaster', stall_after=10, critical=True)
+    while True:
+        watchdog.beat('topic-broadcaster')
+        now = time.time()
+        any_subscribers = False
+        for name, topic in topics.items():
+            interval = effective_interval(name)
+            if interval is not None or subscriber_count(name):
+                any_subscribers = True
+            if topic['compute'] is None or interval is None or now - topic['last_run'] < interval:
+                continue
+            try:
+                payload = topic['compute']()
+                topic['last_payload'], topic['last_run'] = payload, now
+                emit_topic(name, payload)
+            except Exception as e:
+                print(f"[ERROR in topic_broadcaster] {name}: {e}")
+                topic['last_run'] = now
+        socketio.sleep(TICK_SECONDS if any_subscribers else IDLE_TICK_SECONDS)
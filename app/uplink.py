@@ -0,0 +1,234 @@
+"""
+Store-and-forward uplink of count and batch events to the plant MES.
+The counting code only appends to an in-memory buffer (record()). The uplink
+thread moves buffered events into the SQLite outbox, then sends the oldest
+rows as gzip-compressed JSON batches over a kept-alive HTTP session (or MQTT
+when the endpoint is mqtt://host[:port]/topic). Rows are deleted only after
+the endpoint accepts them, so events survive WiFi outages and restarts.
+While no endpoint is set, events are dropped rather than stored.
+Failed sends back off exponentially with jitter; after an outage the backlog
+is drained in BATCH_SIZE chunks back-to-back.
+
+Try it locally with: python3 mes_standin.py, then set the endpoint to
+http://localhost:8099/ingest on the App Settings page.
+"""
+import gzip
+import json
+import random
+import socket
+import threading
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+from . import database, watchdog
+
+BATCH_SIZE = 500
+# How long events accumulate before a send when the outbox is not backlogged.
+SEND_INTERVAL = 5
+HTTP_TIMEOUT = 10
+BACKOFF_BASE_SECONDS = 2
+BACKOFF_MAX_SECONDS = 300
+# Oldest events are dropped beyond this so a months-long outage cannot fill the SD card.
+MAX_OUTBOX_ROWS = 500000
+MAX_BUFFERED_EVENTS = 20000
+
+UPLINK_DEFAULTS = {'url': '', 'token': '', 'device_id': socket.gethostname()}
+
+buffer = deque(maxlen=MAX_BUFFERED_EVENTS)
+wake = threading.Event()
+status = {
+    "connected": False, "last_success_at": None, "last_error": None,
+    "consecutive_failures": 0, "next_attempt_at": 0, "sent_total": 0,
+}
+http_session = None
+mqtt_client = None
+# Endpoint the open session/client belongs to.
+transport_url = None
+
+
+def record(event, **fields):
+    """Queues an event for the MES. Never blocks: the uplink thread does all I/O."""
+    fields.update(event=event, ts=time.time())
+    buffer.append(fields)
+    if len(buffer) >= BATCH_SIZE:
+        wake.set()
+
+
+def get_uplink_config():
+    return {key: database.get_setting(f'uplink_{key}', default) for key, default in UPLINK_DEFAULTS.items()}
+
+
+def get_public_uplink_config():
+    """The settings for the App Settings page: the token is never sent back, only whether one is saved."""
+    config = get_uplink_config()
+    config['token_set'] = bool(config.pop('token'))
+    return config
+
+
+def save_uplink_config(config):
+    """
+    Saves the endpoint settings. Raises ValueError for an unsupported URL.
+    A blank token keeps the saved one unless clear_token is set.
+    """
+    url = (config.get('url') or '').strip()
+    if url and urlparse(url).scheme not in ('http', 'https', 'mqtt'):
+        raise ValueError("Endpoint must start with http://, https:// or mqtt://")
+    config = dict(config, url=url)
+    if config.pop('clear_token', False):
+        config['token'] = ''
+    elif not (config.get('token') or '').strip():
+        config.pop('token', None)
+    for key in UPLINK_DEFAULTS:
+        if key in config:
+            database.set_setting(f'uplink_{key}', str(config[key]).strip())
+
+
+def retry_now():
+    """Ends the backoff after new settings; runs where the uplink thread does (counter_link 'uplink_retry')."""
+    # The uplink thread reconnects when it sees the new endpoint.
+    status['consecutive_failures'] = 0; status['next_attempt_at'] = 0
+    wake.set()
+
+
+def _persist_buffer():
+    """Moves buffered events into the outbox in one transaction."""
+    events = []
+    while buffer:
+        events.append(buffer.popleft())
+    if not events:
+        return
+    conn = database.get_db_connection()
+    try:
+        with conn:
+            conn.executemany("INSERT INTO uplink_outbox (created_at, body) VALUES (?, ?)",
+                             [(e['ts'], json.dumps(e, separators=(',', ':'))) for e in events])
+            conn.execute("DELETE FROM uplink_outbox WHERE id <= (SELECT MAX(id) FROM uplink_outbox) - ?", (MAX_OUTBOX_ROWS,))
+    except Exception:
+        buffer.extendleft(reversed(events))
+        raise
+    finally:
+        conn.close()
+
+
+def get_outbox_size():
+    conn = database.get_db_connection()
+    total = conn.execute("SELECT COUNT(*) FROM uplink_outbox").fetchone()[0]
+    conn.close()
+    return total
+
+
+def _reset_transport():
+    global http_session, mqtt_client, transport_url
+    if http_session is not None:
+        http_session.close(); http_session = None
+    if mqtt_client is not None:
+        try: mqtt_client.loop_stop(); mqtt_client.disconnect()
+        except Exception: pass
+        mqtt_client = None
+    transport_url = None
+    status['connected'] = False
+
+
+def _send_http(config, body):
+    global http_session
+    if http_session is None:
+        import requests
+        # One session per endpoint keeps the TCP/TLS connection alive between batches.
+        http_session = requests.Session()
+        http_session.headers.update({'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+    headers = {'Authorization': f"Bearer {config['token']}"} if config['token'] else {}
+    response = http_session.post(config['url'], data=body, headers=headers, timeout=HTTP_TIMEOUT)
+    if response.status_code >= 300:
+        raise ConnectionError(f"HTTP {response.status_code}: {response.text[:200]}")
+
+
+def _send_mqtt(config, body):
+    global mqtt_client
+    url = urlparse(config['url'])
+    if mqtt_client is None:
+        try:
+            import paho.mqtt.client as mqtt
+        except ImportError:
+            raise RuntimeError("MQTT endpoint requires the 'paho-mqtt' package.")
+        if hasattr(mqtt, 'CallbackAPIVersion'):
+            client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"box-counter-{config['device_id']}")
+        else:
+            client = mqtt.Client(client_id=f"box-counter-{config['device_id']}")
+        if url.username:
+            client.username_pw_set(url.username, url.password)
+        client.connect(url.hostname, url.port or 1883, keepalive=60)
+        client.loop_start()
+        mqtt_client = client
+    info = mqtt_client.publish(url.path.lstrip('/') or 'box-counter/events', body, qos=1)
+    info.wait_for_publish(timeout=HTTP_TIMEOUT)
+    if not info.is_published():
+        raise ConnectionError("MQTT publish was not acknowledged")
+
+
+def send_next_batch(config):
+    """Sends the oldest outbox rows. Returns how many were sent; raises if the endpoint rejected them."""
+    global transport_url
+    conn = database.get_db_connection()
+    try:
+        rows = conn.execute("SELECT id, body FROM uplink_outbox ORDER BY id LIMIT ?", (BATCH_SIZE,)).fetchall()
+        if not rows:
+            return 0
+        if transport_url != config['url']:
+            _reset_transport()
+        transport_url = config['url']
+        events = [dict(json.loads(row['body']), seq=row['id']) for row in rows]
+        payload = {"device_id": config['device_id'], "sent_at": time.time(), "events": events}
+        body = gzip.compress(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+        if config['url'].startswith('mqtt://'):
+            _send_mqtt(config, body)
+        else:
+            _send_http(config, body)
+        with conn:
+            conn.execute("DELETE FROM uplink_outbox WHERE id <= ?", (rows[-1]['id'],))
+        return len(rows)
+    finally:
+        conn.close()
+
+
+def _backoff_delay(failures):
+    """Exponential backoff with equal jitter, so a fleet of Pis does not retry in lockstep."""
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (failures - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def uplink_loop():
+    print("[Uplink] Starting store-and-forward uplink thread...")
+    # A send can take up to HTTP_TIMEOUT; anything far beyond that is a hang.
+    watchdog.register('uplink', stall_after=SEND_INTERVAL + 6 * HTTP_TIMEOUT)
+    while True:
+        watchdog.beat('uplink')
+        backlogged = False
+        # Cleared before the buffer is read, so a wake-up that arrives during this round is not lost.
+        wake.clear()
+        try:
+            config = get_uplink_config()
+            if not config['url']:
+                # No endpoint means the uplink is off: drop events instead of filling the outbox.
+                buffer.clear()
+            else:
+                _persist_buffer()
+                if time.time() >= status['next_attempt_at']:
+                    sent = send_next_batch(config)
+                    if sent:
+                        status.update(connected=True, last_success_at=time.time(), last_error=None, consecutive_failures=0)
+                        status['sent_total'] += sent
+                        backlogged = sent == BATCH_SIZE
+        except Exception as e:
+            status['consecutive_failures'] += 1
+            delay = _backoff_delay(status['consecutive_failures'])
+            status.update(connected=False, last_error=str(e), next_attempt_at=time.time() + delay)
+            print(f"[Uplink] Send failed ({e}); retrying in {delay:.0f}s.")
+            _reset_transport()
+        if not backlogged:
+            wake.wait(SEND_INTERVAL)
+
+
+def get_uplink_status():
+    config = get_uplink_config()
+    return dict(status, endpoint=config['url'], outbox_size=get_outbox_size(), buffered=len(buffer))
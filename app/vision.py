@@ -0,0 +1,239 @@
+"""
+Vision counting backend, for lines with a USB camera instead of through-beam
+sensors (setting 'sensor_backend' = 'vision').
+ffmpeg reads the camera (V4L2) or a recorded video and writes downscaled
+grayscale frames to a pipe. The reader thread reads each frame straight into
+one of a small ring of preallocated buffers that NumPy views without copying,
+and hands the slot index over a bounded queue; when the counting side falls
+behind, the oldest waiting frame is dropped instead of building up lag.
+Two bands across the belt act as virtual entry and exit sensors: a band is on
+while enough of its pixels differ from the learned background. Only the band
+pixels are compared and learned, so a frame costs a few thousand pixel
+operations. Each frame's pair of band states goes through
+hardware.process_sensor_sample(), the same state machine the Modbus poll loop
+feeds, so batches, close-ahead and carry-over work unchanged.
+Settings are kept as JSON in the 'vision' setting (see DEFAULTS).
+"""
+import json
+import queue
+from collections import deque
+import subprocess
+import threading
+import time
+
+import numpy as np
+
+from . import database, watchdog
+
+DEFAULTS = {
+    # /dev/videoN for a camera, anything else is a video file ffmpeg can read (replayed in real time).
+    "source": "/dev/video0", "width": 160, "height": 120, "fps": 30,
+    # Belt direction in the image: 'x' (left to right) or 'y' (top to bottom).
+    "axis": "x",
+    # Band centres and width as fractions of the image along the belt.
+    "entry_line": 0.35, "exit_line": 0.65, "band_width": 0.04,
+    # Grey-level difference that makes a pixel foreground, and the share of foreground
+    # pixels that switches a band on (it switches off below half of that).
+    "diff_threshold": 25, "occupancy": 0.3,
+    # Background learning rate per frame, and the frames learned at startup before counting.
+    "learn_rate": 0.02, "warmup_frames": 30,
+}
+# Frame slots: the queued frames, the one being counted and the one being read.
+QUEUE_FRAMES = 2
+RING_FRAMES = QUEUE_FRAMES + 2
+RESTART_DELAY = 2.0
+# A camera that stops delivering without exiting (unplugged mid-read) is restarted after this.
+FRAME_TIMEOUT = 3.0
+# ffmpeg's last log lines, kept for the error report when the source ends.
+FFMPEG_LOG_LINES = 5
+
+settings = dict(DEFAULTS)
+status = {"state": "stopped", "frames": 0, "dropped": 0, "restarts": 0, "last_error": None,
+          "entry_occupancy": 0.0, "exit_occupancy": 0.0, "process_ms_max": 0.0, "fps": 0.0}
+frames = queue.Queue(maxsize=QUEUE_FRAMES)
+ffmpeg_log = deque(maxlen=FFMPEG_LOG_LINES)
+
+
+def load_settings():
+    try:
+        settings.update(json.loads(database.get_setting('vision') or '{}'))
+    except ValueError:
+        print("[Vision] Saved vision settings are invalid; using defaults.")
+    return settings
+
+
+def ffmpeg_command(config, paced=True):
+    """Builds the ffmpeg command that writes config['width'] x config['height'] gray frames to stdout."""
+    command = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin']
+    if config['source'].startswith('/dev/video'):
+        command += ['-f', 'v4l2', '-framerate', str(config['fps']), '-i', config['source']]
+    else:
+        command += (['-re'] if paced else []) + ['-i', config['source']]
+    return command + ['-vf', f"fps={config['fps']},scale={config['width']}:{config['height']}",
+                      '-pix_fmt', 'gray', '-f', 'rawvideo', 'pipe:1']
+
+
+class FrameRing:
+    """Preallocated frame buffers, their (zero-copy) NumPy views and the list of free slots."""
+    def __init__(self, width, height, slots=RING_FRAMES):
+        self.buffers = [bytearray(width * height) for _ in range(slots)]
+        self.views = [np.frombuffer(buffer, dtype=np.uint8).reshape(height, width) for buffer in self.buffers]
+        self.memory = [memoryview(buffer) for buffer in self.buffers]
+        self.free = queue.SimpleQueue()
+        for slot in range(slots):
+            self.free.put(slot)
+
+    def read_into(self, stream):
+        """Reads one whole frame from `stream` into a free slot. Returns the slot, or None at end of stream."""
+        slot = self.free.get()
+        view, filled = self.memory[slot], 0
+        while filled < len(view):
+            count = stream.readinto(view[filled:])
+            if not count:
+                self.free.put(slot)
+                return None
+            filled += count
+        return slot
+
+    def release(self, slot):
+        self.free.put(slot)
+
+
+class BandDetector:
+    """Background subtraction over the entry and exit bands. process() allocates nothing per frame."""
+    def __init__(self, config):
+        self.config = config
+        length = config['width'] if config['axis'] == 'x' else config['height']
+        half = max(1, round(config['band_width'] * length / 2))
+        self.slices = []
+        for line in (config['entry_line'], config['exit_line']):
+            centre = min(length - half, max(half, round(line * length)))
+            band = slice(centre - half, centre + half)
+            self.slices.append((slice(None), band) if config['axis'] == 'x' else (band, slice(None)))
+        shape = np.empty((config['height'], config['width']), dtype=np.uint8)[self.slices[0]].shape
+        self.background = [np.zeros(shape, dtype=np.float32) for _ in self.slices]
+        self.diff = np.empty(shape, dtype=np.float32)
+        self.mask = np.empty(shape, dtype=bool)
+        self.still = np.empty(shape, dtype=bool)
+        self.on = [False, False]
+        self.occupancy = [0.0, 0.0]
+        self.seen = 0
+
+    def process(self, frame):
+        """Returns (entry_on, exit_on) for one gray frame."""
+        config = self.config
+        warming_up = self.seen < config['warmup_frames']
+        rate = 0.5 if warming_up else config['learn_rate']
+        for i, (band, background) in enumerate(zip(self.slices, self.background)):
+            pixels = frame[band]
+            if self.seen == 0:
+                background[...] = pixels
+            np.subtract(pixels, background, out=self.diff)
+            np.greater(np.abs(self.diff, out=self.diff), config['diff_threshold'], out=self.mask)
+            self.occupancy[i] = occupancy = np.count_nonzero(self.mask) / self.mask.size
+            self.on[i] = occupancy >= (config['occupancy'] / 2 if self.on[i] else config['occupancy'])
+            # Learn only where nothing is passing, so a slow box does not fade into the background.
+            np.subtract(pixels, background, out=self.diff)
+            self.diff *= rate
+            np.logical_not(self.mask, out=self.still)
+            np.add(background, self.diff, out=background, where=True if warming_up else self.still)
+        self.seen += 1
+        return (False, False) if warming_up else (self.on[0], self.on[1])
+
+
+def reader_loop(process, ring):
+    """Native thread: moves frames from ffmpeg into the ring; drops the oldest waiting frame when full."""
+    while True:
+        slot = ring.read_into(process.stdout)
+        if slot is None:
+            frames.put(None)
+            return
+        try:
+            frames.put_nowait(slot)
+        except queue.Full:
+            try:
+                ring.release(frames.get_nowait()); status['dropped'] += 1
+            except queue.Empty:
+                pass
+            frames.put_nowait(slot)
+
+
+def log_loop(process):
+    """Native thread: keeps reading ffmpeg's log, so a source that keeps warning cannot fill the pipe and stall ffmpeg."""
+    for line in process.stderr:
+        ffmpeg_log.append(line.decode(errors='replace').strip())
+
+
+def _start_source(ring):
+    command = ffmpeg_command(settings)
+    ffmpeg_log.clear()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+    threading.Thread(target=reader_loop, args=(process, ring), daemon=True, name='vision-reader').start()
+    log_thread = threading.Thread(target=log_loop, args=(process,), daemon=True, name='vision-ffmpeg-log')
+    log_thread.start()
+    status['state'] = "running"
+    return process, log_thread
+
+
+def vision_loop():
+    """Counts from camera frames; restarts ffmpeg if the source ends or the camera goes away."""
+    from . import hardware
+    print(f"[Vision] Counting from {settings['source']} at {settings['width']}x{settings['height']}, {settings['fps']} fps.")
+    watchdog.register('vision', stall_after=3, critical=True)
+    ring = FrameRing(settings['width'], settings['height'])
+    detector, process, log_thread = BandDetector(settings), None, None
+    window_start, window_frames = time.monotonic(), 0
+    last_frame, closed_by_fault = time.monotonic(), False
+    # Like a Modbus link fault: hold boxes back while the camera is blind, unless the line says 'hold'.
+    fault_gate_action = database.get_setting('modbus_fault_gate_action', hardware.MODBUS_CONFIG['fault_gate_action'])
+    while True:
+        watchdog.beat('vision')
+        if process is None:
+            try:
+                process, log_thread = _start_source(ring)
+            except OSError as e:
+                status.update(state="failed", last_error=str(e)); print(f"[Vision] Cannot start ffmpeg: {e}")
+                time.sleep(RESTART_DELAY); continue
+        try:
+            slot = frames.get(timeout=1)
+        except queue.Empty:
+            if time.monotonic() - last_frame > FRAME_TIMEOUT and process.poll() is None:
+                print(f"[Vision] No frame for {FRAME_TIMEOUT:.0f}s; restarting the source."); process.kill()
+            continue
+        if slot is None:
+            returncode = process.wait()
+            # The log reader finishes once ffmpeg has exited and its last lines are in.
+            log_thread.join(timeout=1)
+            error = ' | '.join(line for line in ffmpeg_log if line) or f"ffmpeg exited with {returncode}"
+            status.update(state="restarting", last_error=error); status['restarts'] += 1
+            print(f"[Vision] Frame source ended: {error}")
+            # Sensors are blind until the camera is back; treat both bands as clear.
+            hardware.process_sensor_sample(False, False)
+            with hardware.state['lock']: should_close = fault_gate_action == "close" and hardware.state['gate_status'] == "Open"
+            if should_close: hardware.close_gate(); closed_by_fault = True
+            process = None; detector = BandDetector(settings)
+            time.sleep(RESTART_DELAY); last_frame = time.monotonic(); continue
+        last_frame = time.monotonic()
+        if closed_by_fault and detector.seen >= settings['warmup_frames']:
+            closed_by_fault = False
+            with hardware.state['lock']: reopen = hardware.state['system_status'] in ["Ready to Count", "Counting"]
+            if reopen: print("[Vision] Camera is back; reopening the gate."); hardware.open_gate()
+        started = time.perf_counter()
+        entry_on, exit_on = detector.process(ring.views[slot])
+        ring.release(slot)
+        hardware.process_sensor_sample(entry_on, exit_on)
+        status['process_ms_max'] = max(status['process_ms_max'], (time.perf_counter() - started) * 1000)
+        status['frames'] += 1; window_frames += 1
+        status['entry_occupancy'], status['exit_occupancy'] = round(float(detector.occupancy[0]), 3), round(float(detector.occupancy[1]), 3)
+        if time.monotonic() - window_start >= 5:
+            status['fps'] = round(window_frames / (time.monotonic() - window_start), 1)
+            window_start, window_frames = time.monotonic(), 0
+
+
+def start():
+    load_settings()
+    threading.Thread(target=vision_loop, daemon=True, name='vision').start()
+
+
+def get_status():
+    return dict(status, source=settings['source'], process_ms_max=round(status['process_ms_max'], 2))
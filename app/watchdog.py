@@ -0,0 +1,115 @@
+"""
+Self-health monitor for the long-running loops.
+Each loop registers itself and calls beat() once per iteration. A supervisor
+running in a real OS thread (so it still runs if the eventlet hub is blocked)
+checks every loop's last beat. A loop that misses its deadline is reported as
+stalled. While every critical loop is healthy the supervisor pets the systemd
+watchdog (sd_notify WATCHDOG=1), so a stall there makes systemd restart the
+service even though the process has not crashed.
+Per-loop lag is served with the 'health' topic.
+"""
+import os
+import socket
+import time
+
+CHECK_INTERVAL = 1.0
+
+# name -> heartbeat record
+loops = {}
+# Unpatched sleep/socket for the supervisor thread (see start_supervisor).
+native = {"sleep": time.sleep, "socket": socket}
+
+
+def register(name, stall_after, critical=False):
+    """Declares a loop; it is stalled when it has not beaten for `stall_after` seconds."""
+    now = time.monotonic()
+    loops[name] = {"stall_after": stall_after, "critical": critical, "last_beat": now, "beats": 0,
+                   "max_gap": 0.0, "stalled": False, "stalls": 0}
+
+
+def beat(name):
+    """Called once per loop iteration. Cheap enough for the 50 ms sensor loop."""
+    loop = loops.get(name)
+    if loop is None:
+        return
+    now = time.monotonic()
+    gap = now - loop['last_beat']
+    if gap > loop['max_gap']:
+        loop['max_gap'] = gap
+    loop['last_beat'] = now
+    loop['beats'] += 1
+
+
+def get_loop_status():
+    now = time.monotonic()
+    return {name: {"lag_ms": round((now - loop['last_beat']) * 1000), "max_gap_ms": round(loop['max_gap'] * 1000),
+                   "stall_after_ms": int(loop['stall_after'] * 1000), "stalled": loop['stalled'],
+                   "stalls": loop['stalls'], "beats": loop['beats'], "critical": loop['critical']}
+            for name, loop in list(loops.items())}
+
+
+def sd_notify(message):
+    """Sends a notification to systemd if we were started with Type=notify. Returns False otherwise."""
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return False
+    if address.startswith('@'):
+        address = '\0' + address[1:]
+    try:
+        sock_module = native['socket']
+        with sock_module.socket(sock_module.AF_UNIX, sock_module.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall(message.encode('utf-8'))
+        return True
+    except OSError as e:
+        print(f"[Watchdog] sd_notify failed: {e}")
+        return False
+
+
+def check_loops():
+    """Updates the stalled flags. Returns True if every critical loop is healthy."""
+    now = time.monotonic()
+    healthy = True
+    for name, loop in list(loops.items()):
+        lag = now - loop['last_beat']
+        if lag > loop['stall_after']:
+            if not loop['stalled']:
+                loop['stalled'] = True; loop['stalls'] += 1
+                print(f"[Watchdog] Loop '{name}' stalled: no heartbeat for {lag:.1f}s.")
+            if loop['critical']:
+                healthy = False
+        elif loop['stalled']:
+            loop['stalled'] = False
+            print(f"[Watchdog] Loop '{name}' recovered.")
+    return healthy
+
+
+def supervisor_loop():
+    # systemd passes WatchdogSec as WATCHDOG_USEC; pet at half that interval.
+    watchdog_usec = int(os.environ.get('WATCHDOG_USEC', 0) or 0)
+    pet_interval = watchdog_usec / 2e6 if watchdog_usec else None
+    print(f"[Watchdog] Supervisor started ({'systemd watchdog every %.1fs' % pet_interval if pet_interval else 'no systemd watchdog'}).")
+    last_pet = 0
+    while True:
+        try:
+            healthy = check_loops()
+            if pet_interval and healthy and time.monotonic() - last_pet >= pet_interval:
+                sd_notify("WATCHDOG=1"); last_pet = time.monotonic()
+            elif not healthy:
+                stalled = ', '.join(n for n, l in loops.items() if l['stalled'] and l['critical'])
+                sd_notify(f"STATUS=Stalled: {stalled}")
+        except Exception as e:
+            print(f"[ERROR in watchdog supervisor]: {e}")
+        native['sleep'](CHECK_INTERVAL)
+
+
+def start_supervisor():
+    """Starts the supervisor in a native thread, even under eventlet monkey-patching."""
+    try:
+        import eventlet.patcher
+        native_threading = eventlet.patcher.original('threading')
+        native.update(sleep=eventlet.patcher.original('time').sleep, socket=eventlet.patcher.original('socket'))
+    except ImportError:
+        import threading as native_threading
+    native_threading.Thread(target=supervisor_loop, daemon=True, name='watchdog').start()
+    sd_notify("READY=1")
@@ -1,27 +1,48 @@
 """
 This module handles all WiFi-related tasks using the nmcli command-line tool.
+Scans and connection attempts run as background jobs so a slow nmcli call
+never holds up a request handler. Job progress is pushed to clients with
+the 'wifi_job_update' SocketIO event and the last scan result is cached.
 """
 import subprocess
+import threading
 import time
+import uuid
 
-def scan_wifi():
+from .extensions import socketio
+
+# Seconds to give the radio to finish a rescan before listing results.
+RESCAN_SETTLE_SECONDS = 5
+# How many finished jobs are kept for /api/wifi/jobs lookups.
+MAX_FINISHED_JOBS = 20
+
+jobs = {}
+jobs_lock = threading.Lock()
+active_jobs = {"scan": None, "connect": None}
+scan_cache = {"networks": [], "error": None, "scanned_at": None}
+
+def scan_wifi(progress=None):
     """
     Scans for WiFi networks using nmcli in a machine-readable "terse" mode
-    and parses the output robustly.
+    and parses the output robustly. `progress` is called with a percentage
+    while waiting for the hardware rescan to settle.
     """
     networks = []
     print("[WiFi] Starting WiFi network scan...")
     try:
         # Rescan to get the latest list from the hardware
         subprocess.run(['nmcli', 'dev', 'wifi', 'rescan'], timeout=10)
-        time.sleep(5)  # Allow time for the hardware to complete the scan
+        # Allow time for the hardware to complete the scan, yielding to other clients
+        for second in range(RESCAN_SETTLE_SECONDS):
+            if progress: progress(10 + 80 * second // RESCAN_SETTLE_SECONDS)
+            socketio.sleep(1)
 
         # --- THIS IS THE FIX ---
         # We now use '-t' for terse (machine-readable) mode and '-f' to specify fields.
         # nmcli will separate fields with a colon ':', which is much safer for parsing.
         command = ['nmcli', '-t', '-f', 'SSID,SIGNAL,SECURITY', 'dev', 'wifi', 'list', '--rescan', 'no']
         
-        result = subprocess.check_output(command, text=True).strip()
+        result = subprocess.check_output(command, text=True, timeout=10).strip()
         
         lines = result.split('\n')
         seen_ssids = set()
@@ -57,7 +78,7 @@ def scan_wifi():
                 print(f"[WiFi] Warning: Could not parse line '{line}'. Error: {e}")
                 continue
 
-    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, FileNotFoundError) as e:
         print(f"[WiFi] Error scanning WiFi: {e}")
         return {"error": str(e)}
 
@@ -88,4 +109,78 @@ def connect_to_wifi(ssid, password):
         return {"success": False, "message": "Connection attempt timed out."}
     except Exception as e:
         print(f"[WiFi] An exception occurred during WiFi connection: {e}")
-        return {"success": False, "message": f"An unexpected error occurred: {e}"}
\ No newline at end of file
+        return {"success": False, "message": f"An unexpected error occurred: {e}"}
+
+
+def _update_job(job_id, **changes):
+    with jobs_lock:
+        job = jobs[job_id]
+        job.update(changes)
+        job_data = dict(job)
+    socketio.emit('wifi_job_update', job_data)
+
+def _start_job(kind, target, *args):
+    """Starts a job of the given kind, or returns the one already in flight."""
+    with jobs_lock:
+        running_id = active_jobs[kind]
+        if running_id and jobs[running_id]['status'] == 'running':
+            return running_id
+        job_id = uuid.uuid4().hex[:12]
+        jobs[job_id] = {"job_id": job_id, "kind": kind, "status": "running", "progress": 0,
+                        "message": "Starting...", "result": None, "started_at": time.time()}
+        active_jobs[kind] = job_id
+        finished = [jid for jid, job in jobs.items() if job['status'] != 'running']
+        for old_id in finished[:-MAX_FINISHED_JOBS]:
+            del jobs[old_id]
+    socketio.start_background_task(target, job_id, *args)
+    return job_id
+
+def _run_scan_job(job_id):
+    # A job must always finish: one left 'running' would be joined by every later scan.
+    try:
+        _update_job(job_id, message="Scanning for networks...", progress=5)
+        result = scan_wifi(progress=lambda pct: _update_job(job_id, progress=pct))
+        if isinstance(result, dict) and 'error' in result:
+            scan_cache['error'] = result['error']
+            _update_job(job_id, status="failed", progress=100, message=result['error'])
+            return
+        scan_cache.update(networks=result, error=None, scanned_at=time.time())
+        _update_job(job_id, status="done", progress=100, message=f"Found {len(result)} networks.", result=result)
+    except Exception as e:
+        print(f"[WiFi] Scan job failed: {e}")
+        scan_cache['error'] = str(e)
+        _update_job(job_id, status="failed", progress=100, message=f"Scan failed: {e}")
+
+def _run_connect_job(job_id, ssid, password):
+    try:
+        _update_job(job_id, message=f"Connecting to {ssid}...", progress=10)
+        result = connect_to_wifi(ssid, password)
+        _update_job(job_id, status="done" if result['success'] else "failed", progress=100,
+                    message=result['message'], result=result)
+    except Exception as e:
+        print(f"[WiFi] Connect job failed: {e}")
+        _update_job(job_id, status="failed", progress=100, message=f"Connection failed: {e}")
+
+def start_scan_job():
+    """Starts a background scan. Concurrent requests share the scan in flight."""
+    return _start_job("scan", _run_scan_job)
+
+def start_connect_job(ssid, password):
+    """Starts a background connection attempt and returns its job ID."""
+    return _start_job("connect", _run_connect_job, ssid, password)
+
+def get_job(job_id):
+    with jobs_lock:
+        job = jobs.get(job_id)
+        return dict(job) if job else None
+
+def get_cached_scan():
+    """Returns the last scan result together with its age in seconds."""
+    scanned_at = scan_cache['scanned_at']
+    with jobs_lock:
+        scan_id = active_jobs['scan']
+        scanning = bool(scan_id and jobs.get(scan_id, {}).get('status') == 'running')
+    return {
+        "networks": scan_cache['networks'], "error": scan_cache['error'], "scanning": scanning,
+        "age_seconds": round(time.time() - scanned_at, 1) if scanned_at else None,
+    }
@@ -0,0 +1,208 @@
+"""
+Hot-path micro-benchmarks.
+
+Times the code that runs on every sensor window or status change, without
+any hardware attached:
+  - poll loop iteration: hardware.process_sensor_sample() for an idle window
+    and for a full box transit (four windows, one count, four broadcasts)
+  - status snapshot and its JSON serialization, and broadcast_status()
+  - the settings lookup (database.get_setting) against a scratch database
+  - 'status_update' emit fan-out to N simulated Socket.IO clients
+  - topic payload encoding: JSON vs the binary encoding (time and bytes)
+Each run is appended to benchmarks/results/hot_paths.jsonl and compared with
+the previous run, so a slower release shows up as a regression.
+
+Usage (from the project root, on the Pi):
+    python3 benchmarks/hot_paths.py
+    python3 benchmarks/hot_paths.py --clients 1 10 50 --threshold 15 --fail-on-regression
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_FILE = os.path.join(ROOT, 'benchmarks', 'results', 'hot_paths.jsonl')
+sys.path.insert(0, ROOT)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return 'unknown'
+
+
+def per_call_us(fn, number, repeat):
+    """Returns the median time of one call in microseconds over `repeat` rounds of `number` calls."""
+    rounds = timeit.Timer(fn).repeat(repeat=repeat, number=number)
+    return round(statistics.median(rounds) / number * 1e6, 2)
+
+
+class SilentBuzzer:
+    """Stands in for the gpiozero buzzer so a counted box does not need GPIO."""
+    def beep(self, **kwargs):
+        pass
+
+
+def bench_poll_loop(hardware, repeat):
+    """Idle windows are the common case; a transit is what happens for every box."""
+    from app import status_queue
+    hardware.buzzer = SilentBuzzer()
+    with hardware.state['lock']:
+        hardware.state.update(box_state="Idle", gate_status="Open", system_status="Counting",
+                              object_count=0, batch_target=10 ** 9, entry_sensor_status=False, exit_sensor_status=False)
+    idle = per_call_us(lambda: hardware.process_sensor_sample(False, False), 20000, repeat)
+
+    def transit():
+        hardware.process_sensor_sample(True, False)
+        hardware.process_sensor_sample(False, False)
+        hardware.process_sensor_sample(False, True)
+        hardware.process_sensor_sample(False, False)
+    # The count path prints one line per box; send it where journald's pipe would take it.
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        box = per_call_us(transit, 2000, repeat)
+    with status_queue.mutex:
+        status_queue.queue.clear()
+    return {"poll_idle_sample_us": idle, "poll_box_transit_us": box}
+
+
+def bench_status(hardware, repeat):
+    from app import status_queue
+
+    def snapshot():
+        with hardware.state['lock']:
+            return hardware.snapshot_state()
+    data = hardware.status_dict(snapshot())
+    result = {
+        "status_snapshot_us": per_call_us(snapshot, 20000, repeat),
+        "status_to_dict_us": per_call_us(lambda: hardware.status_dict(snapshot()), 20000, repeat),
+        "status_serialize_us": per_call_us(lambda: json.dumps(data), 20000, repeat),
+        "broadcast_status_us": per_call_us(hardware.broadcast_status, 20000, repeat),
+        "status_payload_bytes": len(json.dumps(data)),
+    }
+    with status_queue.mutex:
+        status_queue.queue.clear()
+    return result
+
+
+def bench_settings(database, repeat):
+    return {"get_setting_us": per_call_us(lambda: database.get_setting('batch_target'), 2000, repeat)}
+
+
+def bench_encoding(hardware, repeat):
+    """Per-update encode cost and size of the binary topic payloads against JSON (skipped without msgpack)."""
+    from app import binary_codec
+    if not binary_codec.available():
+        return {}
+    with hardware.state['lock']:
+        status = hardware.status_dict(hardware.snapshot_state())
+    health = {"cpu_usage": "42.5%", "cpu_temp": "51.3°C", "memory_usage": "37.0%", "uptime": "12:34:56",
+              "loops": {name: {"lag_ms": 12, "max_gap_ms": 60, "stall_after_ms": 2000, "stalled": False, "stalls": 0,
+                               "beats": 123456, "critical": True} for name in ('sensor-poll', 'status-broadcaster', 'topic-broadcaster', 'uplink')}}
+    result = {}
+    for event, payload in (('status_update', status), ('health_update', health)):
+        name = event.split('_')[0]
+        result[f"{name}_json_encode_us"] = per_call_us(lambda: json.dumps(payload), 20000, repeat)
+        result[f"{name}_binary_encode_us"] = per_call_us(lambda: binary_codec.encode(event, payload), 20000, repeat)
+        result[f"{name}_json_bytes"] = len(json.dumps(payload))
+        result[f"{name}_binary_bytes"] = len(binary_codec.encode(event, payload))
+    return result
+
+
+def bench_fan_out(hardware, client_counts, repeat):
+    """Emits one status update to N subscribed test clients, the way status_broadcaster does."""
+    from flask import Flask
+    from app.extensions import socketio
+    from app.topics import topic_room
+    flask_app = Flask('hot_paths')
+    socketio.init_app(flask_app, async_mode='threading')
+    with hardware.state['lock']:
+        data = hardware.status_dict(hardware.snapshot_state())
+    result = {}
+    for count in client_counts:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            clients = [socketio.test_client(flask_app) for _ in range(count)]
+        for client in clients:
+            client.emit('subscribe', {'topics': ['status']})
+            client.get_received()
+
+        def emit():
+            socketio.emit('status_update', data, to=topic_room('status'))
+        emits = max(20, 2000 // count)
+        result[f"emit_fan_out_{count}_us"] = per_call_us(emit, emits, repeat)
+        for client in clients:
+            client.disconnect()
+    return result
+
+
+def compare(result, previous, threshold):
+    """Prints each timing next to the previous run. Returns the names that got slower than `threshold` %."""
+    regressions = []
+    for name, value in result['timings'].items():
+        old = (previous or {}).get('timings', {}).get(name)
+        if not old or not name.endswith('_us'):
+            print(f"  {name:<28} {value:>10}")
+            continue
+        change = (value - old) / old * 100
+        flag = '  REGRESSION' if change > threshold else ''
+        print(f"  {name:<28} {value:>10}  (was {old}, {change:+.1f}%){flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def load_previous():
+    try:
+        with open(RESULTS_FILE) as f:
+            lines = [line for line in f if line.strip()]
+        return json.loads(lines[-1]) if lines else None
+    except (OSError, ValueError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='rounds per measurement; the median is kept')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 10, 50], help='simulated clients for the emit fan-out')
+    parser.add_argument('--threshold', type=float, default=20, help='percent slowdown reported as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true', help='exit with status 1 if anything regressed')
+    args = parser.parse_args()
+
+    from app import database
+    with tempfile.TemporaryDirectory() as scratch:
+        # Never touch the line's real database.
+        database.DATABASE_PATH = os.path.join(scratch, 'bench.db')
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            database.init_db()
+            database.init_db_defaults()
+        from app import hardware
+        timings = {}
+        timings.update(bench_poll_loop(hardware, args.repeat))
+        timings.update(bench_status(hardware, args.repeat))
+        timings.update(bench_settings(database, args.repeat))
+        timings.update(bench_encoding(hardware, args.repeat))
+        timings.update(bench_fan_out(hardware, args.clients, args.repeat))
+
+    result = {"timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'), "revision": git_revision(),
+              "python": sys.version.split()[0], "timings": timings}
+    previous = load_previous()
+    print(f"Hot paths at {result['revision']}" + (f" vs {previous['revision']}:" if previous else ":"))
+    regressions = compare(result, previous, args.threshold)
+
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    with open(RESULTS_FILE, 'a') as f:
+        f.write(json.dumps(result) + '\n')
+    print(f"Result appended to {os.path.relpath(RESULTS_FILE, ROOT)}")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Memory footprint per subsystem, for sizing a line against a fixed budget
+(e.g. a 512 MB Pi Zero 2 shared with the Chromium kiosk).
+
+Each memory profile (features.py) is loaded step by step in a fresh process:
+the eventlet and Flask stack, the app itself (web UI, scratch database), the
+line's hardware libraries, then every optional subsystem the profile leaves
+on, used once the way the running app would (BLE manager, WiFi jobs, the
+system health probe and profiler). For each step it reports the RSS added and
+the Python allocations still held (tracemalloc, measured in a second run so
+tracing does not inflate the RSS figures), plus the packages that ended up
+imported and the size of a status snapshot. The last step queues a burst of
+status broadcasts with no consumer: the status queue keeps only the newest.
+Each run is appended to benchmarks/results/memory.jsonl.
+
+Usage (from the project root, on the Pi; no hardware needed):
+    python3 benchmarks/memory.py
+    python3 benchmarks/memory.py --profiles low --budget 80
+"""
+import argparse
+import contextlib
+import gc
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_FILE = os.path.join(ROOT, 'benchmarks', 'results', 'memory.jsonl')
+sys.path.insert(0, ROOT)
+
+# Packages worth knowing about when they are loaded; the low profile should not load the optional ones.
+HEAVY_PACKAGES = ('eventlet', 'flask', 'flask_socketio', 'pymodbus', 'gpiozero', 'bleak', 'psutil', 'requests', 'msgpack', 'numpy')
+STATUS_BURST = 1000
+
+
+def rss_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def _load_web_app(profile, scratch):
+    from app import database
+    database.DATABASE_PATH = os.path.join(scratch, 'bench.db')
+    database.init_db()
+    database.set_setting('memory_profile', profile)
+    from app import create_app
+    create_app(mode='web')
+
+
+def _load_line_libraries():
+    import pymodbus.client
+    try:
+        import gpiozero
+    except ImportError:
+        pass
+
+
+def _use_ble():
+    from app import ble
+
+
+def _use_wifi():
+    from app import wifi
+
+
+def _use_diagnostics():
+    from app import profiler, system
+    system.get_system_health_info()
+
+
+def _status_burst():
+    from app import hardware, status_queue
+    for _ in range(STATUS_BURST):
+        hardware.broadcast_status()
+    return {"queued": status_queue.qsize()}
+
+
+def run_child(profile, trace):
+    """Loads one profile step by step in this process; returns the per-step measurements."""
+    import tracemalloc
+    if trace:
+        tracemalloc.start()
+    steps = []
+
+    def measure(name, fn):
+        rss, held = rss_kb(), tracemalloc.get_traced_memory()[0] if trace else 0
+        extra = fn() or {}
+        # Only what is still reachable counts; garbage waiting for the collector does not.
+        gc.collect()
+        steps.append(dict(extra, step=name, rss_kb=rss_kb(), added_kb=rss_kb() - rss,
+                          held_kb=round((tracemalloc.get_traced_memory()[0] - held) / 1024) if trace else None))
+
+    steps.append({"step": "interpreter", "rss_kb": rss_kb(), "added_kb": rss_kb(), "held_kb": None})
+    with tempfile.TemporaryDirectory() as scratch, open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        measure("eventlet", lambda: __import__('eventlet').monkey_patch())
+        measure("flask + socketio", lambda: (__import__('flask'), __import__('flask_socketio')) and None)
+        measure("app (web UI)", lambda: _load_web_app(profile, scratch))
+        measure("line (pymodbus, gpiozero)", _load_line_libraries)
+        from app import features, hardware
+        for name, use in (('ble', _use_ble), ('wifi', _use_wifi), ('diagnostics', _use_diagnostics)):
+            if features.is_enabled(name):
+                measure(name, use)
+        measure(f"status burst ({STATUS_BURST} broadcasts)", _status_burst)
+        with hardware.state['lock']:
+            snapshot = hardware.snapshot_state()
+    return {"profile": profile, "steps": steps, "enabled": dict(features.enabled),
+            "loaded": [name for name in HEAVY_PACKAGES if name in sys.modules],
+            "status_snapshot_bytes": sys.getsizeof(snapshot), "status_dict_bytes": sys.getsizeof(hardware.status_dict(snapshot))}
+
+
+def measure_profile(profile):
+    """Runs the profile in two fresh processes (RSS, then allocations) and merges the results."""
+    runs = []
+    for trace in (False, True):
+        command = [sys.executable, os.path.abspath(__file__), '--child', profile] + (['--trace'] if trace else [])
+        output = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+        if output.returncode != 0:
+            raise RuntimeError(f"profile '{profile}' failed:\n{output.stderr.strip()[-2000:]}")
+        runs.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    result, traced = runs
+    held = {step['step']: step['held_kb'] for step in traced['steps']}
+    for step in result['steps']:
+        step['held_kb'] = held.get(step['step'])
+    result['total_rss_kb'] = result['steps'][-1]['rss_kb']
+    return result
+
+
+def report(results):
+    names = [step['step'] for step in results[0]['steps']]
+    for result in results[1:]:
+        names += [step['step'] for step in result['steps'] if step['step'] not in names]
+    print(f"{'step':<34}" + ''.join(f"{r['profile'] + ': RSS added / held':>30}" for r in results))
+    for name in names:
+        cells = []
+        for result in results:
+            step = next((s for s in result['steps'] if s['step'] == name), None)
+            if step is None:
+                cells.append('off')
+            else:
+                held = '' if step['held_kb'] is None else f" / {step['held_kb']} KB"
+                cells.append(f"{step['added_kb'] / 1024:+.1f} MB{held}")
+        print(f"{name:<34}" + ''.join(f"{cell:>30}" for cell in cells))
+    print(f"{'total RSS':<34}" + ''.join(f"{r['total_rss_kb'] / 1024:>27.1f} MB" for r in results))
+    for result in results:
+        queued = next((s['queued'] for s in result['steps'] if 'queued' in s), None)
+        print(f"{result['profile']}: loaded {', '.join(result['loaded'])}; status snapshot {result['status_snapshot_bytes']} B "
+              f"(as a dict {result['status_dict_bytes']} B), {queued} queued after the burst")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', nargs='+', default=['standard', 'low'], help='memory profiles to measure')
+    parser.add_argument('--budget', type=float, help='MB of RSS a profile may use; exceeding it exits with status 1')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--trace', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(run_child(args.child, args.trace)))
+        return
+
+    results = [measure_profile(profile) for profile in args.profiles]
+    report(results)
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    with open(RESULTS_FILE, 'a') as f:
+        f.write(json.dumps({"timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'), "python": sys.version.split()[0],
+                            "results": results}) + '\n')
+    print(f"Result appended to {os.path.relpath(RESULTS_FILE, ROOT)}")
+    over = [r['profile'] for r in results if args.budget and r['total_rss_kb'] / 1024 > args.budget]
+    if over:
+        print(f"Over the {args.budget:.0f} MB budget: {', '.join(over)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Startup-time benchmark.
+
+Measures how long it takes to import the app package (with a per-module
+breakdown from `python -X importtime`) and, with --boot, how long a real
+`run.py` takes to reach "Ready to Count" according to /api/startup_profile.
+Each run is appended to benchmarks/results/startup.jsonl so boot time can be
+compared between releases.
+
+Usage (from the project root, on the Pi):
+    python3 benchmarks/startup_time.py            # import cost only
+    python3 benchmarks/startup_time.py --boot     # also boot run.py (stop conveyor.service first)
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_FILE = os.path.join(ROOT, 'benchmarks', 'results', 'startup.jsonl')
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return 'unknown'
+
+
+def measure_import(runs):
+    """Returns the median wall time of `import app` and the slowest modules from the last run."""
+    timings, modules = [], {}
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                                cwd=ROOT, capture_output=True, text=True)
+        timings.append((time.perf_counter() - started) * 1000)
+        modules = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or '|' not in line:
+                continue
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            if cumulative_us.strip().isdigit():
+                modules[name.strip()] = int(cumulative_us) / 1000
+    slowest = sorted(modules.items(), key=lambda item: item[1], reverse=True)[:15]
+    return {"median_ms": round(statistics.median(timings), 1), "runs_ms": [round(t, 1) for t in timings],
+            "slowest_modules_ms": [{"module": name, "ms": round(ms, 1)} for name, ms in slowest]}
+
+
+def measure_boot(timeout):
+    """Starts run.py and polls /api/startup_profile until the line is ready to count."""
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, 'run.py'], cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    profile, web_up_ms = None, None
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen('http://127.0.0.1:5000/api/startup_profile', timeout=1) as response:
+                    profile = json.load(response)
+                web_up_ms = web_up_ms or round((time.perf_counter() - started) * 1000, 1)
+                if any(p['phase'] == 'ready_to_count' for p in profile['phases']):
+                    break
+            except OSError:
+                pass
+            time.sleep(0.1)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return {"web_first_response_ms": web_up_ms, "profile": profile}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='import measurements to take')
+    parser.add_argument('--boot', action='store_true', help='also boot run.py and wait for Ready to Count')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for a full boot')
+    args = parser.parse_args()
+
+    result = {"timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'), "revision": git_revision(),
+              "python": sys.version.split()[0], "import": measure_import(args.runs)}
+    print(f"import app: median {result['import']['median_ms']} ms over {args.runs} runs")
+    for entry in result['import']['slowest_modules_ms'][:8]:
+        print(f"  {entry['ms']:>8.1f} ms  {entry['module']}")
+    if args.boot:
+        result['boot'] = measure_boot(args.timeout)
+        print(f"web server answered after {result['boot']['web_first_response_ms']} ms")
+        for phase in (result['boot']['profile'] or {}).get('phases', []):
+            print(f"  {phase['ms']:>8.1f} ms  {phase['phase']}")
+
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    with open(RESULTS_FILE, 'a') as f:
+        f.write(json.dumps(result) + '\n')
+    print(f"Result appended to {os.path.relpath(RESULTS_FILE, ROOT)}")
+
+
+if __name__ == '__main__':
+    main()
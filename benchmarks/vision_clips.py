@@ -0,0 +1,151 @@
+"""
+Offline validation and timing of the vision counting backend (app/vision.py).
+
+Runs recorded clips through the same ffmpeg decode, band detector and box
+state machine as the line, as fast as possible instead of in real time, and
+reports per clip:
+  - boxes counted (and PASS/FAIL against the expected count, if given)
+  - detector time per frame (mean, p99, max) and the frame rate it sustains,
+    which must stay above the camera's fps (30) on the Pi
+A synthetic clip (boxes drawn with NumPy, no ffmpeg needed) checks the
+detector when no recording is at hand. Each run is appended to
+benchmarks/results/vision_clips.jsonl.
+
+Usage (from the project root, on the Pi):
+    python3 benchmarks/vision_clips.py line3_morning.mp4:120 line3_backlit.mp4:87
+    python3 benchmarks/vision_clips.py --synthetic 50
+    python3 benchmarks/vision_clips.py clip.mp4 --config '{"entry_line": 0.3, "diff_threshold": 30}'
+"""
+import argparse
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_FILE = os.path.join(ROOT, 'benchmarks', 'results', 'vision_clips.jsonl')
+sys.path.insert(0, ROOT)
+
+
+class SilentBuzzer:
+    """Stands in for the gpiozero buzzer so a counted box does not need GPIO."""
+    def beep(self, **kwargs):
+        pass
+
+
+def ffmpeg_frames(path, config, ring):
+    """Yields frame views of a recorded clip, decoded by ffmpeg unpaced."""
+    from app import vision
+    process = subprocess.Popen(vision.ffmpeg_command(dict(config, source=path), paced=False),
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0)
+    try:
+        while True:
+            slot = ring.read_into(process.stdout)
+            if slot is None:
+                break
+            yield ring.views[slot]
+            ring.release(slot)
+    finally:
+        process.kill(); process.wait()
+
+
+def synthetic_frames(boxes, config, seed=1):
+    """Yields frames of dark boxes crossing a noisy belt, one box fully past the exit band before the next."""
+    rng = np.random.default_rng(seed)
+    height, width = config['height'], config['width']
+    belt = rng.integers(150, 190, size=(height, width), dtype=np.uint8)
+    frame = np.empty_like(belt)
+    box_length, speed = width // 6, max(1, width // 40)
+    for _ in range(config['warmup_frames']):
+        yield belt
+    for _ in range(boxes):
+        for position in range(-box_length, width + speed, speed):
+            np.copyto(frame, belt)
+            frame += rng.integers(0, 6, size=frame.shape, dtype=np.uint8)
+            frame[height // 4:3 * height // 4, max(0, position):max(0, position + box_length)] = 60
+            yield frame
+        for _ in range(5):
+            yield belt
+
+
+def run_clip(name, frames, config):
+    from app import hardware, vision
+    with hardware.state['lock']:
+        hardware.state.update(box_state="Idle", gate_status="Open", system_status="Counting", object_count=0,
+                              objects_on_belt=0, batch_target=10 ** 9, entry_sensor_status=False, exit_sensor_status=False)
+    detector, timings, started = vision.BandDetector(config), [], time.perf_counter()
+    # The count path prints one line per box; send it where journald's pipe would take it.
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for frame in frames:
+            frame_started = time.perf_counter()
+            entry_on, exit_on = detector.process(frame)
+            hardware.process_sensor_sample(entry_on, exit_on)
+            timings.append(time.perf_counter() - frame_started)
+    elapsed = time.perf_counter() - started
+    if not timings:
+        return {"clip": name, "frames": 0, "error": "no frames decoded"}
+    per_frame = np.array(timings) * 1000
+    with hardware.state['lock']:
+        counted = hardware.state['object_count']
+    return {"clip": name, "frames": len(timings), "counted": counted,
+            "detect_ms_mean": round(float(per_frame.mean()), 3), "detect_ms_p99": round(float(np.percentile(per_frame, 99)), 3),
+            "detect_ms_max": round(float(per_frame.max()), 3), "detect_fps": round(1000 / float(per_frame.mean())),
+            "pipeline_fps": round(len(timings) / elapsed)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('clips', nargs='*', help='recorded clips, optionally with the expected count: clip.mp4:120')
+    parser.add_argument('--synthetic', type=int, metavar='BOXES', help='also run a generated clip with this many boxes')
+    parser.add_argument('--config', default='{}', help="JSON overrides of the vision settings (see app/vision.py)")
+    args = parser.parse_args()
+    if not args.clips and not args.synthetic:
+        parser.error("give at least one clip or --synthetic")
+
+    from app import database
+    with tempfile.TemporaryDirectory() as scratch:
+        # Never touch the line's real database.
+        database.DATABASE_PATH = os.path.join(scratch, 'bench.db')
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            database.init_db()
+            database.init_db_defaults()
+        from app import hardware, vision
+        hardware.buzzer = SilentBuzzer()
+        config = dict(vision.DEFAULTS, **json.loads(args.config))
+        runs = []
+        if args.synthetic:
+            runs.append((f"synthetic:{args.synthetic}", synthetic_frames(args.synthetic, config), args.synthetic))
+        for clip in args.clips:
+            path, _, expected = clip.rpartition(':') if clip.rsplit(':', 1)[-1].isdigit() else (clip, '', '')
+            runs.append((path, ffmpeg_frames(path, config, vision.FrameRing(config['width'], config['height'])),
+                         int(expected) if expected else None))
+        results, failed = [], False
+        for name, frames, expected in runs:
+            result = run_clip(name, frames, config)
+            result['expected'] = expected
+            result['ok'] = expected is None or result.get('counted') == expected
+            failed |= not result['ok']
+            results.append(result)
+            verdict = '' if expected is None else ('  PASS' if result['ok'] else f"  FAIL (expected {expected})")
+            if 'error' in result:
+                print(f"{name}: {result['error']}")
+                continue
+            print(f"{name}: {result['counted']} boxes in {result['frames']} frames{verdict}\n"
+                  f"  detect {result['detect_ms_mean']} ms/frame (p99 {result['detect_ms_p99']}, max {result['detect_ms_max']}) "
+                  f"= {result['detect_fps']} fps; with decode {result['pipeline_fps']} fps (camera: {config['fps']} fps)")
+
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    with open(RESULTS_FILE, 'a') as f:
+        f.write(json.dumps({"timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'), "config": config, "results": results}) + '\n')
+    print(f"Result appended to {os.path.relpath(RESULTS_FILE, ROOT)}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
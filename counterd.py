@@ -0,0 +1,47 @@
+"""
+Counting daemon for the split install.
+Owns the Modbus bus, the GPIO outputs and the BLE printer, and runs the poll
+loop, batch handling, analytics and the MES uplink, without a web server in
+the same process. Status is published to shared memory and commands are
+taken over a Unix socket (see app/counter_link.py); start the UI with
+`run.py --split`. Pin the two processes to different cores so UI load cannot
+delay a sensor sample.
+
+Usage: python3 counterd.py [--cpus 3] [--nice -10] [--realtime [--rt-priority 50] [--rt-cpus 3]]
+"""
+import argparse
+import signal
+import sys
+import threading
+
+from app import counter_link, database, hardware, realtime, shared_state, start_line_tasks, system, watchdog
+
+
+def shutdown_handler(sig, frame):
+    print('--- Signal received, shutting down counting daemon... ---')
+    hardware.cleanup_resources()
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Box counter counting daemon")
+    parser.add_argument('--cpus', type=system.parse_cpu_list, help="pin the daemon to CPUs, e.g. 3")
+    parser.add_argument('--nice', type=int, help="nice level, e.g. -10 (needs CAP_SYS_NICE)")
+    parser.add_argument('--realtime', action='store_true', help="run the poll thread SCHED_FIFO with GC in slack time")
+    parser.add_argument('--rt-priority', type=int, default=50, help="SCHED_FIFO priority of the poll thread (1-99)")
+    parser.add_argument('--rt-cpus', type=system.parse_cpu_list, help="pin only the poll thread to CPUs, e.g. 3")
+    args = parser.parse_args()
+    system.pin_process(args.cpus, args.nice)
+    realtime.settings.update(enabled=args.realtime, priority=args.rt_priority, cpus=args.rt_cpus)
+    signal.signal(signal.SIGINT, shutdown_handler)
+    signal.signal(signal.SIGTERM, shutdown_handler)
+
+    database.init_db()
+    database.init_db_defaults()
+    shared_state.open_writer()
+    print(f"[Counterd] Publishing status at {shared_state.STATE_PATH}.")
+    threading.Thread(target=hardware.system_startup, daemon=True, name='hardware-startup').start()
+    start_line_tasks()
+    counter_link.start_command_server()
+    watchdog.start_supervisor()
+    counter_link.publish_loop()
@@ -0,0 +1,27 @@
+"""
+Starts the fleet aggregator: one dashboard and API for many counting Pis.
+Like run.py it applies the eventlet monkey-patch before anything else is
+imported. Devices can be passed on the command line (name=url) or added on
+the dashboard; they are remembered in the database either way.
+
+Usage: python3 fleet_run.py [--port 5050] [line1=http://192.168.1.50:5000 ...]
+"""
+import eventlet
+# Apply the patch first. This is the most critical step.
+eventlet.monkey_patch()
+
+import argparse
+from app import create_app
+from app.extensions import socketio
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fleet aggregator for box counter devices")
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('devices', nargs='*', help="devices to watch, as name=http://host:5000")
+    args = parser.parse_args()
+    seed = dict(d.split('=', 1) for d in args.devices)
+
+    print("[Fleet Run] Creating Flask application in fleet mode...")
+    app = create_app(mode='fleet', fleet_devices=seed)
+    print(f"--- Starting fleet aggregator on port {args.port} ---")
+    socketio.run(app, host='0.0.0.0', port=args.port, debug=False)
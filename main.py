@@ -7,7 +7,7 @@ import signal
 import os
 from app import create_app
 from app.extensions import socketio
-from app.hardware import system_startup, cleanup_resources, start_polling_thread
+from app.hardware import cleanup_resources
 
 def shutdown_handler(sig, frame):
     print('--- Signal received, initiating graceful shutdown... ---')
@@ -0,0 +1,77 @@
+"""
+Local stand-in for the plant MES, used to test the uplink without the real system.
+It accepts the gzip JSON batches POSTed by app/uplink.py, drops duplicates by
+(device_id, seq) and prints what arrived. --fail-rate and --down-for simulate
+a flaky or unreachable endpoint so backoff and backlog draining can be watched.
+
+Usage: python3 mes_standin.py [--port 8099] [--fail-rate 0.3] [--down-for 60]
+Then set the uplink endpoint to http://localhost:8099/ingest.
+"""
+import argparse
+import gzip
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+seen = set()
+totals = {"batches": 0, "events": 0, "duplicates": 0, "connections": 0}
+
+
+class IngestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps the connection open, so reuse by the uplink session is visible in the log.
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        totals['connections'] += 1
+
+    def _reply(self, code, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if time.time() < self.server.down_until or random.random() < self.server.fail_rate:
+            self._reply(503, {"error": "simulated outage"})
+            return
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        payload = json.loads(body)
+        new = 0
+        for event in payload['events']:
+            key = (payload['device_id'], event['seq'])
+            if key in seen:
+                totals['duplicates'] += 1
+            else:
+                seen.add(key); new += 1
+        totals['batches'] += 1; totals['events'] += new
+        print(f"[MES] {payload['device_id']}: {len(payload['events'])} events ({new} new, {len(body)} bytes raw) | "
+              f"totals {totals}")
+        self._reply(200, {"accepted": new})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument('--down-for', type=float, default=0.0, help="answer every request with 503 for this many seconds")
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(('0.0.0.0', args.port), IngestHandler)
+    server.fail_rate, server.down_until = args.fail_rate, time.time() + args.down_for
+    print(f"[MES] Stand-in listening on http://localhost:{args.port}/ingest")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -8,7 +8,8 @@ import eventlet
 eventlet.monkey_patch()
 
 # NOW that the system is patched, we can safely import and run the main app logic.
-from app import create_app
+import argparse
+from app import create_app, startup, system
 from app.extensions import socketio
 import signal
 from app.hardware import cleanup_resources
@@ -24,8 +25,16 @@ signal.signal(signal.SIGINT, shutdown_handler)
 signal.signal(signal.SIGTERM, shutdown_handler)
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Box counter web application")
+    parser.add_argument('--split', action='store_true', help="serve the UI only; counterd.py runs the line")
+    parser.add_argument('--cpus', type=system.parse_cpu_list, help="pin this process to CPUs, e.g. 0-2")
+    parser.add_argument('--nice', type=int, help="nice level for this process")
+    args = parser.parse_args()
+    system.pin_process(args.cpus, args.nice)
+
     print("[Run] Creating Flask application...")
-    app = create_app()
+    app = create_app(mode='web' if args.split else 'device')
     
     print("--- Starting application with Eventlet Web Server ---")
+    startup.mark('web_server_starting')
     socketio.run(app, host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file